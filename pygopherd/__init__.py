@@ -16,8 +16,10 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-__all__ = ['handlers', 'protocols', 'GopherExceptions',
+__all__ = ['cache', 'cacheTest', 'handlers', 'protocols', 'GopherExceptions',
 'GopherExceptionsTest', 'gopherentry', 'gopherentryTest',
            'logger', 'loggerTest',
-'fileext', 'fileextTest', 'pipe', 'pipeTest', 'initialization',
-           'initializationTest', 'testutil', 'version']
+'fileext', 'fileextTest', 'output', 'outputTest', 'pipe', 'pipeTest',
+           'initialization', 'initializationTest', 'servers', 'serversTest',
+           'settings', 'settingsTest', 'testutil',
+           'version']
@@ -0,0 +1,126 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: in-memory caches
+# Copyright (C) 2002-2019 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+import collections, threading, time
+
+class LRUCache:
+    """A bounded mapping for caching.  When full, the entries used least
+    recently are discarded first.
+
+    maxentries -- most entries to hold.  0 disables the cache; None
+    means no limit.
+    maxbytes -- if given, the most bytes to hold, as totalled from the
+    sizes passed to put().
+    maxage -- if given, entries older than this many seconds are
+    treated as missing.
+    onremove -- if given, called as onremove(key, value) for each entry
+    dropped from the cache, however that happens, once the cache's lock
+    is released.
+
+    All methods are safe to call from several threads at once."""
+
+    def __init__(self, maxentries = 1000, maxbytes = None, maxage = None,
+                 onremove = None):
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.onremove = onremove
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default = None):
+        removed = []
+        with self.lock:
+            try:
+                value, size, stamp = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.maxage != None and time.time() - stamp > self.maxage:
+                removed.append(self._remove(key))
+                self.misses += 1
+                value = default
+            else:
+                self.data.move_to_end(key)
+                self.hits += 1
+        self._notify(removed)
+        return value
+
+    def put(self, key, value, size = 0):
+        """Stores value under key.  size is its cost in bytes, counted
+        against maxbytes.  Values larger than maxbytes are not stored."""
+        if self.maxentries == 0 or \
+           (self.maxbytes != None and size > self.maxbytes):
+            return
+        removed = []
+        with self.lock:
+            if key in self.data:
+                removed.append(self._remove(key))
+            self.data[key] = (value, size, time.time())
+            self.bytes += size
+            while (self.maxentries != None and
+                   len(self.data) > self.maxentries) or \
+                  (self.maxbytes != None and self.bytes > self.maxbytes):
+                removed.append(self._remove(next(iter(self.data))))
+                self.evictions += 1
+        self._notify(removed)
+
+    def remove(self, key):
+        removed = []
+        with self.lock:
+            if key in self.data:
+                removed.append(self._remove(key))
+        self._notify(removed)
+
+    def _remove(self, key):
+        """Drops key and returns (key, value)."""
+        value, size, stamp = self.data.pop(key)
+        self.bytes -= size
+        return (key, value)
+
+    def _notify(self, removed):
+        if self.onremove != None:
+            for key, value in removed:
+                self.onremove(key, value)
+
+    def clear(self):
+        with self.lock:
+            removed = [(key, x[0]) for key, x in self.data.items()]
+            self.data.clear()
+            self.bytes = 0
+        self._notify(removed)
+
+    def __len__(self):
+        return len(self.data)
+
+    def getstats(self):
+        """Returns a dictionary with the number of entries and bytes
+        held, hits, misses, evictions and the hit rate."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.data),
+                    'bytes': self.bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hitrate': lookups and float(self.hits) / lookups}
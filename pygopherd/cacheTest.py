@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of in-memory caches
+# COPYRIGHT #
+# Copyright (C) 2002-2019 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+
+import unittest, time
+from pygopherd import cache
+
+class LRUCacheTestCase(unittest.TestCase):
+    def testlru(self):
+        c = cache.LRUCache(2)
+        c.put('a', 1)
+        c.put('b', 2)
+        self.assertEqual(c.get('a'), 1)
+        c.put('c', 3)
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual(c.get('a'), 1)
+        self.assertEqual(c.get('c'), 3)
+        stats = c.getstats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def testmaxbytes(self):
+        c = cache.LRUCache(10, maxbytes = 10)
+        c.put('a', 'x', 6)
+        c.put('b', 'y', 6)
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.getstats()['bytes'], 6)
+        c.put('c', 'z', 11)
+        self.assertEqual(c.get('c'), None)
+        self.assertEqual(c.get('b'), 'y')
+
+    def testmaxage(self):
+        c = cache.LRUCache(10, maxage = 0.05)
+        c.put('a', 1)
+        self.assertEqual(c.get('a'), 1)
+        time.sleep(0.1)
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(len(c), 0)
+
+    def testonremove(self):
+        removed = []
+        c = cache.LRUCache(2, onremove = lambda k, v: removed.append((k, v)))
+        c.put('a', 1)
+        c.put('b', 2)
+        c.put('a', 3)
+        c.put('c', 4)
+        c.remove('a')
+        c.clear()
+        self.assertEqual(removed, [('a', 1), ('b', 2), ('a', 3), ('c', 4)])
+
+    def testdisabled(self):
+        c = cache.LRUCache(0)
+        c.put('a', 1)
+        self.assertEqual(c.get('a'), None)
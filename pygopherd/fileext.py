@@ -16,10 +16,19 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-import mimetypes
+import mimetypes, os.path, functools
+from pygopherd import settings
 
 typemap = {}
 
+# Reverse suffix tries over typemap, one per mimetype, for extstrip.
+typetries = {}
+
+# Memoised results of lookup() and gettype(), built up as files are seen.
+lookupcache = {}
+typecache = {}
+maxcached = 4096
+
 def extcmp(x, y):
     if x.count('.') > y.count('.'):
         return 1
@@ -29,20 +38,86 @@ def extcmp(x, y):
         return 1
     if len(x) < len(y):
         return -1
-    return cmp(x, y)
+    return (x > y) - (x < y)
 
 def extstrip(file, filetype):
     """Strips off the extension from file given type and returns the result.
     Returns file unmodified if no action is possible."""
-    if not (filetype and filetype in typemap):
+    if not (filetype and filetype in typetries):
         return file
-    for possible in typemap[filetype]:
-        if file.endswith(possible):
-            extindex = file.rfind(possible)
-            return file[0:extindex]
-    return file
+    node = typetries[filetype]
+    extindex = None
+    index = len(file)
+    # Walk the trie from the end of the name; the last terminal reached
+    # is the longest extension that matches.
+    while index > 0:
+        index -= 1
+        node = node.get(file[index])
+        if node == None:
+            break
+        if None in node:
+            extindex = index
+    if extindex == None:
+        return file
+    return file[0:extindex]
+
+def getextkey(filename):
+    """Returns the last two extensions of filename.  Those are all
+    mimetypes.guess_type ever looks at: a suffix, possibly preceded
+    by an encoding, possibly preceded by a type."""
+    root, last = os.path.splitext(os.path.basename(filename))
+    return (os.path.splitext(root)[1], last)
+
+def memoise(cache, key, value):
+    if len(cache) >= maxcached:
+        cache.clear()
+    cache[key] = value
+    return value
+
+def gettype(mimetype, config):
+    """Returns the gopher0 type for mimetype, from the mapping in
+    the config file."""
+    s = settings.get(config)
+    key = (s, mimetype)
+    try:
+        return typecache[key]
+    except KeyError:
+        pass
+    gophertype = '0'
+    for mimepatt, candidate in s.mapping:
+        if mimepatt.match(mimetype):
+            gophertype = candidate
+            break
+    return memoise(typecache, key, gophertype)
+
+def lookup(filename, config):
+    """Returns (mimetype, encoding, encodedmimetype, gophertype) for a
+    file named filename.  A file with an encoding is
+    application/octet-stream, and a file of unknown type gets the
+    default mimetype from the config file.  The result is memoised by
+    the file's extensions."""
+    s = settings.get(config)
+    extkey = getextkey(filename)
+    key = (s, extkey)
+    try:
+        return lookupcache[key]
+    except KeyError:
+        pass
+    mimetype, encoding = mimetypes.guess_type('x' + ''.join(extkey),
+                                              strict = 0)
+    encodedmimetype = None
+    if encoding:
+        encodedmimetype = mimetype
+        mimetype = 'application/octet-stream'
+    mimetype = mimetype or s.defaultmimetype
+    return memoise(lookupcache, key, (mimetype, encoding, encodedmimetype,
+                                      gettype(mimetype, config)))
 
 def init():
+    typemap.clear()
+    typetries.clear()
+    lookupcache.clear()
+    typecache.clear()
     for fileext, filetype in list(mimetypes.types_map.items()):
         extlist = []
         if filetype in typemap:
@@ -60,9 +135,15 @@ def init():
                 baselist.append(shortsuff)
 
         extlist.extend(baselist)
-        extlist.sort(extcmp)
+        extlist.sort(key = functools.cmp_to_key(extcmp))
         extlist.reverse()
         typemap[filetype] = extlist
 
-
-        
+    for filetype, extlist in list(typemap.items()):
+        root = {}
+        for possible in extlist:
+            node = root
+            for char in reversed(possible):
+                node = node.setdefault(char, {})
+            node[None] = 1
+        typetries[filetype] = root
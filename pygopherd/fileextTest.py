@@ -34,3 +34,24 @@ class FileExtTestCase(unittest.TestCase):
         self.assertTrue('.txt.gz' in fileext.typemap['text/plain'])
         self.assertTrue(not ('.html' in fileext.typemap['text/plain']))
         
+    def testextstrip(self):
+        self.assertEqual(fileext.extstrip('foo.txt', 'text/plain'), 'foo')
+        self.assertEqual(fileext.extstrip('foo.txt.gz', 'text/plain'), 'foo')
+        self.assertEqual(fileext.extstrip('foo.html', 'text/plain'),
+                         'foo.html')
+        self.assertEqual(fileext.extstrip('foo.txt', None), 'foo.txt')
+        self.assertEqual(fileext.extstrip('foo.txt', 'foo/bar'), 'foo.txt')
+
+    def testlookup(self):
+        config = testutil.getconfig()
+        self.assertEqual(fileext.lookup('/dir/foo.txt', config),
+                         ('text/plain', None, None, '0'))
+        self.assertEqual(fileext.lookup('/foo.txt.gz', config),
+                         ('application/octet-stream', 'gzip', 'text/plain',
+                          '9'))
+        self.assertEqual(fileext.lookup('/dir.txt/README', config),
+                         ('text/plain', None, None, '0'))
+        self.assertEqual(fileext.lookup('/foo.gif', config)[3], 'g')
+        # Memoised by extension, not by name.
+        assert fileext.lookup('/bar.gif', config) is \
+               fileext.lookup('/foo.gif', config)
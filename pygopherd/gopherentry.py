@@ -19,14 +19,56 @@
 import socketserver
 import re
 import os, stat, os.path, mimetypes, urllib.request, urllib.parse, urllib.error
-
-mapping = None
-eaexts = None
+import sys, types
+from pygopherd import settings, cache
+import pygopherd.fileext
+
+# Extended attributes read from sidecar files, keyed by the state of
+# the file they came from.
+eacache = None
+
+# Fields shared by many entries; loaded listings intern them.
+internedfields = ('type', 'mimetype', 'encodedmimetype', 'encoding',
+                  'realencoding', 'host', 'language')
+
+def internvalue(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+# The extended attributes of an entry that has none.  Shared by all
+# such entries; setea replaces it with a real dict.
+emptyea = types.MappingProxyType({})
+
+def getslots(cls):
+    """Returns the names of all the slots of cls and its bases."""
+    slots = []
+    for base in reversed(cls.__mro__):
+        slots.extend(base.__dict__.get('__slots__', ()))
+    return slots
+
+# The slots of each class, as sets, by class.
+slotsets = {}
+
+def getslotset(cls):
+    """Returns the names of all the slots of cls and its bases, as a
+    set."""
+    slots = slotsets.get(cls)
+    if slots == None:
+        slots = slotsets[cls] = frozenset(getslots(cls))
+    return slots
 
 class GopherEntry:
     """The entry object for Gopher.  It holds information about each
     Gopher object."""
 
+    # Whole listings of these are held in memory, so keep them small.
+    __slots__ = ('selector', 'config', 'fspath', 'type', 'name', 'host',
+                 'port', 'mimetype', 'encodedmimetype', 'size', 'encoding',
+                 'realencoding', 'populated', 'language', 'ctime', 'mtime',
+                 'num', 'gopherpsupport', 'ea')
+
     def __init__(self, selector, config):
         """Initialize object based on a selector and config."""
         self.selector = selector        # Gopher path to file
@@ -40,15 +82,43 @@ class GopherEntry:
         self.encodedmimetype = None     # Real MIME type if encoded.
         self.size = None                # Size
         self.encoding = None            # Encoding type
+        self.realencoding = None        # Encoding as sent, for handlers
         self.populated = 0              # Whether or not it's been populated
         self.language = None            # Language
         self.ctime = None               # Creation date
         self.mtime = None               # Modification date
         self.num = 0                    # Number in menu
         self.gopherpsupport = 0         # Supports gopher+
-        self.ea = {}                    # Extended attributes -- Gopher+
+        self.ea = emptyea               # Extended attributes -- Gopher+
                                         # Abstract, etc.
 
+    def __getstate__(self):
+        # The config is not pickled; whoever loads us must set it again.
+        state = {}
+        for name in getslots(type(self)):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        state['config'] = None
+        state['ea'] = dict(self.ea)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            if name in internedfields:
+                value = internvalue(value)
+            setattr(self, name, value)
+        if not self.ea:
+            self.ea = emptyea
+
+    def __copy__(self):
+        entry = type(self).__new__(type(self))
+        for name in getslots(type(self)):
+            if hasattr(self, name):
+                setattr(entry, name, getattr(self, name))
+        if entry.ea is not emptyea:
+            entry.ea = dict(entry.ea)
+        return entry
+
     def populatefromvfs(self, vfs, selector):
         self.populatefromfs(selector, statval = vfs.stat(selector),
                             vfs = vfs)
@@ -140,50 +210,39 @@ class GopherEntry:
 
         self.size = self.size or statval[6]
 
-        mimetype, encoding = mimetypes.guess_type(self.selector, strict = 0)
+        mimetype, encoding, encodedmimetype, gophertype = \
+                  pygopherd.fileext.lookup(self.selector, self.config)
 
+        if self.mimetype and self.mimetype != mimetype:
+            gophertype = None
+        self.mimetype = self.mimetype or mimetype
         if encoding:
-            self.mimetype = self.mimetype or 'application/octet-stream'
             self.encoding = self.encoding or encoding
-            self.encodedmimetype = self.encodedmimetype or mimetype
-        else:
-            self.mimetype = self.mimetype or mimetype
+            self.encodedmimetype = self.encodedmimetype or encodedmimetype
 
-        # Did we get no mime type at all?  Fall back to a default.
-
-        if not self.mimetype:
-            self.mimetype = self.config.get("GopherEntry", "defaultmimetype")
-
-        self.type = self.type or self.guesstype()
+        self.type = self.type or gophertype or self.guesstype()
 
     def guesstype(self):
-        global mapping
-        if not mapping:
-            mapping = eval(self.config.get("GopherEntry", "mapping"))
-        for maprule in mapping:
-            if re.match(maprule[0], self.mimetype):
-                return maprule[1]
-        return '0'
+        return pygopherd.fileext.gettype(self.mimetype, self.config)
 
     def handleeaext(self, selector, vfs):
         """Handle getting extended attributes from the filesystem."""
-        global eaexts
-        if eaexts == None:
-            eaexts = eval(self.config.get("GopherEntry", "eaexts"))
         if vfs == None:
             from pygopherd.handlers.base import VFS_Real
             vfs = VFS_Real(self.config)
 
-        for extension, blockname in list(eaexts.items()):
+        for extension, blockname in settings.get(self.config).eaexts:
             if blockname in self.ea:
                 continue
+            # Cheap when the VFS already holds the directory's listing,
+            # as it does while a directory is being listed.
+            if not vfs.exists(selector + extension):
+                continue
             try:
-                rfile = vfs.open(selector + extension, "rb")
-                self.setea(blockname, b"\n".join(
-                           [x.rstrip() for x in rfile.readlines(20480)]))
+                self.setea(blockname, readeafile(vfs, selector + extension))
             except IOError:
                 pass
-                         
+
 
     def getselector(self, default = None):
         if self.selector == None:
@@ -307,12 +366,42 @@ class GopherEntry:
             return self.ea[name]
         return default
 
+    def geteatext(self, name, default = None):
+        """Like getea, but always returns a string.  Attributes read
+        from files are bytes; they are decoded as cp437, like requests,
+        so that they go back out to the client unchanged."""
+        value = self.getea(name, default)
+        if isinstance(value, bytes):
+            return value.decode('cp437')
+        return value
+
     def geteadict(self):
         return self.ea
 
     def setea(self, name, value):
+        if self.ea is emptyea:
+            self.ea = {}
         self.ea[name] = value
 
+def readeafile(vfs, selector):
+    """Returns the contents of the sidecar file selector as an extended
+    attribute.  Results are cached until the file changes."""
+    global eacache
+    if eacache == None:
+        eacache = cache.LRUCache(10000)
+    statresult = vfs.stat(selector)
+    key = (vfs.getcachekey(), selector, statresult[stat.ST_SIZE],
+           getattr(statresult, 'st_mtime_ns', statresult[stat.ST_MTIME]))
+    value = eacache.get(key)
+    if value == None:
+        rfile = vfs.open(selector, "rb")
+        try:
+            value = b"\n".join([x.rstrip() for x in rfile.readlines(20480)])
+        finally:
+            rfile.close()
+        eacache.put(key, value)
+    return value
+
 def getinfoentry(text, config):
     entry = GopherEntry('fake', config)
     entry.name = text
@@ -320,3 +409,79 @@ def getinfoentry(text, config):
     entry.port = 0
     entry.type = 'i'
     return entry
+
+class EntryList:
+    """A directory listing, stored as one column per field rather than
+    one GopherEntry per file.  Fields that are the same for every entry
+    are stored once.  Entries are made afresh as the list is read, so
+    changing them does not change the list."""
+
+    __slots__ = ('config', 'length', 'classes', 'columns', 'constants')
+
+    def __init__(self, entries, config):
+        self.config = config
+        entries = list(entries)
+        self.length = len(entries)
+        self.classes = tuple([type(x) for x in entries])
+        self.columns = {}
+        self.constants = {}
+        names = []
+        for cls in set(self.classes):
+            names.extend([x for x in getslots(cls)
+                          if x != 'config' and x not in names])
+        for name in names:
+            column = tuple([getattr(x, name, None) for x in entries])
+            if column and column.count(column[0]) == len(column):
+                self.constants[name] = column[0]
+            else:
+                self.columns[name] = column
+
+    def __getstate__(self):
+        # Like the entries, the config is not pickled.
+        columns = self.columns.copy()
+        if 'ea' in columns:
+            columns['ea'] = tuple([dict(x) for x in columns['ea']])
+        constants = self.constants.copy()
+        if 'ea' in constants:
+            constants['ea'] = dict(constants['ea'])
+        return (self.classes, columns, constants)
+
+    def __setstate__(self, state):
+        self.config = None
+        self.classes, self.columns, self.constants = state
+        self.length = len(self.classes)
+        for name, column in list(self.columns.items()):
+            if name in internedfields:
+                self.columns[name] = tuple([internvalue(x) for x in column])
+            if name == 'ea':
+                self.columns[name] = tuple([x or emptyea for x in column])
+        if 'ea' in self.constants and not self.constants['ea']:
+            self.constants['ea'] = emptyea
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("EntryList index out of range")
+        cls = self.classes[index]
+        entry = cls.__new__(cls)
+        entry.config = self.config
+        # Entries of different classes may be mixed, each with its own
+        # slots.
+        slots = getslotset(cls)
+        for name, value in self.constants.items():
+            if name in slots:
+                setattr(entry, name, value)
+        for name, column in self.columns.items():
+            if name in slots:
+                setattr(entry, name, column[index])
+        if entry.ea is not emptyea:
+            entry.ea = dict(entry.ea)
+        return entry
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
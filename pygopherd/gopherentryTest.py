@@ -21,7 +21,8 @@
 
 import unittest, os, stat, re
 from pygopherd import testutil
-from pygopherd.gopherentry import GopherEntry
+from pygopherd.gopherentry import GopherEntry, EntryList
+import pickle, copy
 
 fields = ['selector', 'config', 'fspath', 'type', 'name', 'host', 'port',
           'mimetype', 'encodedmimetype', 'size', 'encoding',
@@ -285,3 +286,51 @@ class GopherEntryTestCase(unittest.TestCase):
                               entry.geturl())
 
         
+
+    def testslots(self):
+        entry = GopherEntry('/foo', self.config)
+        other = GopherEntry('/bar', self.config)
+        assert not hasattr(entry, '__dict__')
+        assert entry.geteadict() is other.geteadict()
+        entry.setea('ABSTRACT', 'An abstract')
+        self.assertEqual(entry.getea('ABSTRACT'), 'An abstract')
+        self.assertEqual(other.getea('ABSTRACT'), None)
+
+        copied = copy.copy(entry)
+        self.assertEqual(copied.config, self.config)
+        copied.setea('ABSTRACT', 'Changed')
+        self.assertEqual(entry.getea('ABSTRACT'), 'An abstract')
+
+        loaded = pickle.loads(pickle.dumps(entry))
+        self.assertEqual(loaded.config, None)
+        self.assertEqual(loaded.getselector(), '/foo')
+        self.assertEqual(loaded.getea('ABSTRACT'), 'An abstract')
+        loaded = pickle.loads(pickle.dumps(other))
+        assert loaded.geteadict() is other.geteadict()
+
+    def testentrylist(self):
+        entries = []
+        for selector in ['/testfile.txt', '/ziptest', '/testdata.zip']:
+            entry = GopherEntry(selector, self.config)
+            entry.populatefromfs(self.root + selector)
+            entries.append(entry)
+        entries[0].setea('ABSTRACT', 'An abstract')
+        entrylist = EntryList(entries, self.config)
+        self.assertEqual(len(entrylist), 3)
+        # Fields every entry shares are stored once.
+        self.assertEqual(entrylist.constants['host'], None)
+        assert not 'host' in entrylist.columns
+
+        entrylist = pickle.loads(pickle.dumps(entrylist))
+        entrylist.config = self.config
+        for entry, loaded in zip(entries, entrylist):
+            for field in fields:
+                self.assertEqual(getattr(entry, field),
+                                 getattr(loaded, field))
+            self.assertEqual(entry.geteadict(), loaded.geteadict())
+        self.assertEqual(entrylist[-1].getselector(), '/testdata.zip')
+        self.assertRaises(IndexError, lambda: entrylist[3])
+
+        # Entries are made afresh each time.
+        entrylist[0].setea('ABSTRACT', 'Changed')
+        self.assertEqual(entrylist[0].getea('ABSTRACT'), 'An abstract')
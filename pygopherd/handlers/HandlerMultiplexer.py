@@ -16,29 +16,31 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from pygopherd import GopherExceptions, logger
+from pygopherd import GopherExceptions, logger, settings, cache
 from pygopherd.handlers import *
-import os, re
+from stat import *
+import os, re, time
 
-handlers = None
-rootpath = None
+# Maps a selector and the state of the file it names to the class of
+# the handler that took it.  Shared by all configs; the settings are
+# part of the key.
+handlercache = None
+
+# Maps a selector that named nothing, and that no handler would take,
+# to the mtime of its parent directory at the time.
+negativecache = None
 
 def getHandler(selector, searchrequest, protocol, config, handlerlist = None,
-               vfs = None):
+               vfs = None, statresult = None):
     """Called without handlerlist specified, uses the default as listed
-    in config."""
-    global handlers, rootpath
-
+    in config.  Callers that have already stat'd the selector can pass
+    the result as statresult."""
     if vfs == None:
-        from pygopherd.handlers.base import VFS_Real
-        vfs = VFS_Real(config)
+        from pygopherd.handlers.base import VFS_Real, VFS_Cached
+        vfs = VFS_Cached(config, VFS_Real(config))
 
-    if not handlers:
-        handlers = eval(config.get("handlers.HandlerMultiplexer",
-                                   "handlers"))
-        rootpath = config.get("pygopherd", "root")
     if handlerlist == None:
-        handlerlist = handlers
+        handlerlist = settings.get(config).handlers
 
     # SECURITY: assert that our absolute path is within the absolute
     # path of the site root.
@@ -49,15 +51,83 @@ def getHandler(selector, searchrequest, protocol, config, handlerlist = None,
     #          [selector, "Requested document is outside the server root",
     #           protocol]
 
-    statresult = None
-    try:
-        statresult = vfs.stat(selector)
-    except OSError:
-        pass
+    if statresult == None:
+        try:
+            statresult = vfs.stat(selector)
+        except OSError:
+            pass
+
+    negativekey = None
+    if statresult == None:
+        negativekey = (vfs.getcachekey(), selector, tuple(handlerlist),
+                       settings.get(config))
+        parentmtime = getparentmtime(selector, vfs)
+        if getnegativecache(config).get(negativekey, notfound) == parentmtime:
+            raise GopherExceptions.FileNotFound([selector, "no handler found",
+                                                 protocol])
+
+    cachekey = None
+    if statresult:
+        cachekey = getcachekey(selector, vfs, statresult, handlerlist, config)
+        handler = gethandlercache(config).get(cachekey)
+        if handler:
+            # The winner's own check still runs, since handlers set up
+            # their per-request state there.
+            htry = handler(selector, searchrequest, protocol, config,
+                           statresult, vfs)
+            if htry.isrequestforme():
+                return htry.gethandler()
+
     for handler in handlerlist:
+        if not handler.iscandidate(selector, statresult):
+            continue
         htry = handler(selector, searchrequest, protocol, config, statresult,
                        vfs)
         if htry.isrequestforme():
+            if cachekey:
+                gethandlercache(config).put(cachekey, handler)
             return htry.gethandler()
-    
+
+    # A directory modified in the last moment could be modified again
+    # without its mtime visibly changing, so we wait for it to settle.
+    if negativekey and \
+       (parentmtime == None or time.time() - parentmtime > 2):
+        getnegativecache(config).put(negativekey, parentmtime)
     raise GopherExceptions.FileNotFound([selector, "no handler found", protocol])
+
+def gethandlercache(config):
+    global handlercache
+    if handlercache == None:
+        handlercache = cache.LRUCache(settings.get(config).handlercachesize)
+    return handlercache
+
+def getcachekey(selector, vfs, statresult, handlerlist, config):
+    """The key under which the handler for selector is remembered.  It
+    changes whenever the file is modified, replaced or has its
+    permissions changed."""
+    # VFS_Zip returns plain tuples rather than os.stat_result.
+    mtime = getattr(statresult, 'st_mtime_ns', statresult[ST_MTIME])
+    return (selector, vfs.getcachekey(), statresult[ST_MODE],
+            statresult[ST_INO], statresult[ST_SIZE], mtime,
+            tuple(handlerlist), settings.get(config))
+
+# Distinct from any mtime, including the None of a missing parent.
+notfound = object()
+
+def getnegativecache(config):
+    global negativecache
+    if negativecache == None:
+        s = settings.get(config)
+        negativecache = cache.LRUCache(s.negativecachesize,
+                                       maxage = s.negativecachetime)
+    return negativecache
+
+def getparentmtime(selector, vfs):
+    """Returns the mtime of the directory holding selector, or None if
+    there is no such directory.  Creating or removing a file changes
+    its directory's mtime."""
+    try:
+        statresult = vfs.stat(os.path.dirname(selector))
+    except OSError:
+        return None
+    return statresult[ST_MTIME]
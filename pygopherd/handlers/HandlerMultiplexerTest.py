@@ -0,0 +1,60 @@
+import unittest, tempfile, shutil, os
+from pygopherd import testutil, GopherExceptions
+from pygopherd.handlers import HandlerMultiplexer, file, mbox
+
+class HandlerMultiplexerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.protocol = testutil.gettestingprotocol("/foo\n", self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def writefile(self, data):
+        fd = open(os.path.join(self.root, 'foo'), 'wb')
+        fd.write(data)
+        fd.close()
+
+    def gethandler(self):
+        return HandlerMultiplexer.getHandler('/foo', '', self.protocol,
+                                             self.config)
+
+    def testcache(self):
+        self.writefile(b"Plain text\n")
+        assert isinstance(self.gethandler(), file.FileHandler)
+        hits = HandlerMultiplexer.gethandlercache(self.config).hits
+        assert isinstance(self.gethandler(), file.FileHandler)
+        self.assertEqual(HandlerMultiplexer.gethandlercache(self.config).hits,
+                         hits + 1)
+
+    def testinvalidate(self):
+        self.writefile(b"Plain text\n")
+        assert isinstance(self.gethandler(), file.FileHandler)
+        self.writefile(b"From jgoerzen Sat Jan  5 10:32:01 2002\n\nHello\n")
+        assert isinstance(self.gethandler(), mbox.MBoxFolderHandler)
+
+    def testnegative(self):
+        negativecache = HandlerMultiplexer.getnegativecache(self.config)
+        os.utime(self.root, (0, 0))
+        self.assertRaises(GopherExceptions.FileNotFound, self.gethandler)
+        hits = negativecache.hits
+        self.assertRaises(GopherExceptions.FileNotFound, self.gethandler)
+        self.assertEqual(negativecache.hits, hits + 1)
+        # Creating the file changes the directory's mtime.
+        self.writefile(b"Plain text\n")
+        assert isinstance(self.gethandler(), file.FileHandler)
+
+    def testiscandidate(self):
+        self.writefile(b"Plain text\n")
+        statresult = os.stat(os.path.join(self.root, 'foo'))
+        assert file.FileHandler.iscandidate('/foo', statresult)
+        assert not file.FileHandler.iscandidate('/foo', None)
+        assert not mbox.MaildirFolderHandler.iscandidate('/foo', statresult)
+        assert not mbox.MBoxMessageHandler.iscandidate('/foo', statresult)
+        assert mbox.MBoxMessageHandler.iscandidate('/foo|/MBOX-MESSAGE/1', None)
+        handler = HandlerMultiplexer.getHandler('/foo', '', self.protocol,
+                                                self.config,
+                                                statresult = statresult)
+        assert isinstance(handler, file.FileHandler)
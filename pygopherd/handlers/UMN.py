@@ -19,14 +19,13 @@
 import socketserver
 import re
 import os, stat, os.path, mimetypes
-from pygopherd import protocols, gopherentry
+from pygopherd import protocols, gopherentry, settings
 from pygopherd.gopherentry import GopherEntry
 from pygopherd.handlers.dir import DirHandler
 from pygopherd.handlers.file import FileHandler
 from stat import *
 import pygopherd.fileext
 
-extstrip = None
 
 ###########################################################################
 # UMN Directory handler
@@ -34,6 +33,8 @@ extstrip = None
 ###########################################################################
 
 class LinkEntry(GopherEntry):
+    __slots__ = ('needsmerge', 'needsabspath')
+
     def __init__(self, selector, config):
         GopherEntry.__init__(self, selector, config)
         self.needsmerge = 0
@@ -71,7 +72,8 @@ class UMNDirHandler(DirHandler):
             # If the parent says it's OK, then let's see if it's
             # a link file.  If yes, process it and return false.
             if file[0] == '.':
-                if not self.vfs.isdir(self.selectorbase + '/' + file):
+                statresult = self.filestats[file]
+                if not (statresult and S_ISDIR(statresult[ST_MODE])):
                     self.linkentries.extend(self.processLinkFile(self.selectorbase + '/' + file))
                     return 0
                 else:
@@ -86,10 +88,7 @@ class UMNDirHandler(DirHandler):
         parent's prepare to append an entry to the list.  Here, we check
         to see if there's a .cap file right before adding it."""
 
-        global extstrip
-        if extstrip == None:
-            extstrip = self.config.get("handlers.UMN.UMNDirHandler",
-                                       "extstrip")
+        extstrip = settings.get(self.config).extstrip
         if extstrip != 'none' and \
                isinstance(handler, FileHandler):
             if extstrip == 'full' or \
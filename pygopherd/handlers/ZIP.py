@@ -16,26 +16,138 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-import re, time, stat, unittest, os.path, struct, types, shelve, marshal
+import re, time, stat, unittest, os.path, struct, types, mmap, hashlib, zlib
+import tempfile, threading
 from io import StringIO
 import zipfile
 
-class MarshalingShelf(shelve.Shelf):
-    def __getitem__(self, key):
-        return marshal.loads(self.dict[key])
-
-    def __setitem__(self, key, value):
-        self.dict[key] = marshal.dumps(value)
+from pygopherd.handlers import base
+from pygopherd import settings, cache
+
+# The index of an archive's contents, saved so that the central
+# directory need not be read again, starts with this header: magic,
+# version, and the mtime and size of the archive it describes, followed
+# by the numbers of nodes and of directory entries.
+indexmagic = b'PYGZIDX\0'
+indexversion = 1
+indexheader = struct.Struct('<8sIqqII')
+
+# Next come the nodes, root directory first.  Each is a directory or a
+# file; symbolic links are resolved when the index is built.  Fields:
+# kind, compression type, flag bits, first entry (directories) or name
+# offset (files), entry count or name length, CRC-32, mtime, offset of
+# the local header, compressed size, size.
+indexnode = struct.Struct('<HHHxxIIIqQQQ')
+nodedir = 0
+nodefile = 1
+
+# Then the directory entries, grouped by directory and sorted by name
+# within each: name offset, name length, node.  Last come the names,
+# in UTF-8, that the offsets point into.
+indexentry = struct.Struct('<III')
+
+# Local file headers, which sit in front of each member's data.
+localheader = struct.Struct('<4s22xHH')
+
+# Largest piece of a deflated member held at once, compressed or not.
+zipblocksize = 65536
+
+# Open archives, shared between requests, by (chain key, filename).
+zippool = None
+
+def closevfs(key, vfs):
+    vfs.close()
+
+def getzippool(config):
+    global zippool
+    if zippool == None:
+        zippool = cache.LRUCache(settings.get(config).zippoolsize,
+                                 onremove = closevfs)
+    return zippool
+
+# Whether files are archives, by (handler class, VFS key, selector).
+# Each answer is stored with the (mtime, size) of the file it was found
+# for.
+archivecache = cache.LRUCache(4096)
+
+def getzipkey(chain, zipfilename):
+    """Returns the cache key of the VFS for zipfilename.  It changes
+    when the archive does."""
+    statval = chain.stat(zipfilename)
+    return ('zip', chain.getcachekey(), zipfilename,
+            statval[stat.ST_MTIME], statval[stat.ST_SIZE])
+
+def getvfs(config, chain, zipfilename):
+    """Returns a VFS_Zip for zipfilename, reusing the one made for an
+    earlier request if the archive has not changed since.  An archive
+    is closed when it is dropped from the pool."""
+    key = getzipkey(chain, zipfilename)
+    poolkey = (key[1], zipfilename)
+    pool = getzippool(config)
+    vfs = pool.get(poolkey)
+    if vfs == None or vfs.getcachekey() != key:
+        vfs = VFS_Zip(config, chain, zipfilename)
+        vfs.cachekey = key
+        pool.put(poolkey, vfs)
+    return vfs
+
+class ZipMemberFile:
+    """A member of an archive, opened by VFS_Zip.open.  Reads go to the
+    file zipfile opened; closing it also calls release, once."""
+
+    def __init__(self, member, release):
+        self.member = member
+        self.release = release
+
+    def __getattr__(self, name):
+        return getattr(self.member, name)
+
+    # These are defined here, rather than left to __getattr__, so that
+    # this object, and so the member, is not closed by __del__ while
+    # they run.
+
+    def read(self, *args):
+        return self.member.read(*args)
+
+    def read1(self, *args):
+        return self.member.read1(*args)
+
+    def readinto(self, buffer):
+        return self.member.readinto(buffer)
+
+    def readline(self, *args):
+        return self.member.readline(*args)
+
+    def readlines(self, *args):
+        return self.member.readlines(*args)
+
+    def seek(self, *args):
+        return self.member.seek(*args)
+
+    def tell(self):
+        return self.member.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.member)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
-class DbfilenameShelf(MarshalingShelf):
-    def __init__(self, filename, flag='c'):
-        import dbm
-        MarshalingShelf.__init__(self, dbm.open(filename, flag))
+    def close(self):
+        self.member.close()
+        release = self.release
+        self.release = None
+        if release != None:
+            release()
 
-def shelveopen(filename, flag='c'):
-    return DbfilenameShelf(filename, flag)
-
-from pygopherd.handlers import base
+    def __del__(self):
+        self.close()
 
 class VFS_Zip(base.VFS_Real):
     def __init__(self, config, chain, zipfilename):
@@ -44,60 +156,211 @@ class VFS_Zip(base.VFS_Real):
         self.zipfilename = zipfilename
         self.entrycache = {}
         self.badcache = {}
+        self.cachekey = None
+        self.zip = None
+        self.zipfd = None
+        # Guards zip, zipfd, members and closed, as the VFS is shared by
+        # requests in several threads.
+        self.lock = threading.RLock()
+        # Members opened and not yet closed.
+        self.members = 0
+        # Set once the VFS is dropped from the pool; the archive is then
+        # closed as soon as no member is open.
+        self.closed = 0
+        self.dataoffsets = {}
         self._initzip()
 
-    def _getcachefilename(self):
-        (dir, file) = os.path.split(self.zipfilename)
-        return os.path.join(dir, '.cache.pygopherd.zip3.' + file)
-
-    def _initcache(self):
-        """Returns 1 if a cache was found existing; 0 if not."""
-        filename = self._getcachefilename()
-        if isinstance(self.chain, base.VFS_Real) and \
-               self.chain.iswritable(filename):
-            fspath = self.chain.getfspath(filename)
-            zipfilemtime = self.chain.stat(self.zipfilename)[stat.ST_MTIME]
-            try:
-                cachemtime = self.chain.stat(filename)[stat.ST_MTIME]
-            except OSError:
-                self._createcache(fspath)
-                return 0
+    def getcachekey(self):
+        if self.cachekey == None:
+            self.cachekey = getzipkey(self.chain, self.zipfilename)
+        return self.cachekey
+
+    def _getindexfilename(self):
+        """Returns the file the index is saved in, or None if there is
+        nowhere to save it."""
+        cachedir = settings.get(self.config).zipcachedir
+        if cachedir:
+            name = repr((self.chain.getcachekey(), self.zipfilename))
+            return os.path.join(cachedir,
+                                hashlib.sha1(name.encode('utf-8')).hexdigest() +
+                                '.zipidx')
+        if not self.chain.iswritable(self.zipfilename):
+            return None
+        (dir, file) = os.path.split(self.chain.getfspath(self.zipfilename))
+        return os.path.join(dir, '.cache.pygopherd.zipidx.' + file)
 
-            if zipfilemtime > cachemtime:
-                self._createcache(fspath)
-                return 0
-            
-            try:
-                self.dircache = shelveopen(fspath, 'r')
-            except:
-                self._createcache(fspath)
-                return 0
-
-            return 1
-
-    def _createcache(self, fspath):
-        self.dircache = {}
+    def _initzip(self):
+        statval = self.chain.stat(self.zipfilename)
+        self.stamp = (int(statval[stat.ST_MTIME]), statval[stat.ST_SIZE])
+        filename = self._getindexfilename()
+        index = None
+        if filename != None:
+            index = self._loadindex(filename)
+        if index == None:
+            index = self._buildindex()
+            if filename != None:
+                self._saveindex(filename, index)
+        self._setindex(index)
+
+    def _loadindex(self, filename):
+        """Maps the saved index, so that processes share it through the
+        page cache.  Returns None if it is missing or out of date."""
         try:
-            self.dbdircache = shelveopen(fspath, 'n')
-        except e:
-            GopherExceptions.log(e, handler = self)
-            return 0
-
-    def _savecache(self):
-        if not hasattr(self, 'dbdircache'):
-            # createcache was somehow unsuccessful
-            return
-        for (key, value) in self.dircache.items():
-            self.dbdircache[key] = value
+            with open(filename, 'rb') as fd:
+                index = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(index) < indexheader.size or \
+           indexheader.unpack_from(index)[:4] != \
+               (indexmagic, indexversion) + self.stamp:
+            index.close()
+            return None
+        return index
+
+    def _saveindex(self, filename, index):
+        try:
+            fd, tempname = tempfile.mkstemp(dir = os.path.dirname(filename))
+            try:
+                os.write(fd, index)
+            finally:
+                os.close(fd)
+            os.replace(tempname, filename)
+        except OSError:
+            # A read-only tree, most likely.  The index is still kept
+            # in memory.
+            pass
+
+    def _setindex(self, index):
+        self.index = index
+        magic, version, mtime, size, nodes, entries = \
+            indexheader.unpack_from(index)
+        self.nodesoffset = indexheader.size
+        self.entriesoffset = self.nodesoffset + nodes * indexnode.size
+        self.stringsoffset = self.entriesoffset + entries * indexentry.size
+
+    def _buildindex(self):
+        """Reads the central directory and returns the index of it."""
+        self._cachedir()
+        zip = self._getzip()
+        numbers = {}
+        for inode in self.dircache:
+            numbers[inode] = len(numbers)
+        nodes = []
+        entries = []
+        strings = bytearray()
+        for inode, item in self.dircache.items():
+            if type(item) == dict:
+                names = sorted([(name.encode('utf-8'), name) for name in item])
+                nodes.append(indexnode.pack(nodedir, 0, 0, len(entries),
+                                            len(names), 0, 0, 0, 0, 0))
+                for encoded, name in names:
+                    entries.append(indexentry.pack(len(strings), len(encoded),
+                                                   numbers[item[name]]))
+                    strings.extend(encoded)
+            else:
+                info = zip.getinfo(item)
+                encoded = item.encode('utf-8')
+                mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+                nodes.append(indexnode.pack(nodefile, info.compress_type,
+                                            info.flag_bits, len(strings),
+                                            len(encoded), info.CRC, mtime,
+                                            info.header_offset,
+                                            info.compress_size,
+                                            info.file_size))
+                strings.extend(encoded)
+        # Only needed while building.
+        del self.dircache
+        self.entrycache = {}
+        self.badcache = {}
+        return indexheader.pack(indexmagic, indexversion, self.stamp[0],
+                                self.stamp[1], len(nodes), len(entries)) + \
+               b''.join(nodes) + b''.join(entries) + bytes(strings)
+
+    def _getzip(self):
+        """Returns the archive, opened with zipfile.  This reads the
+        whole central directory, so is put off until needed."""
+        with self.lock:
+            if self.zip == None:
+                self.zipfd = self.chain.open(self.zipfilename, mode='rb')
+                self.zip = zipfile.ZipFile(self.zipfd, mode='r')
+            return self.zip
+
+    def _closezip(self):
+        if self.zip != None:
+            self.zip.close()
+            self.zipfd.close()
+            self.zip = None
+            self.zipfd = None
+
+    def _releasemember(self):
+        with self.lock:
+            self.members -= 1
+            if self.closed and not self.members:
+                self._closezip()
+
+    def __del__(self):
+        # Members hold a reference to this, so none are open by now.
+        self._closezip()
+
+    def close(self):
+        """Closes the archive, or, if members are still being read,
+        has the last of them close it.  A request still using the VFS
+        may open it again; it is then closed after that request's
+        members are."""
+        with self.lock:
+            self.closed = 1
+            if not self.members:
+                self._closezip()
+
+    def _getnode(self, node):
+        return indexnode.unpack_from(self.index,
+                                     self.nodesoffset + node * indexnode.size)
+
+    def _getstring(self, offset, length):
+        offset += self.stringsoffset
+        return self.index[offset:offset + length]
+
+    def _getentries(self, node):
+        """Returns (name, node) for each entry in a directory node."""
+        fields = self._getnode(node)
+        retval = []
+        for i in range(fields[3], fields[3] + fields[4]):
+            nameoffset, namelength, child = indexentry.unpack_from(
+                self.index, self.entriesoffset + i * indexentry.size)
+            retval.append((self._getstring(nameoffset, namelength), child))
+        return retval
+
+    def _findentry(self, node, name):
+        """Returns the node for name in the directory node, by binary
+        search.  Raises KeyError if there is none."""
+        kind, compresstype, flags, first, count = self._getnode(node)[:5]
+        if kind != nodedir:
+            raise KeyError("%s is not a directory" % name)
+        name = name.encode('utf-8')
+        low = first
+        high = first + count
+        while low < high:
+            middle = (low + high) // 2
+            nameoffset, namelength, child = indexentry.unpack_from(
+                self.index, self.entriesoffset + middle * indexentry.size)
+            entryname = self._getstring(nameoffset, namelength)
+            if entryname == name:
+                return child
+            if entryname < name:
+                low = middle + 1
+            else:
+                high = middle
+        raise KeyError("Couldn't find %s" % name)
 
-    def _initzip(self):
-        zipfd = self.chain.open(self.zipfilename, mode='rb')
-        self.zip = zipfile.ZipFile(zipfd, mode='r')
-        if not self._initcache():
-            # For reloading an existing one.  Must be called before _cachedir.
-            self._cachedir()
-            self._savecache()
-            self.dbdircache.close()       # Flush it out
+    def _lookup(self, fspath):
+        """Returns the index node for fspath.  Raises KeyError if there
+        is none."""
+        node = 0
+        if fspath == '':
+            return node
+        for item in fspath.split('/'):
+            node = self._findentry(node, item)
+        return node
 
     def _isentryincache(self, fspath):
         try:
@@ -143,7 +406,7 @@ class VFS_Zip(base.VFS_Real):
         nextinode = 1
         self.dircache = {'0': {}}
         
-        for info in self.zip.infolist():
+        for info in self._getzip().infolist():
             (dir, filename) = os.path.split(info.filename)
             if dir == '/':
                 dir == ''
@@ -200,7 +463,7 @@ class VFS_Zip(base.VFS_Real):
         #if not self._islinkfspath(fspath):
         #    raise ValueError, "Readlinkfspath called on %s which is not a link" % fspath
 
-        return self.zip.read(fspath).decode(encoding='cp437')
+        return self._getzip().read(fspath).decode(encoding='cp437')
 
     def _readlink(self, selector):
         return self._readlinkfspath(self, self._getfspathfinal(selector))
@@ -244,13 +507,12 @@ class VFS_Zip(base.VFS_Real):
     def stat(self, selector):
         fspath = self.getfspath(selector)
         try:
-            zi = self._getcacheentry(fspath)
+            fields = self._getnode(self._lookup(fspath))
         except KeyError:
             raise OSError("Entry %s does not exist in %s" %\
                   (selector, self.zipfilename))
         
-        if type(zi) == dict:
-            # It's a directory.
+        if fields[0] == nodedir:
             return (16877,              # mode
                     0,                  # inode
                     0,                  # device
@@ -262,17 +524,16 @@ class VFS_Zip(base.VFS_Real):
                     0,                  # modification time
                     0)                  # change time
 
-        zi = self.zip.getinfo(fspath)
-
-        zt = zi.date_time
-        modtime = time.mktime(zt + (0, 0, -1))
+        modtime = fields[6]
+        # The inode goes into HTTP ETags, so make it tell members apart:
+        # from where the member lies, and its CRC.
         return (33188,                  # mode
-                0,                      # inode
+                fields[5] << 64 | (fields[7] + 1), # inode
                 0,                      # device
                 1,                      # links
                 0,                      # uid
                 0,                      # gid
-                zi.file_size,           # size
+                fields[9],              # size
                 modtime,                # access time
                 modtime,                # modification time
                 modtime)                # change time
@@ -281,50 +542,144 @@ class VFS_Zip(base.VFS_Real):
     def isdir(self, selector):
         fspath = self.getfspath(selector)
         try:
-            item = self._getcacheentry(fspath)
+            return self._getnode(self._lookup(fspath))[0] == nodedir
         except KeyError:
             return 0
 
-        return type(item) == dict
-
     def isfile(self, selector):
         fspath = self.getfspath(selector)
         try:
-            item = self._getcacheentry(fspath)
+            return self._getnode(self._lookup(fspath))[0] == nodefile
         except KeyError:
             return 0
 
-        return type(item) != dict
-
     def exists(self, selector):
         fspath = self.getfspath(selector)
-        return self._isentryincache(fspath)
-
-    def _open(self, fspath):
-        return self.zip.open_pos(self._getcacheentry(fspath))
+        try:
+            self._lookup(fspath)
+            return 1
+        except KeyError:
+            return 0
 
     def open(self, selector, *args, **kwargs):
         fspath = self.getfspath(selector)
         try:
-            item = self._getcacheentry(fspath)
+            fields = self._getnode(self._lookup(fspath))
+        except KeyError:
+            raise IOError("Request to open %s, which does not exist" % selector)
+        if fields[0] == nodedir:
+            raise IOError("Request to open %s, which is a directory" % selector)
+
+        name = self._getstring(fields[3], fields[4]).decode('utf-8')
+        with self.lock:
+            member = self._getzip().open(name)
+            self.members += 1
+        return ZipMemberFile(member, self._releasemember)
+
+    def getrawmember(self, selector):
+        """Returns (compression type, offset, length, size) for the
+        member at selector: where its data, as stored, lies in the
+        archive file, and how long it is once decompressed.  Raises
+        IOError if it is not a file."""
+        fspath = self.getfspath(selector)
+        try:
+            node = self._lookup(fspath)
         except KeyError:
             raise IOError("Request to open %s, which does not exist" % selector)
-        if type(item) == dict:
-            raise IOError("Request to open %s, which is a directory (%s)" % (selector, str(item)))
+        fields = self._getnode(node)
+        if fields[0] == nodedir:
+            raise IOError("Request to open %s, which is a directory" % selector)
+        if not node in self.dataoffsets:
+            # The local header may have a different extra field from
+            # the central directory, so it must be read.
+            rfile = self.chain.open(self.zipfilename, 'rb')
+            try:
+                rfile.seek(fields[7])
+                header = rfile.read(localheader.size)
+            finally:
+                rfile.close()
+            if len(header) != localheader.size or \
+               localheader.unpack(header)[0] != b'PK\x03\x04':
+                raise IOError("Bad local header for %s in %s" % \
+                              (selector, self.zipfilename))
+            signature, namelength, extralength = localheader.unpack(header)
+            self.dataoffsets[node] = fields[7] + localheader.size + \
+                                     namelength + extralength
+        return (fields[1], self.dataoffsets[node], fields[8], fields[9])
+
+    def sendfile(self, selector, wfile, offset = 0, count = None):
+        """Members stored as they are go straight from the archive
+        file, with os.sendfile where possible.  Deflated ones are
+        inflated a piece at a time.  Others, and encrypted ones, are
+        read through zipfile."""
+        fspath = self.getfspath(selector)
+        try:
+            fields = self._getnode(self._lookup(fspath))
+        except KeyError:
+            fields = None
+        if fields == None or fields[0] != nodefile or fields[2] & 0x1 or \
+           fields[1] not in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]:
+            base.VFS_Real.sendfile(self, selector, wfile, offset, count)
+            return
 
-        return self.zip.open(item)
+        compresstype, dataoffset, length, size = self.getrawmember(selector)
+        if count == None or offset + count > size:
+            count = max(0, size - offset)
+        if compresstype == zipfile.ZIP_STORED:
+            self.chain.sendfile(self.zipfilename, wfile, dataoffset + offset,
+                                count)
+        else:
+            self._inflate(wfile, dataoffset, length, offset, count)
+
+    def _inflate(self, wfile, dataoffset, length, offset, count):
+        """Writes count bytes, from offset on, of the deflated data
+        length bytes long at dataoffset in the archive file."""
+        buffer = bytearray(zipblocksize)
+        view = memoryview(buffer)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        rfile = self.chain.open(self.zipfilename, 'rb')
+        try:
+            rfile.seek(dataoffset)
+            while length > 0 and count > 0:
+                got = rfile.readinto(view[:min(length, zipblocksize)])
+                if not got:
+                    raise IOError("%s is truncated" % self.zipfilename)
+                length -= got
+                data = view[:got]
+                while len(data) and count > 0:
+                    try:
+                        block = decompressor.decompress(data, zipblocksize)
+                    except zlib.error as e:
+                        raise IOError("Corrupt member in %s: %s" % \
+                                      (self.zipfilename, str(e)))
+                    data = decompressor.unconsumed_tail
+                    if offset >= len(block):
+                        offset -= len(block)
+                        continue
+                    block = block[offset:offset + count]
+                    offset = 0
+                    wfile.write(block)
+                    count -= len(block)
+        finally:
+            rfile.close()
+
+    def copyto(self, name, fd):
+        self.sendfile(name, fd)
 
     def listdir(self, selector):
         fspath = self.getfspath(selector)
         try:
-            retobj = self._getcacheentry(fspath)
+            node = self._lookup(fspath)
         except KeyError:
             raise OSError("listdir on %s (%s) failed: no such file or directory" % (selector, fspath))
 
-        if type(retobj) != dict:
-            raise OSError("listdir on %s failed: that is a file, not a directory.  Got %s" % (selector, str(retobj)))
+        if self._getnode(node)[0] != nodedir:
+            raise OSError("listdir on %s failed: that is a file, not a directory" % selector)
 
-        return list(retobj.keys())
+        return [name.decode('utf-8') for name, child in self._getentries(node)]
+
+    def listdirstat(self, selector):
+        return base.listdirstat(self, selector)
 
 
 #class TestVFS_Zip_huge(unittest.TestCase):
@@ -401,10 +756,8 @@ class DISABLED_TestVFS_Zip_huge:
 
 class TestVFS_Zip(unittest.TestCase):
     def setUp(s):
-        from configparser import ConfigParser
-        s.config = ConfigParser()
-        s.config.add_section('pygopherd')
-        s.config.set("pygopherd", "root", os.path.abspath('testdata'))
+        from pygopherd import testutil
+        s.config = testutil.getconfig()
         s.real = base.VFS_Real(s.config)
         s.z = VFS_Zip(s.config, s.real, '/testdata.zip')
         s.z2 = VFS_Zip(s.config, s.real, '/testdata2.zip')
@@ -599,26 +952,143 @@ class TestVFS_Zip(unittest.TestCase):
         
         
         
+    def test_sendfile(s):
+        from io import BytesIO
+        import socket
+        for selector in ['/testdata.zip/testfile.txt',
+                         '/testdata.zip/README',
+                         '/testdata.zip/pygopherd/pipetestdata']:
+            data = s.z.open(selector).read()
+            wfile = BytesIO()
+            s.z.sendfile(selector, wfile)
+            s.assertEqual(wfile.getvalue(), data)
+            for offset, count in [(1, 3), (2, None), (0, 1000), (1000, 1)]:
+                wfile = BytesIO()
+                s.z.sendfile(selector, wfile, offset, count)
+                end = None
+                if count != None:
+                    end = offset + count
+                s.assertEqual(wfile.getvalue(), data[offset:end])
+
+        s.assertEqual(s.z.getrawmember('/testdata.zip/testfile.txt')[0],
+                      zipfile.ZIP_STORED)
+        s.assertEqual(s.z.getrawmember('/testdata.zip/README')[0],
+                      zipfile.ZIP_DEFLATED)
+        s.assertRaises(IOError, s.z.getrawmember, '/testdata.zip/pygopherd')
+
+        # Stored members go straight from the archive to the socket.
+        server, client = socket.socketpair()
+        wfile = server.makefile('wb')
+        s.z.sendfile('/testdata.zip/testfile.txt', wfile)
+        wfile.close()
+        server.close()
+        s.assertEqual(client.makefile('rb').read(), b"Test\n")
+        client.close()
+
+class TestZIPCaches(unittest.TestCase):
+    def setUp(self):
+        import tempfile, shutil
+        from pygopherd import testutil
+        self.root = tempfile.mkdtemp()
+        shutil.copy('testdata/testdata.zip', self.root)
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.real = base.VFS_Real(self.config)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def testpool(self):
+        vfs = getvfs(self.config, self.real, '/testdata.zip')
+        self.assertEqual(vfs.open('/testdata.zip/testfile.txt').read(),
+                         b'Test\n')
+        assert getvfs(self.config, self.real, '/testdata.zip') is vfs
+
+        # A changed archive is opened again, and the old one closed
+        # once the members already open from it are.
+        member = vfs.open('/testdata.zip/testfile.txt')
+        zipfd = vfs.zipfd
+        path = os.path.join(self.root, 'testdata.zip')
+        mtime = os.stat(path)[stat.ST_MTIME]
+        os.utime(path, (mtime + 10, mtime + 10))
+        newvfs = getvfs(self.config, self.real, '/testdata.zip')
+        assert newvfs is not vfs
+        assert not zipfd.closed
+        self.assertEqual(member.read(), b'Test\n')
+        member.close()
+        assert zipfd.closed
+        assert vfs.zip == None
+
+        # A request still using the old one can, and it is closed again.
+        member = vfs.open('/testdata.zip/testfile.txt')
+        zipfd = vfs.zipfd
+        self.assertEqual(member.read(), b'Test\n')
+        member.close()
+        assert zipfd.closed
+        assert getvfs(self.config, self.real, '/testdata.zip') is newvfs
+        self.assertEqual(newvfs.open('/testdata.zip/testfile.txt').read(),
+                         b'Test\n')
+
+    def testindex(self):
+        import mmap, tempfile, shutil
+        cachedir = tempfile.mkdtemp()
+        try:
+            self.config.set("handlers.ZIP.ZIPHandler", "cachedir", cachedir)
+            vfs = VFS_Zip(self.config, self.real, '/testdata.zip')
+            self.assertEqual(os.listdir(self.root), ['testdata.zip'])
+            self.assertEqual(len(os.listdir(cachedir)), 1)
+
+            # The saved index is used, without reading the archive.
+            vfs = VFS_Zip(self.config, self.real, '/testdata.zip')
+            assert isinstance(vfs.index, mmap.mmap)
+            assert vfs.zip == None
+            self.assertEqual(sorted(vfs.listdir('/testdata.zip/pygopherd')),
+                             ['pipetest.sh', 'pipetestdata', 'ziponly'])
+            self.assertEqual(vfs.stat('/testdata.zip/testfile.txt')[6], 5)
+            assert vfs.zip == None
+            self.assertEqual(vfs.open('/testdata.zip/testfile.txt').read(),
+                             b'Test\n')
+        finally:
+            shutil.rmtree(cachedir)
+
+    def testarchivecache(self):
+        from pygopherd import testutil
+        self.config.set("handlers.ZIP.ZIPHandler", "enabled", "true")
+        self.config.set("handlers.ZIP.ZIPHandler", "pattern", "\\.(zip|txt)$")
+        protocol = testutil.gettestingprotocol("/\n", self.config)
+        open(os.path.join(self.root, 'fake.txt'), 'w').close()
+        for selector, expected in [('/testdata.zip/pygopherd/ziponly', 1),
+                                   ('/testdata.zip', 1),
+                                   ('/fake.txt', 0),
+                                   ('/nonexistant.zip/foo', 0)]:
+            for i in range(2):
+                handler = ZIPHandler(selector, '', protocol, self.config,
+                                     None, self.real)
+                self.assertEqual(handler.canhandlerequest(), expected)
+            if expected:
+                self.assertEqual(handler.basename, '/testdata.zip')
+        hits = archivecache.getstats()['hits']
+        handler = ZIPHandler('/fake.txt', '', protocol, self.config,
+                             None, self.real)
+        handler.canhandlerequest()
+        self.assertEqual(archivecache.getstats()['hits'], hits + 1)
+
 class ZIPHandler(base.BaseHandler):
     def canhandlerequest(self):
         """We can handle the request if it's a ZIP file, in our pattern, etc.
         """
 
-        if not self.config.getboolean("handlers.ZIP.ZIPHandler",
-                                      "enabled"):
+        if not self.isenabled():
             return 0
 
-
-        pattern = re.compile(self.config.get("handlers.ZIP.ZIPHandler",
-                                             "pattern"))
+        pattern = self.getpattern()
 
         basename = self.selector
         appendage = None
 
         while 1:
-            if pattern.search(basename) and \
-               self.vfs.isfile(basename) and \
-               zipfile.is_zipfile(self.vfs.getfspath(basename)):
+            if pattern.search(basename) and self.isarchive(basename):
                 self.basename = basename
                 self.appendage = appendage
                 return 1
@@ -635,10 +1105,41 @@ class ZIPHandler(base.BaseHandler):
 
             basename = head
 
+    def isenabled(self):
+        return settings.get(self.config).zipenabled
+
+    def getpattern(self):
+        return settings.get(self.config).zippattern
+
+    def isarchivefile(self, fspath):
+        return zipfile.is_zipfile(fspath)
+
+    def getarchivevfs(self):
+        """Returns the VFS for the archive at self.basename."""
+        return getvfs(self.config, self.vfs, self.basename)
+
+    def isarchive(self, selector):
+        """Returns true if selector is an archive this handler can
+        open.  The answer is remembered until the file changes."""
+        try:
+            statval = self.vfs.stat(selector)
+        except OSError:
+            return 0
+        if not stat.S_ISREG(statval[stat.ST_MODE]):
+            return 0
+        key = (type(self), self.vfs.getcachekey(), selector)
+        stamp = (statval[stat.ST_MTIME], statval[stat.ST_SIZE])
+        cached = archivecache.get(key)
+        if cached != None and cached[0] == stamp:
+            return cached[1]
+        result = self.isarchivefile(self.vfs.getfspath(selector))
+        archivecache.put(key, (stamp, result))
+        return result
+
     def _makehandler(self):
         if hasattr(self, 'handler'):
             return
-        vfs = VFS_Zip(self.config, self.vfs, self.basename)
+        vfs = base.VFS_Cached(self.config, self.getarchivevfs())
         from pygopherd.handlers import HandlerMultiplexer
         self.handler = HandlerMultiplexer.getHandler(self.getselector(),
                                                      self.searchrequest,
@@ -659,6 +1160,21 @@ class ZIPHandler(base.BaseHandler):
 
     def write(self, wfile):
         self.handler.write(wfile)
+
+    def getcontentlength(self):
+        return self.handler.getcontentlength()
+
+    def writerange(self, wfile, offset, count):
+        self.handler.writerange(wfile, offset, count)
+
+    def getetag(self):
+        return self.handler.getetag()
+
+    def getprecompressed(self, coding):
+        return self.handler.getprecompressed(coding)
+
+    def writeprecompressed(self, wfile, selector):
+        self.handler.writeprecompressed(wfile, selector)
                
     def getentry(self):
         self._makehandler()
@@ -18,19 +18,25 @@
 
 import socketserver
 import re
-import os, stat, os.path, mimetypes
-from pygopherd import protocols, gopherentry
+import os, stat, os.path, mimetypes, socket
+from pygopherd import protocols, gopherentry, settings, cache, output
 
-rootpath = None
 
 class VFS_Real:
     def __init__(self, config, chain = None):
         """This implementation does not chain."""
         self.config = config
+        self.rootpath = None
     
     def iswritable(self, selector):
         return 1
 
+    def getcachekey(self):
+        """Returns a hashable value that identifies the files this VFS
+        gives access to.  Two VFS objects with equal keys must return the
+        same thing for the same selector."""
+        return ('real', self.getrootpath())
+
     def unlink(self, selector):
         os.unlink(self.getfspath(selector))
 
@@ -52,11 +58,28 @@ class VFS_Real:
     def listdir(self, selector):
         return os.listdir(self.getfspath(selector))
 
+    def listdirstat(self, selector):
+        """Returns a list of (name, statresult) pairs, one for each
+        entry in the directory selector.  statresult is None for
+        entries that cannot be stat'd, such as dangling symlinks.
+
+        os.scandir tells us which entries are plain files and
+        directories without extra system calls on some platforms."""
+        retval = []
+        with os.scandir(self.getfspath(selector)) as entries:
+            for entry in entries:
+                try:
+                    retval.append((entry.name, entry.stat()))
+                except OSError:
+                    retval.append((entry.name, None))
+        return retval
+
     def getrootpath(self):
-        global rootpath
-        if not rootpath:
-            rootpath = self.config.get("pygopherd", "root")
-        return rootpath
+        # Read directly rather than through settings, so that a VFS
+        # can be used with a config holding nothing but the root.
+        if self.rootpath == None:
+            self.rootpath = self.config.get("pygopherd", "root")
+        return self.rootpath
 
     def getfspath(self, selector):
         """Gets the filesystem path corresponding to the selector."""
@@ -77,6 +100,251 @@ class VFS_Real:
             fd.write(data)
         rfile.close
 
+    def sendfile(self, selector, wfile, offset = 0, count = None):
+        """Writes count bytes of selector, starting at offset, to wfile.
+        If count is None, writes to the end of the file.
+
+        When selector is a regular file and wfile a socket, the kernel
+        copies the data with os.sendfile and it never passes through
+        Python.  Otherwise it is copied in the usual way."""
+        rfile = self.open(selector, 'rb')
+        try:
+            outfd = getsocketfd(wfile)
+            infd = None
+            if outfd != None and hasattr(os, 'sendfile'):
+                try:
+                    infd = rfile.fileno()
+                    if not stat.S_ISREG(os.fstat(infd)[stat.ST_MODE]):
+                        infd = None
+                except (AttributeError, OSError, ValueError):
+                    infd = None
+
+            if infd == None:
+                copyfile(rfile, wfile, offset, count)
+                return
+
+            if count == None:
+                count = os.fstat(infd)[stat.ST_SIZE] - offset
+            wfile.flush()
+            while count > 0:
+                try:
+                    sent = os.sendfile(outfd, infd, offset, count)
+                except BlockingIOError:
+                    waitwritable(outfd)
+                    continue
+                if sent == 0:
+                    break               # The file was truncated under us.
+                offset += sent
+                count -= sent
+        finally:
+            rfile.close()
+
+def listdirstat(vfs, selector):
+    """An implementation of listdirstat for any VFS, using its listdir
+    and stat."""
+    retval = []
+    for name in vfs.listdir(selector):
+        try:
+            retval.append((name, vfs.stat(selector.rstrip('/') + '/' + name)))
+        except OSError:
+            retval.append((name, None))
+    return retval
+
+class RangeWritten(Exception):
+    """Raised by RangeWriter once it has passed on all it is to."""
+    pass
+
+class RangeWriter:
+    """A file that passes count bytes, from offset on, of what is
+    written to it on to wfile, and discards the rest."""
+
+    def __init__(self, wfile, offset, count):
+        self.wfile = wfile
+        self.offset = offset
+        self.count = count
+
+    def write(self, data):
+        size = len(data)
+        if self.offset >= size:
+            self.offset -= size
+            return size
+        data = data[self.offset:self.offset + self.count]
+        self.offset = 0
+        self.wfile.write(data)
+        self.count -= len(data)
+        if not self.count:
+            raise RangeWritten()
+        return size
+
+    def flush(self):
+        pass
+
+def copyfile(rfile, wfile, offset = 0, count = None):
+    """Copies count bytes (or the rest) of rfile from offset to wfile."""
+    if offset:
+        rfile.seek(offset)
+    while count == None or count > 0:
+        size = 65536
+        if count != None:
+            size = min(size, count)
+        data = rfile.read(size)
+        if not len(data):
+            break
+        wfile.write(data)
+        if count != None:
+            count -= len(data)
+
+def getsocketfd(wfile):
+    """Returns the file descriptor behind wfile if it is a socket, or
+    None."""
+    try:
+        fd = wfile.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISSOCK(os.fstat(fd)[stat.ST_MODE]):
+        return None
+    return fd
+
+def waitwritable(fd):
+    """Waits for the socket fd to accept more data.  Raises
+    socket.timeout if it does not within its send timeout."""
+    sock = socket.socket(fileno = os.dup(fd))
+    try:
+        output.waitwritable(sock)
+    finally:
+        sock.close()
+
+# Shared by all VFS_Cached objects when entries are kept across requests.
+vfscache = None
+
+class VFS_Cached(VFS_Real):
+    """Wraps another VFS, remembering the results of stat, isdir,
+    isfile, exists and listdir.
+
+    By default, results are kept only as long as this object, which is
+    made afresh for each request.  If the vfscachetime option is set,
+    they are instead shared by all requests for that many seconds.
+    Writes through this object discard what it remembers."""
+
+    def __init__(self, config, chain):
+        self.config = config
+        self.chain = chain
+        self.rootpath = None
+        maxage = settings.get(config).vfscachetime
+        if maxage:
+            global vfscache
+            if vfscache == None:
+                vfscache = cache.LRUCache(settings.get(config).vfscachesize,
+                                          maxage = maxage)
+            self.cache = vfscache
+        else:
+            self.cache = cache.LRUCache(settings.get(config).vfscachesize)
+        self.cachekey = chain.getcachekey()
+
+    def getcachekey(self):
+        return self.cachekey
+
+    def getstats(self):
+        """Returns the hit and miss counters of the cache in use."""
+        return self.cache.getstats()
+
+    def _lookup(self, method, selector):
+        key = (self.cachekey, method, selector)
+        result = self.cache.get(key, self)
+        if result is self:
+            try:
+                result = (0, getattr(self.chain, method)(selector))
+            except OSError as e:
+                result = (1, (type(e), e.args, e.filename))
+            self.cache.put(key, result)
+        failed, value = result
+        if failed:
+            exceptionclass, args, filename = value
+            e = exceptionclass(*args)
+            e.filename = filename
+            raise e
+        return value
+
+    def _changed(self, selector):
+        for method in ['stat', 'isdir', 'isfile', 'exists', 'listdir']:
+            self.cache.remove((self.cachekey, method, selector))
+        for method in ['listdir', 'listdirstat', 'names']:
+            self.cache.remove((self.cachekey, method,
+                               os.path.dirname(selector)))
+
+    def stat(self, selector):
+        return self._lookup('stat', selector)
+
+    def isdir(self, selector):
+        return self._lookup('isdir', selector)
+
+    def isfile(self, selector):
+        return self._lookup('isfile', selector)
+
+    def exists(self, selector):
+        # Answer from the parent's listing, if we have it.
+        names = self._getnames(os.path.dirname(selector))
+        if names != None:
+            return os.path.basename(selector) in names
+        return self._lookup('exists', selector)
+
+    def _getnames(self, selector):
+        """Returns the set of names in the directory selector if it
+        has already been listed, or None."""
+        key = (self.cachekey, 'names', selector)
+        names = self.cache.get(key)
+        if names == None:
+            listing = self.cache.get((self.cachekey, 'listdir', selector))
+            if listing == None or listing[0]:
+                return None
+            names = frozenset(listing[1])
+            self.cache.put(key, names)
+        return names
+
+    def listdir(self, selector):
+        # A copy, since callers may sort or alter what they get.
+        return list(self._lookup('listdir', selector))
+
+    def listdirstat(self, selector):
+        """Also remembers the stat results, so that looking up the
+        entries afterwards costs nothing."""
+        result = self._lookup('listdirstat', selector)
+        base = selector.rstrip('/') + '/'
+        self.cache.put((self.cachekey, 'listdir', selector),
+                       (0, [name for name, statresult in result]))
+        for name, statresult in result:
+            if statresult:
+                self.cache.put((self.cachekey, 'stat', base + name),
+                               (0, statresult))
+                self.cache.put((self.cachekey, 'exists', base + name),
+                               (0, True))
+        return list(result)
+
+    def iswritable(self, selector):
+        return self.chain.iswritable(selector)
+
+    def unlink(self, selector):
+        self._changed(selector)
+        self.chain.unlink(selector)
+
+    def open(self, selector, *args, **kwargs):
+        mode = kwargs.get('mode', args and args[0] or 'r')
+        if 'w' in mode or 'a' in mode or '+' in mode or 'x' in mode:
+            self._changed(selector)
+        return self.chain.open(selector, *args, **kwargs)
+
+    def getrootpath(self):
+        return self.chain.getrootpath()
+
+    def getfspath(self, selector):
+        return self.chain.getfspath(selector)
+
+    def copyto(self, name, fd):
+        self.chain.copyto(name, fd)
+
+    def sendfile(self, selector, wfile, offset = 0, count = None):
+        self.chain.sendfile(selector, wfile, offset, count)
+
 class BaseHandler:
     """Skeleton handler -- includes commonly-used routines."""
     def __init__(self, selector, searchrequest, protocol, config, statresult,
@@ -131,6 +399,16 @@ class BaseHandler:
         handler.  Should be overridden by all subclasses."""
         return 0
 
+    def iscandidate(cls, selector, statresult):
+        """A quick test, made before the handler is even created, for
+        whether canhandlerequest could possibly return true.  It may
+        look only at its arguments.  Subclasses whose canhandlerequest
+        is narrower than their parent's can override it, so that
+        listing a large directory does not build every handler for
+        every file."""
+        return 1
+    iscandidate = classmethod(iscandidate)
+
     def getentry(self):
         """Returns an entry object for this request."""
         if not self.entry:
@@ -174,6 +452,40 @@ class BaseHandler:
         if self.isdir():
             raise Exception("Attempt to use write for a directory")
 
+    def getcontentlength(self):
+        """Returns the number of bytes write() will write, or None if
+        that is not known before writing.  Valid only after prepare."""
+        return None
+
+    def writerange(self, wfile, offset, count):
+        """Writes count bytes of what write() would write, starting at
+        offset.  This runs write() and passes on only that part of what
+        it writes, stopping it once that is done; handlers that can seek
+        should override it."""
+        if count <= 0:
+            return
+        try:
+            self.write(RangeWriter(wfile, offset, count))
+        except RangeWritten:
+            pass
+
+    def getetag(self):
+        """Returns a strong HTTP ETag, quotes included, that changes
+        whenever what write() writes does, or None if there is no such
+        thing.  Valid only after prepare."""
+        return None
+
+    def getprecompressed(self, coding):
+        """Returns (selector, statresult) for a copy of what write()
+        writes, already compressed with the given HTTP content coding
+        ('gzip', 'zstd', ...), or None if there is no such copy.  Valid
+        only after prepare."""
+        return None
+
+    def writeprecompressed(self, wfile, selector):
+        """Writes out a copy found by getprecompressed()."""
+        self.vfs.sendfile(selector, wfile)
+
     def getdirlist(self):
         """Returns a list-like object (list, iterator, tuple, generator, etc)
         that contains as its elements the gopherentry objects corresponding
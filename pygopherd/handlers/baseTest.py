@@ -0,0 +1,104 @@
+import unittest, socket
+from io import BytesIO
+from pygopherd import testutil
+from pygopherd.handlers.base import VFS_Real, VFS_Cached, BaseHandler, copyfile
+
+class VFS_RealTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+        self.vfs = VFS_Real(self.config)
+
+    def testsendfile_socket(self):
+        server, client = socket.socketpair()
+        wfile = server.makefile('wb')
+        self.vfs.sendfile('/testfile.txt', wfile)
+        self.vfs.sendfile('/testfile.txt', wfile, 1, 2)
+        wfile.close()
+        server.close()
+        self.assertEqual(client.makefile('rb').read(), b"Test\nes")
+        client.close()
+
+    def testsendfile_copy(self):
+        wfile = BytesIO()
+        self.vfs.sendfile('/testfile.txt', wfile)
+        self.vfs.sendfile('/testfile.txt', wfile, 1, 2)
+        self.vfs.sendfile('/testfile.txt', wfile, 3)
+        self.assertEqual(wfile.getvalue(), b"Test\nest\n")
+
+    def testcopyfile_shortreads(self):
+        class ShortReader(BytesIO):
+            def read(self, size = -1):
+                return BytesIO.read(self, min(size, 3))
+        wfile = BytesIO()
+        copyfile(ShortReader(b"0123456789"), wfile, 1, 7)
+        self.assertEqual(wfile.getvalue(), b"1234567")
+
+class VFS_CachedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+        self.vfs = VFS_Cached(self.config, VFS_Real(self.config))
+
+    def testcache(self):
+        self.assertEqual(self.vfs.stat('/testfile.txt'),
+                         VFS_Real(self.config).stat('/testfile.txt'))
+        assert self.vfs.isfile('/testfile.txt')
+        assert 'testfile.txt' in self.vfs.listdir('/')
+        self.assertRaises(OSError, self.vfs.stat, '/NONEXISTANT')
+        self.assertEqual(self.vfs.getstats()['misses'], 4)
+
+        self.vfs.stat('/testfile.txt')
+        self.vfs.isfile('/testfile.txt')
+        self.vfs.listdir('/')
+        self.assertRaises(OSError, self.vfs.stat, '/NONEXISTANT')
+        stats = self.vfs.getstats()
+        self.assertEqual(stats['misses'], 4)
+        self.assertEqual(stats['hits'], 4)
+
+    def testwrite(self):
+        self.assertRaises(OSError, self.vfs.stat, '/.cache.vfstest')
+        assert '.cache.vfstest' not in self.vfs.listdir('/')
+        self.vfs.open('/.cache.vfstest', 'wb').close()
+        try:
+            self.assertEqual(self.vfs.stat('/.cache.vfstest')[6], 0)
+            assert '.cache.vfstest' in self.vfs.listdir('/')
+        finally:
+            self.vfs.unlink('/.cache.vfstest')
+        assert not self.vfs.exists('/.cache.vfstest')
+
+    def testlistdirstat(self):
+        names = dict(self.vfs.listdirstat('/'))
+        self.assertEqual(sorted(names), sorted(self.vfs.listdir('/')))
+        hits = self.vfs.getstats()['hits']
+        self.assertEqual(self.vfs.stat('/testfile.txt'), names['testfile.txt'])
+        assert self.vfs.exists('/testfile.txt')
+        self.assertEqual(self.vfs.getstats()['hits'], hits + 2)
+
+    def testexistsfromlisting(self):
+        self.vfs.listdir('/')
+        assert self.vfs.exists('/testfile.txt')
+        assert not self.vfs.exists('/testfile.txt.abstract')
+        assert self.vfs.exists('/testfile.txt.gz.abstract')
+        # Only the listing itself went to the filesystem.
+        self.assertEqual(self.vfs.getstats()['misses'], 2)
+
+class BaseHandlerTestCase(unittest.TestCase):
+    def testwriterange(self):
+        # Handlers that only know how to write the lot still do ranges,
+        # and are stopped once the range is written.
+        class Handler(BaseHandler):
+            def write(self, wfile):
+                for x in range(10):
+                    self.written = x
+                    wfile.write(b"%d" % x * 3)
+            def getcontentlength(self):
+                return 30
+        config = testutil.getconfig()
+        handler = Handler('/', '', testutil.gettestingprotocol("/\n", config),
+                          config, None)
+        wfile = BytesIO()
+        handler.writerange(wfile, 2, 5)
+        self.assertEqual(wfile.getvalue(), b"01112")
+        self.assertEqual(handler.written, 2)
+        wfile = BytesIO()
+        handler.writerange(wfile, 27, 3)
+        self.assertEqual(wfile.getvalue(), b"999")
@@ -19,16 +19,28 @@
 
 import socketserver
 import re
-import os, stat, os.path, mimetypes, time
-from pygopherd import protocols, gopherentry, handlers
+import os, stat, os.path, mimetypes, time, hashlib, tempfile
+from pygopherd import protocols, gopherentry, handlers, settings, cache
 from pygopherd.handlers import base
 from stat import *
 import pickle
 
-cachetime = None
-cachefile = None
+# Finished directory listings, shared by all requests.
+listingcache = None
+
+def getlistingcache(config):
+    global listingcache
+    if listingcache == None:
+        s = settings.get(config)
+        listingcache = cache.LRUCache(None, maxbytes = s.dircachesize,
+                                      maxage = s.dircachetime)
+    return listingcache
 
 class DirHandler(base.BaseHandler):
+    def iscandidate(cls, selector, statresult):
+        return statresult and S_ISDIR(statresult[ST_MODE])
+    iscandidate = classmethod(iscandidate)
+
     def canhandlerequest(self):
         """We can handle the request if it's for a directory."""
         return self.statresult and S_ISDIR(self.statresult[ST_MODE])
@@ -42,16 +54,17 @@ class DirHandler(base.BaseHandler):
     def prep_initfiles(self):
         "Initialize the list of files.  Ignore the files we're suppoed to."
         self.files = []
-        dirfiles = self.vfs.listdir(self.getselector())
-        ignorepatt = self.config.get("handlers.dir.DirHandler", "ignorepatt")
-        for file in dirfiles:
+        # Keep the stat results; the handlers for the files need them.
+        self.filestats = dict(self.vfs.listdirstat(self.getselector()))
+        ignorepatt = settings.get(self.config).ignorepatt
+        for file in self.filestats:
             if self.prep_initfiles_canaddfile(ignorepatt,
                                               self.selectorbase + '/' + file,
                                               file):
                 self.files.append(file)
 
     def prep_initfiles_canaddfile(self, ignorepatt, pattern, file):
-        return not re.search(ignorepatt, pattern)
+        return not ignorepatt.search(pattern)
 
     def prep_entries(self):
         "Generate entries from the list."
@@ -63,7 +76,8 @@ class DirHandler(base.BaseHandler):
             handler = handlers.HandlerMultiplexer.\
                         getHandler(self.selectorbase + '/' \
                                    + file, self.searchrequest, self.protocol,
-                                   self.config, vfs = self.vfs)
+                                   self.config, vfs = self.vfs,
+                                   statresult = self.filestats[file])
             fileentry = handler.getentry()
             self.prep_entriesappend(file, handler, fileentry)
 
@@ -99,44 +113,89 @@ class DirHandler(base.BaseHandler):
         self.savecache()
         return self.fileentries
 
-    def loadcache(self):
-        global cachetime, cachefile
+    def getlistingkey(self):
+        """Returns the key for this listing in the listing cache.  It
+        changes when a file is added to or removed from the directory.
+        Returns None if the listing cannot be cached."""
+        if not self.statresult:
+            return None
+        mtime = getattr(self.statresult, 'st_mtime_ns',
+                        self.statresult[ST_MTIME])
+        return (type(self), self.vfs.getcachekey(), self.selector, mtime,
+                settings.get(self.config))
 
+    def loadcache(self):
         self.fromcache = 0
-        if cachetime == None:
-            cachetime = self.config.getint("handlers.dir.DirHandler",
-                                           "cachetime")
-            cachefile = self.config.get("handlers.dir.DirHandler",
-                                        "cachefile")
-        cachename = self.selector + "/" + cachefile
-        if not self.vfs.iswritable(cachename):
+        if not settings.get(self.config).dircachetime:
             return 0
-
-        try:
-            statval = self.vfs.stat(cachename)
-        except OSError:
+        key = self.getlistingkey()
+        if key == None:
             return 0
-
-        if (time.time() - statval[stat.ST_MTIME] < cachetime):
-            fp = self.vfs.open(cachename, "rb")
-            self.fileentries = pickle.load(fp)
-            fp.close()
-            self.fromcache = 1
-            return 1
-        return 0
+        fileentries = getlistingcache(self.config).get(key)
+        if fileentries == None:
+            fileentries = self.loadsavedlisting(key)
+            if fileentries == None:
+                return 0
+        self.fileentries = fileentries
+        self.fromcache = 1
+        return 1
 
     def savecache(self):
-        global cachefile
-        if self.fromcache:
-            # Don't resave the cache.
+        if self.fromcache or not settings.get(self.config).dircachetime:
             return
-        if not self.vfs.iswritable(self.selector + "/" + cachefile):
+        key = self.getlistingkey()
+        if key == None:
             return
+        fileentries = gopherentry.EntryList(self.fileentries, self.config)
+        data = pickle.dumps((key[3], fileentries), pickle.HIGHEST_PROTOCOL)
+        getlistingcache(self.config).put(key, fileentries, len(data))
+        self.savelisting(key, data)
+
+    def getsavedlistingpath(self, key):
+        """Returns the file in which the listing is saved, or None if
+        listings are not saved."""
+        cachedir = settings.get(self.config).dircachedir
+        if not cachedir:
+            return None
+        name = repr((type(self).__module__, type(self).__name__,
+                     key[1], key[2]))
+        return os.path.join(cachedir,
+                            hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+    def loadsavedlisting(self, key):
+        filename = self.getsavedlistingpath(key)
+        if filename == None:
+            return None
         try:
-            fp = self.vfs.open(self.selector + "/" + cachefile, "wb")
-            pickle.dump(self.fileentries, fp, 1)
-            fp.close()
-        except IOError:
+            fp = open(filename, "rb")
+            try:
+                age = time.time() - os.fstat(fp.fileno())[ST_MTIME]
+                if age >= settings.get(self.config).dircachetime:
+                    return None
+                mtime, fileentries = pickle.load(fp)
+            finally:
+                fp.close()
+        except Exception:
+            return None
+        if mtime != key[3]:
+            return None
+        fileentries.config = self.config
+        getlistingcache(self.config).put(key, fileentries,
+                                         os.path.getsize(filename))
+        return fileentries
+
+    def savelisting(self, key, data):
+        filename = self.getsavedlistingpath(key)
+        if filename == None:
+            return
+        try:
+            fd, tempname = tempfile.mkstemp(dir = os.path.dirname(filename))
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.replace(tempname, filename)
+        except OSError:
             pass
 
     
@@ -0,0 +1,72 @@
+import unittest, tempfile, shutil, os
+from pygopherd import testutil, settings
+from pygopherd.handlers import dir
+
+class DirHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cachedir = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.protocol = testutil.gettestingprotocol("/\n", self.config)
+        open(os.path.join(self.root, 'foo.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.cachedir)
+
+    def getdirlist(self):
+        handler = dir.DirHandler('/', '', self.protocol, self.config,
+                                 os.stat(self.root))
+        handler.prepare()
+        return handler, [x.getselector() for x in handler.getdirlist()]
+
+    def testcache(self):
+        handler, selectors = self.getdirlist()
+        assert not handler.fromcache
+        self.assertEqual(selectors, ['/foo.txt'])
+        handler, selectors = self.getdirlist()
+        assert handler.fromcache
+        self.assertEqual(selectors, ['/foo.txt'])
+
+        open(os.path.join(self.root, 'bar.txt'), 'w').close()
+        os.utime(self.root, (0, 0))
+        handler, selectors = self.getdirlist()
+        assert not handler.fromcache
+        self.assertEqual(selectors, ['/bar.txt', '/foo.txt'])
+
+    def testcachedir(self):
+        self.config.set("handlers.dir.DirHandler", "cachedir", self.cachedir)
+        settings.reset(self.config)
+        handler, selectors = self.getdirlist()
+        self.assertEqual(len(os.listdir(self.cachedir)), 1)
+        dir.getlistingcache(self.config).clear()
+        handler, selectors = self.getdirlist()
+        assert handler.fromcache
+        self.assertEqual(selectors, ['/foo.txt'])
+        self.assertEqual(handler.getdirlist()[0].config, self.config)
+        assert os.listdir(self.root) == ['foo.txt']
+
+    def testnocache(self):
+        self.config.set("handlers.dir.DirHandler", "cachetime", "0")
+        settings.reset(self.config)
+        self.getdirlist()
+        handler, selectors = self.getdirlist()
+        assert not handler.fromcache
+
+    def testlinks(self):
+        # A .Links file mixes LinkEntry items in with the GopherEntry ones.
+        from pygopherd.handlers import UMN
+        with open(os.path.join(self.root, '.Links'), 'w') as fd:
+            fd.write("Name=Remote\nType=1\nPath=1/remote\n"
+                     "Host=gopher.example.com\nPort=70\n")
+        for fromcache in [0, 1]:
+            handler = UMN.UMNDirHandler('/', '', self.protocol, self.config,
+                                        os.stat(self.root))
+            handler.getentry()
+            handler.prepare()
+            self.assertEqual(handler.fromcache, fromcache)
+            entries = handler.getdirlist()
+            self.assertEqual([x.getselector() for x in entries],
+                             ['1/remote', '/foo.txt'])
+            self.assertEqual(entries[0].gethost(), 'gopher.example.com')
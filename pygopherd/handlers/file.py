@@ -18,13 +18,145 @@
 
 import socketserver
 import re
-import os, stat, os.path, mimetypes
-from pygopherd import protocols, gopherentry
+import os, stat, os.path, mimetypes, struct, zlib, bz2, lzma
+from pygopherd import protocols, gopherentry, settings, cache
 from pygopherd.handlers import base
 import pygopherd.pipe
 from stat import *
 
+# Suffixes of the precompressed copies looked for next to files, by
+# HTTP content coding.
+sidecarsuffixes = {'gzip': '.gz', 'zstd': '.zst'}
+
+# The encodings decompressed within the server, each with a function
+# returning a new decompressor.  Others need a program to be named in
+# decompressors.
+builtindecompressors = {
+    'gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'bzip2': bz2.BZ2Decompressor,
+    'xz': lzma.LZMADecompressor}
+
+# Largest piece of compressed or decompressed data held at once.
+decompressblocksize = 65536
+
+# Decompressed files, by getdecompressedkey().
+decompressedcache = None
+
+# Exact decompressed sizes, by getdecompressedkey().
+sizecache = cache.LRUCache(4096)
+
+def getdecompressedcache(config):
+    global decompressedcache
+    if decompressedcache == None:
+        decompressedcache = cache.LRUCache(None, maxbytes = \
+                                settings.get(config).decompresscachesize)
+    return decompressedcache
+
+def decompressblocks(rfile, encoding):
+    """Reads compressed data from rfile, yielding it decompressed in
+    pieces of at most decompressblocksize bytes.  Files made of several
+    compressed streams, one after the other, are handled."""
+    decompressor = None
+    data = b''
+    while True:
+        if decompressor == None or not hasattr(decompressor, 'needs_input'):
+            needsinput = not data
+        else:
+            needsinput = decompressor.needs_input
+        if needsinput:
+            block = rfile.read(decompressblocksize)
+            if not block:
+                if decompressor != None and not decompressor.eof and \
+                   hasattr(decompressor, 'flush'):
+                    # zlib may be holding back output.
+                    block = decompressor.flush()
+                    if block:
+                        yield block
+                if decompressor != None and not decompressor.eof:
+                    raise IOError("Compressed data ends early")
+                return
+            data += block
+        if decompressor == None:
+            # Some compressors pad the end of the file with zeros.
+            data = data.lstrip(b'\0')
+            if not data:
+                continue
+            decompressor = builtindecompressors[encoding]()
+        try:
+            block = decompressor.decompress(data, decompressblocksize)
+        except (zlib.error, OSError, EOFError, lzma.LZMAError) as e:
+            raise IOError("Compressed data is corrupt: %s" % str(e))
+        data = getattr(decompressor, 'unconsumed_tail', b'')
+        if block:
+            yield block
+        if decompressor.eof:
+            data = decompressor.unused_data + data
+            decompressor = None
+
+def readvarint(data, pos):
+    """Reads an xz variable-length integer from data at pos.  Returns
+    it and the position after it."""
+    value = 0
+    for shift in range(0, 63, 7):
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return (value, pos)
+    raise ValueError("Integer too long")
+
+def getxzsize(rfile, filesize):
+    """Returns the decompressed size of an xz file, read from the index
+    at its end, or None if the file is not a single xz stream."""
+    if filesize < 32:
+        return None
+    rfile.seek(-12, 2)
+    footer = rfile.read(12)
+    if len(footer) != 12 or footer[10:] != b'YZ':
+        return None
+    indexsize = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+    if indexsize > filesize - 24:
+        return None
+    rfile.seek(-12 - indexsize, 2)
+    index = rfile.read(indexsize)
+    try:
+        if index[0] != 0:
+            return None
+        records, pos = readvarint(index, 1)
+        size = 0
+        blockssize = 0
+        for i in range(records):
+            unpadded, pos = readvarint(index, pos)
+            uncompressed, pos = readvarint(index, pos)
+            blockssize += (unpadded + 3) & ~3
+            size += uncompressed
+    except (IndexError, ValueError):
+        return None
+    # Anything else in the file means there is more than one stream.
+    if 12 + blockssize + indexsize + 12 != filesize:
+        return None
+    return size
+
+def getgzipsize(rfile, filesize):
+    """Returns the size a gzip file gives for its contents.  This is
+    modulo 2**32, and that of the last member only."""
+    if filesize < 18:
+        return None
+    rfile.seek(-4, 2)
+    return struct.unpack('<I', rfile.read(4))[0]
+
+def getstatetag(statresult):
+    """Returns an HTTP ETag for a file, made from its stat result."""
+    mtime = getattr(statresult, 'st_mtime_ns', None)
+    if mtime == None:
+        mtime = int(statresult[ST_MTIME])
+    return '"%x-%x-%x"' % (statresult[ST_INO], statresult[ST_SIZE], mtime)
+
 class FileHandler(base.BaseHandler):
+    def iscandidate(cls, selector, statresult):
+        return statresult and S_ISREG(statresult[ST_MODE])
+    iscandidate = classmethod(iscandidate)
+
     def canhandlerequest(self):
         """We can handle the request if it's for a file."""
         return self.statresult and S_ISREG(self.statresult[ST_MODE])
@@ -36,29 +168,52 @@ class FileHandler(base.BaseHandler):
         return self.entry
 
     def write(self, wfile):
-        self.vfs.copyto(self.getselector(), wfile)
+        self.vfs.sendfile(self.getselector(), wfile)
 
-decompressors = None
-decompresspatt = None
+    def getcontentlength(self):
+        return self.statresult[ST_SIZE]
+
+    def writerange(self, wfile, offset, count):
+        self.vfs.sendfile(self.getselector(), wfile, offset, count)
+
+    def getetag(self):
+        return getstatetag(self.statresult)
+
+    def getprecompressed(self, coding):
+        """Looks for a copy compressed ahead of time, such as foo.txt.gz
+        for foo.txt.  One older than the file itself is ignored."""
+        if not coding in sidecarsuffixes:
+            return None
+        selector = self.getselector() + sidecarsuffixes[coding]
+        try:
+            statresult = self.vfs.stat(selector)
+        except OSError:
+            return None
+        if not S_ISREG(statresult[ST_MODE]) or \
+           statresult[ST_MTIME] < self.statresult[ST_MTIME]:
+            return None
+        return (selector, statresult)
 
 class CompressedFileHandler(FileHandler):
-    def canhandlerequest(self):
-        self.initdecompressors()
+    def isdecompressible(self, encoding):
+        return encoding in builtindecompressors or \
+               encoding in settings.get(self.config).decompressors
 
+    def canhandlerequest(self):
         # It's OK to call just canhandlerequest() since we're not
         # overriding the security or isrequestforme functions.
         
         return FileHandler.canhandlerequest(self) and \
                self.getentry().realencoding and \
-               self.getentry().realencoding in decompressors and \
-               re.search(decompresspatt, self.selector)
+               self.isdecompressible(self.getentry().realencoding) and \
+               settings.get(self.config).decompresspatt.search(self.selector)
 
     def getentry(self):
         if not self.entry:
             self.entry = FileHandler.getentry(self)
             self.entry.realencoding = None
             if self.entry.getencoding() and \
-               self.entry.getencoding() in decompressors and \
+               self.isdecompressible(self.entry.getencoding()) and \
                self.entry.getencodedmimetype():
                 # When the client gets it, there will not be
                 # encoding.  Therefore, we remove the encoding and switch
@@ -68,25 +223,100 @@ class CompressedFileHandler(FileHandler):
                 self.entry.realencoding = self.entry.encoding
                 self.entry.encoding = None
                 self.entry.type = self.entry.guesstype()
+                self.entry.size = self.getuncompressedsize(exact = 0)
         return self.entry
+
+    def getdecompressedkey(self):
+        return (self.vfs.getcachekey(), self.getselector(),
+                getstatetag(self.statresult))
+
+    def getuncompressedsize(self, exact = 1):
+        """Returns the size of the file once decompressed, or None if
+        that is not known without decompressing it.  Unless exact is
+        set, the size given in a gzip trailer will do, although that is
+        wrong for files of several members or over 4 GiB."""
+        key = self.getdecompressedkey()
+        size = sizecache.get(key)
+        if size != None:
+            return size
+        encoding = self.getentry().realencoding
+        if encoding == 'xz' or (encoding == 'gzip' and not exact):
+            try:
+                with self.vfs.open(self.getselector(), 'rb') as rfile:
+                    if encoding == 'xz':
+                        size = getxzsize(rfile, self.statresult[ST_SIZE])
+                        if size != None:
+                            sizecache.put(key, size)
+                    else:
+                        size = getgzipsize(rfile, self.statresult[ST_SIZE])
+            except (IOError, OSError):
+                return None
+        return size
     
-    def initdecompressors(self):
-        global decompressors, decompresspatt
-        if decompressors == None:
-            decompressors = \
-                eval(self.config.get("handlers.file.CompressedFileHandler",
-                                     "decompressors"))
-            decompresspatt = \
-                self.config.get("handlers.file.CompressedFileHandler",
-                                "decompresspatt")
+    def getcontentlength(self):
+        if not self.getentry().realencoding in builtindecompressors:
+            return None
+        return self.getuncompressedsize()
+
+    def getprecompressed(self, coding):
+        # Clients that accept gzip can have the file as it is.
+        if coding == 'gzip' and self.getentry().realencoding == 'gzip':
+            return (self.getselector(), self.statresult)
+        return None
+
+    def getdecompressed(self):
+        """Yields the file decompressed, in pieces.  Small files are
+        kept, decompressed, for next time."""
+        key = self.getdecompressedkey()
+        cachefilesize = settings.get(self.config).decompresscachefilesize
+        data = getdecompressedcache(self.config).get(key)
+        if data != None:
+            yield data
+            return
+        blocks = []
+        size = 0
+        with self.vfs.open(self.getselector(), 'rb') as rfile:
+            for block in decompressblocks(rfile,
+                                          self.getentry().realencoding):
+                size += len(block)
+                if blocks != None:
+                    blocks.append(block)
+                    if size > cachefilesize:
+                        blocks = None
+                yield block
+        sizecache.put(key, size)
+        if blocks != None:
+            getdecompressedcache(self.config).put(key, b''.join(blocks), size)
 
     def write(self, wfile):
-        global decompressors
-        decompprog = decompressors[self.getentry().realencoding]
-        pygopherd.pipe.pipedata_unix(decompprog, [decompprog],
-                                     childstdin = self.rfile,
-                                     childstdout = wfile,
-                                     pathsearch = 1)
-        self.rfile.close()
-        self.rfile = None
-    
+        encoding = self.getentry().realencoding
+        if encoding in builtindecompressors:
+            for block in self.getdecompressed():
+                wfile.write(block)
+            return
+        decompprog = settings.get(self.config).decompressors[encoding]
+        rfile = self.vfs.open(self.getselector(), 'rb')
+        try:
+            wfile.flush()
+            pygopherd.pipe.pipedata_unix(decompprog, [decompprog],
+                                         childstdin = rfile,
+                                         childstdout = wfile,
+                                         pathsearch = 1)
+        finally:
+            rfile.close()
+
+    def writerange(self, wfile, offset, count):
+        blocks = self.getdecompressed()
+        try:
+            for block in blocks:
+                if offset >= len(block):
+                    offset -= len(block)
+                    continue
+                block = block[offset:offset + count]
+                offset = 0
+                wfile.write(block)
+                count -= len(block)
+                if not count:
+                    break
+        finally:
+            blocks.close()
@@ -0,0 +1,81 @@
+import unittest, tempfile, shutil, os, gzip, bz2, lzma
+from io import BytesIO
+from pygopherd import testutil
+from pygopherd.handlers import file
+
+class CompressedFileHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.protocol = testutil.gettestingprotocol("/\n", self.config)
+        # Several blocks' worth, and not too compressible.
+        self.data = b"".join([b"%d\n" % (x * x) for x in range(40000)])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def gethandler(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+        handler = file.CompressedFileHandler('/' + name, '', self.protocol,
+                                             self.config, os.stat(path))
+        assert handler.canhandlerequest()
+        handler.prepare()
+        return handler
+
+    def getwritten(self, handler):
+        wfile = BytesIO()
+        handler.write(wfile)
+        return wfile.getvalue()
+
+    def testdecompress(self):
+        for name, compress in [('foo.txt.gz', gzip.compress),
+                               ('foo.txt.bz2', bz2.compress),
+                               ('foo.txt.xz', lzma.compress)]:
+            handler = self.gethandler(name, compress(self.data))
+            self.assertEqual(handler.getentry().getmimetype(), 'text/plain')
+            self.assertEqual(self.getwritten(handler), self.data)
+            # Too big to be kept, but the size is remembered.
+            self.assertEqual(handler.getcontentlength(), len(self.data))
+
+            wfile = BytesIO()
+            handler.writerange(wfile, 70000, 100000)
+            self.assertEqual(wfile.getvalue(), self.data[70000:170000])
+
+    def testmultistream(self):
+        for name, compress in [('foo.txt.gz', gzip.compress),
+                               ('foo.txt.bz2', bz2.compress),
+                               ('foo.txt.xz', lzma.compress)]:
+            handler = self.gethandler(name, compress(b"one\n") +
+                                      compress(b"two\n"))
+            self.assertEqual(self.getwritten(handler), b"one\ntwo\n")
+
+    def testcorrupt(self):
+        handler = self.gethandler('foo.txt.gz', gzip.compress(self.data)[:-20])
+        self.assertRaises(IOError, self.getwritten, handler)
+        handler = self.gethandler('bar.txt.gz', b"\x1f\x8bnonsense")
+        self.assertRaises(IOError, self.getwritten, handler)
+
+    def testsize(self):
+        # Gopher+ clients are told the size once decompressed.
+        handler = self.gethandler('foo.txt.gz', gzip.compress(self.data))
+        self.assertEqual(handler.getentry().getsize(), len(self.data))
+        self.assertEqual(handler.getcontentlength(), None)
+        handler = self.gethandler('foo.txt.xz', lzma.compress(self.data))
+        self.assertEqual(handler.getentry().getsize(), len(self.data))
+        self.assertEqual(handler.getcontentlength(), len(self.data))
+        handler = self.gethandler('foo.txt.bz2', bz2.compress(self.data))
+        self.assertEqual(handler.getentry().getsize(), None)
+
+    def testcache(self):
+        handler = self.gethandler('small.txt.bz2', bz2.compress(b"small\n"))
+        self.assertEqual(self.getwritten(handler), b"small\n")
+        self.assertEqual(handler.getcontentlength(), 6)
+        # Now served from memory, even if the file goes away.
+        os.unlink(os.path.join(self.root, 'small.txt.bz2'))
+        self.assertEqual(self.getwritten(handler), b"small\n")
+        wfile = BytesIO()
+        handler.writerange(wfile, 1, 3)
+        self.assertEqual(wfile.getvalue(), b"mal")
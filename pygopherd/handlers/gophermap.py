@@ -26,6 +26,12 @@ from stat import *
 class BuckGophermapHandler(base.BaseHandler):
     """Bucktooth selector handler.  Adheres to the specification
     at gopher://gopher.floodgap.com:70/0/buck/dbrowse%3Ffaquse%201"""
+    def iscandidate(cls, selector, statresult):
+        return statresult and (S_ISDIR(statresult[ST_MODE]) or \
+                               (S_ISREG(statresult[ST_MODE]) and \
+                                selector.endswith(".gophermap")))
+    iscandidate = classmethod(iscandidate)
+
     def canhandlerequest(self):
         """We can handle the request if it's for a directory AND
         the directory has a gophermap file."""
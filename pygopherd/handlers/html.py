@@ -22,6 +22,7 @@ import socketserver
 import re
 import os, stat, os.path, mimetypes
 from pygopherd import protocols, gopherentry
+import pygopherd.fileext
 from pygopherd.gopherentry import GopherEntry
 import html.entities
 from stat import *
@@ -61,7 +62,7 @@ class HTMLFileTitleHandler(FileHandler):
     HTML title.  It is a clone of the UMN gsfindhtmltitle function."""
     def canhandlerequest(self):
         if FileHandler.canhandlerequest(self):
-            mimetype, encoding = mimetypes.guess_type(self.selector)
+            mimetype = pygopherd.fileext.lookup(self.selector, self.config)[0]
             return mimetype == 'text/html'
         else:
             return 0
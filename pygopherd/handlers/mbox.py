@@ -63,6 +63,11 @@ class FolderHandler(Virtual):
         return self.entries
 
 class MessageHandler(Virtual):
+    def iscandidate(cls, selector, statresult):
+        # Messages are always named with arguments.
+        return selector.find("?") != -1 or selector.find("|") != -1
+    iscandidate = classmethod(iscandidate)
+
     def canhandlerequest(self):
         """We put MBOX-MESSAGE in here so we don't have to re-check
         the first line of the mbox file before returning a true or false
@@ -131,6 +136,10 @@ class MessageHandler(Virtual):
 ###########################################################################
 
 class MBoxFolderHandler(FolderHandler):
+    def iscandidate(cls, selector, statresult):
+        return statresult and S_ISREG(statresult[ST_MODE])
+    iscandidate = classmethod(iscandidate)
+
     def canhandlerequest(self):
         """Figure out if this is a handleable request."""
 
@@ -175,6 +184,10 @@ class MBoxMessageHandler(MessageHandler):
 ###########################################################################
 
 class MaildirFolderHandler(FolderHandler):
+    def iscandidate(cls, selector, statresult):
+        return statresult and S_ISDIR(statresult[ST_MODE])
+    iscandidate = classmethod(iscandidate)
+
     def canhandlerequest(self):
         if not isinstance(self.vfs, VFS_Real):
             return 0
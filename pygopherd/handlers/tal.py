@@ -43,7 +43,7 @@ if haslogging:
 
 
 from pygopherd.handlers.file import FileHandler
-from pygopherd import gopherentry
+from pygopherd import gopherentry, settings
 import re, os.path
 
 class TALLoader:
@@ -97,9 +97,7 @@ class TALFileHandler(FileHandler):
         if not canhandle:
             return 0
         self.talbasename = self.getselector()[:-4]
-        self.allowpythonpath = 1
-        if self.config.has_option('handlers.tal.TALFileHandler', 'allowpythonpath'):
-            self.allowpythonpath = self.config.getboolean('handlers.tal.TALFileHandler', 'allowpythonpath')
+        self.allowpythonpath = settings.get(self.config).allowpythonpath
         return 1
 
     def getentry(self):
@@ -116,6 +114,16 @@ class TALFileHandler(FileHandler):
 
         return self.entry
 
+    def getcontentlength(self):
+        return None
+
+    def getetag(self):
+        # Templates may produce something different every time.
+        return None
+
+    def getprecompressed(self, coding):
+        return None
+
     def write(self, wfile):
         rfile = self.vfs.open(self.getselector())
         context = simpleTALES.Context(allowPythonPath = self.allowpythonpath)
@@ -0,0 +1,550 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: tar transparent handling
+# Copyright (C) 2002-2019 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import stat, unittest, os.path, tarfile, zlib, bisect, io
+from pygopherd.handlers import base
+from pygopherd.handlers.ZIP import ZIPHandler
+from pygopherd import settings, cache
+
+# Uncompressed bytes between the points from which a compressed archive
+# can be read without starting over.  Each point costs some 40 KiB.
+checkpointinterval = 4194304
+
+# Largest piece of compressed data read at once.
+tarblocksize = 65536
+
+# Most symbolic links followed while looking up one path.
+maxlinks = 32
+
+# Indexed archives, shared between requests, by (chain key, filename).
+tarpool = None
+
+def gettarpool(config):
+    global tarpool
+    if tarpool == None:
+        tarpool = cache.LRUCache(settings.get(config).tarpoolsize)
+    return tarpool
+
+def gettarkey(chain, tarfilename):
+    """Returns the cache key of the VFS for tarfilename.  It changes
+    when the archive does."""
+    statval = chain.stat(tarfilename)
+    return ('tar', chain.getcachekey(), tarfilename,
+            statval[stat.ST_MTIME], statval[stat.ST_SIZE])
+
+def getvfs(config, chain, tarfilename):
+    """Returns a VFS_Tar for tarfilename, reusing the one made for an
+    earlier request, and so its index, if the archive has not changed
+    since."""
+    key = gettarkey(chain, tarfilename)
+    poolkey = (key[1], tarfilename)
+    pool = gettarpool(config)
+    vfs = pool.get(poolkey)
+    if vfs == None or vfs.getcachekey() != key:
+        vfs = VFS_Tar(config, chain, tarfilename)
+        vfs.cachekey = key
+        pool.put(poolkey, vfs)
+    return vfs
+
+def normpath(path):
+    """Returns a member path without leading slashes or dots, or '' for
+    the top of the archive."""
+    path = os.path.normpath('/' + path).lstrip('/')
+    if path == '.':
+        return ''
+    return path
+
+class GzipReader:
+    """Reads a gzip file as if it were not compressed, with seeking.
+
+    checkpoints is a sorted list of (uncompressed offset, compressed
+    offset, decompressor) that reading may start from, and may be
+    shared between readers.  If record is set, new ones are added to
+    it every checkpointinterval bytes as the file is read."""
+
+    def __init__(self, rfile, checkpoints, record = 0):
+        self.rfile = rfile
+        self.checkpoints = checkpoints
+        self.record = record
+        if not checkpoints:
+            checkpoints.append((0, 0,
+                                zlib.decompressobj(16 + zlib.MAX_WBITS)))
+        self._restart(0)
+
+    def _restart(self, pos):
+        """Goes back to the last checkpoint at or before pos."""
+        index = bisect.bisect_right(self.checkpoints, (pos, float('inf'))) - 1
+        self.pos, self.consumed, decompressor = self.checkpoints[index]
+        self.decompressor = decompressor.copy()
+        self.rfile.seek(self.consumed)
+        self.unconsumed = b''
+        self.pending = b''
+
+    def _fill(self):
+        """Decompresses some more into self.pending.  Returns false at
+        the end of the file."""
+        produced = self.pos + len(self.pending)
+        if self.record and \
+           produced >= self.checkpoints[-1][0] + checkpointinterval:
+            self.checkpoints.append((produced, self.consumed,
+                                     self.decompressor.copy()))
+        if self.decompressor.eof:
+            return 0
+        if not self.unconsumed:
+            self.unconsumed = self.rfile.read(tarblocksize)
+            if not self.unconsumed:
+                raise IOError("Compressed data ends early")
+        try:
+            block = self.decompressor.decompress(self.unconsumed,
+                                                 tarblocksize)
+        except zlib.error as e:
+            raise IOError("Compressed data is corrupt: %s" % str(e))
+        tail = self.decompressor.unconsumed_tail
+        self.consumed += len(self.unconsumed) - len(tail)
+        self.unconsumed = tail
+        self.pending += block
+        return 1
+
+    def read(self, size = -1):
+        while size < 0 or len(self.pending) < size:
+            if not self._fill():
+                break
+        if size < 0:
+            size = len(self.pending)
+        data = self.pending[:size]
+        self.pending = self.pending[size:]
+        self.pos += len(data)
+        return data
+
+    def seek(self, pos, whence = 0):
+        if whence == 1:
+            pos += self.pos
+        elif whence != 0:
+            raise IOError("Cannot seek from the end of a compressed file")
+        index = bisect.bisect_right(self.checkpoints, (pos, float('inf'))) - 1
+        if pos < self.pos or \
+           self.checkpoints[index][0] > self.pos + len(self.pending):
+            self._restart(pos)
+        while self.pos < pos:
+            if not self.pending and not self._fill():
+                break
+            skip = min(len(self.pending), pos - self.pos)
+            self.pending = self.pending[skip:]
+            self.pos += skip
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.rfile.close()
+
+class TarMemberFile(io.RawIOBase):
+    """A read-only file for one member of an archive: size bytes from
+    offset in rfile."""
+
+    def __init__(self, rfile, offset, size):
+        self.rfile = rfile
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.size - self.pos)
+        if size <= 0:
+            return 0
+        self.rfile.seek(self.offset + self.pos)
+        data = self.rfile.read(size)
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, pos, whence = 0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = max(0, pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if not self.closed:
+            self.rfile.close()
+        io.RawIOBase.close(self)
+
+class VFS_Tar(base.VFS_Real):
+    """Gives access to the contents of a tar archive, compressed with
+    gzip or not.  The archive is read through once, to make an index of
+    where each member lies; after that, members are read directly.  For
+    compressed archives, decompression starts from the checkpoint
+    nearest the member."""
+
+    def __init__(self, config, chain, tarfilename):
+        self.config = config
+        self.chain = chain
+        self.tarfilename = tarfilename
+        self.cachekey = None
+        self._inittar()
+
+    def getcachekey(self):
+        if self.cachekey == None:
+            self.cachekey = gettarkey(self.chain, self.tarfilename)
+        return self.cachekey
+
+    def _opentar(self):
+        """Opens the archive, as it is once decompressed."""
+        rfile = self.chain.open(self.tarfilename, 'rb')
+        if self.compressed:
+            return GzipReader(rfile, self.checkpoints)
+        return rfile
+
+    def _inittar(self):
+        # Paths of members, and of the directories they imply, to
+        # (is a directory, data offset, size, mtime).
+        self.entries = {'': (1, 0, 0, 0)}
+        # Directories to the names in them.
+        self.dirs = {'': set()}
+        # Links to what they point to, relative to the archive's top
+        # if it starts with a slash and to the link's directory if not.
+        self.links = {}
+        self.checkpoints = []
+
+        rfile = self.chain.open(self.tarfilename, 'rb')
+        try:
+            self.compressed = rfile.read(2) == b'\x1f\x8b'
+            rfile.seek(0)
+            if self.compressed:
+                rfile = GzipReader(rfile, self.checkpoints, record = 1)
+            archive = tarfile.open(fileobj = rfile, mode = 'r:')
+            for info in archive:
+                self._addmember(info)
+        except tarfile.TarError as e:
+            raise IOError("Cannot read %s: %s" % (self.tarfilename, str(e)))
+        finally:
+            rfile.close()
+        # Links that lead nowhere are left out of listings, since they
+        # cannot be served.
+        for path in self.links:
+            try:
+                self._resolve(path)
+            except KeyError:
+                parent, name = os.path.split(path)
+                self.dirs[parent].discard(name)
+        self.dirs = dict([(path, sorted(names)) for path, names in \
+                          self.dirs.items()])
+
+    def _adddir(self, path):
+        while not path in self.dirs:
+            self.dirs[path] = set()
+            if not path in self.entries or not self.entries[path][0]:
+                self.entries[path] = (1, 0, 0, 0)
+            parent, name = os.path.split(path)
+            self.dirs.setdefault(parent, set()).add(name)
+            path = parent
+
+    def _addmember(self, info):
+        path = normpath(info.name)
+        if path == '':
+            return
+        parent, name = os.path.split(path)
+        self._adddir(parent)
+        self.dirs[parent].add(name)
+        self.links.pop(path, None)
+        if info.isdir():
+            self.entries[path] = (1, 0, 0, info.mtime)
+            self._adddir(path)
+        elif info.issym():
+            self.links[path] = info.linkname
+        elif info.islnk():
+            self.links[path] = '/' + normpath(info.linkname)
+        elif info.isreg():
+            self.entries[path] = (0, info.offset_data, info.size, info.mtime)
+        else:
+            # Devices and such cannot be served.
+            self.dirs[parent].discard(name)
+
+    def _resolve(self, fspath):
+        """Returns the path of the entry fspath refers to, with links
+        followed.  Raises KeyError if there is none."""
+        parts = [x for x in fspath.split('/') if x]
+        resolved = ''
+        links = 0
+        while parts:
+            item = parts.pop(0)
+            path = os.path.join(resolved, item)
+            if path in self.links:
+                links += 1
+                if links > maxlinks:
+                    raise KeyError("Too many links in %s" % fspath)
+                target = self.links[path]
+                if not target.startswith('/'):
+                    target = os.path.join('/' + resolved, target)
+                parts = [x for x in normpath(target).split('/') if x] + parts
+                resolved = ''
+                continue
+            if not path in self.entries:
+                raise KeyError("Couldn't find %s" % path)
+            resolved = path
+        return resolved
+
+    def _getentry(self, selector):
+        return self.entries[self._resolve(self.getfspath(selector))]
+
+    def iswritable(self, selector):
+        return 0
+
+    def unlink(self, selector):
+        raise NotImplementedError("VFS_Tar cannot unlink files.")
+
+    def getfspath(self, selector):
+        return selector[len(self.tarfilename):].strip('/')
+
+    def stat(self, selector):
+        try:
+            isdir, offset, size, mtime = self._getentry(selector)
+        except KeyError:
+            raise OSError("Entry %s does not exist in %s" % \
+                          (selector, self.tarfilename))
+        if isdir:
+            return (16877, 0, 0, 3, 0, 0, 0, mtime, mtime, mtime)
+        # The inode goes into HTTP ETags, so make it tell members apart.
+        return (33188, offset, 0, 1, 0, 0, size, mtime, mtime, mtime)
+
+    def isdir(self, selector):
+        try:
+            return self._getentry(selector)[0]
+        except KeyError:
+            return 0
+
+    def isfile(self, selector):
+        try:
+            return not self._getentry(selector)[0]
+        except KeyError:
+            return 0
+
+    def exists(self, selector):
+        try:
+            self._getentry(selector)
+            return 1
+        except KeyError:
+            return 0
+
+    def open(self, selector, *args, **kwargs):
+        try:
+            isdir, offset, size, mtime = self._getentry(selector)
+        except KeyError:
+            raise IOError("Request to open %s, which does not exist" % selector)
+        if isdir:
+            raise IOError("Request to open %s, which is a directory" % selector)
+        return io.BufferedReader(TarMemberFile(self._opentar(), offset, size),
+                                 tarblocksize)
+
+    def sendfile(self, selector, wfile, offset = 0, count = None):
+        """Members of archives that are not compressed go straight from
+        the archive file, with os.sendfile where possible."""
+        try:
+            isdir, dataoffset, size, mtime = self._getentry(selector)
+        except KeyError:
+            isdir = 1
+        if isdir or self.compressed:
+            base.VFS_Real.sendfile(self, selector, wfile, offset, count)
+            return
+        if count == None or offset + count > size:
+            count = max(0, size - offset)
+        self.chain.sendfile(self.tarfilename, wfile, dataoffset + offset,
+                            count)
+
+    def copyto(self, name, fd):
+        self.sendfile(name, fd)
+
+    def listdir(self, selector):
+        try:
+            path = self._resolve(self.getfspath(selector))
+        except KeyError:
+            raise OSError("listdir on %s failed: no such file or directory" % selector)
+        if not path in self.dirs:
+            raise OSError("listdir on %s failed: that is a file, not a directory" % selector)
+        return list(self.dirs[path])
+
+    def listdirstat(self, selector):
+        return base.listdirstat(self, selector)
+
+class TestVFS_Tar(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from pygopherd import testutil
+        self.config = testutil.getconfig()
+        self.real = base.VFS_Real(self.config)
+        self.root = tempfile.mkdtemp()
+        self.tempconfig = testutil.getconfig()
+        self.tempconfig.set("pygopherd", "root", self.root)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def maketar(self, name, mode, members, links = []):
+        """Makes a tar file under the temporary root."""
+        from io import BytesIO
+        archive = tarfile.open(os.path.join(self.root, name), mode)
+        for path, data in members:
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            info.mtime = 1000000000
+            archive.addfile(info, BytesIO(data))
+        for path, target in links:
+            info = tarfile.TarInfo(path)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            archive.addfile(info)
+        archive.close()
+        return VFS_Tar(self.tempconfig, base.VFS_Real(self.tempconfig),
+                       '/' + name)
+
+    def testtestdata(self):
+        for name in ['/testarchive.tar', '/testarchive.tar.gz',
+                     '/testarchive.tgz']:
+            vfs = VFS_Tar(self.config, self.real, name)
+            self.assertEqual(vfs.listdir(name), ['testfile.txt'])
+            assert vfs.isdir(name)
+            assert vfs.isfile(name + '/testfile.txt')
+            assert not vfs.exists(name + '/nonexistant')
+            self.assertEqual(vfs.stat(name + '/testfile.txt')[6], 5)
+            self.assertEqual(vfs.open(name + '/testfile.txt').read(),
+                             b"Test\n")
+            self.assertRaises(IOError, vfs.open, name)
+            self.assertRaises(OSError, vfs.stat, name + '/nonexistant')
+
+    def testcheckpoints(self):
+        global checkpointinterval
+        members = [('dir/file%d' % x, (b"%d\n" % x) * 3000)
+                   for x in range(20)]
+        saved = checkpointinterval
+        checkpointinterval = 16384
+        try:
+            vfs = self.maketar('test.tar.gz', 'w:gz', members)
+        finally:
+            checkpointinterval = saved
+        assert len(vfs.checkpoints) > 2
+        self.assertEqual(vfs.listdir('/test.tar.gz'), ['dir'])
+        # Read out of order, to go back and forth between checkpoints.
+        for path, data in reversed(members):
+            rfile = vfs.open('/test.tar.gz/' + path)
+            self.assertEqual(rfile.read(), data)
+            rfile.seek(5)
+            self.assertEqual(rfile.read(10), data[5:15])
+            rfile.close()
+
+    def testsendfile(self):
+        from io import BytesIO
+        for name, mode in [('test.tar', 'w'), ('test.tgz', 'w:gz')]:
+            vfs = self.maketar(name, mode, [('a', b"first"),
+                                            ('b', b"second")])
+            wfile = BytesIO()
+            vfs.sendfile('/' + name + '/b', wfile)
+            vfs.sendfile('/' + name + '/a', wfile, 1, 3)
+            vfs.copyto('/' + name + '/a', wfile)
+            self.assertEqual(wfile.getvalue(), b"secondirsfirst")
+
+    def testlinks(self):
+        vfs = self.maketar('links.tar', 'w',
+                           [('real.txt', b"real\n"),
+                            ('sub/real2.txt', b"real2\n")],
+                           [('linked.txt', 'real.txt'),
+                            ('sub/up.txt', '../real.txt'),
+                            ('linktosub', 'sub'),
+                            ('sub/self', '.'),
+                            ('loop', 'loop'),
+                            ('dangling', 'nonexistant')])
+        self.assertEqual(vfs.listdir('/links.tar'),
+                         ['linked.txt', 'linktosub', 'real.txt', 'sub'])
+        self.assertEqual(vfs.open('/links.tar/linked.txt').read(), b"real\n")
+        self.assertEqual(vfs.open('/links.tar/sub/up.txt').read(), b"real\n")
+        self.assertEqual(vfs.open('/links.tar/linktosub/self/real2.txt').read(),
+                         b"real2\n")
+        assert vfs.isdir('/links.tar/linktosub')
+        self.assertEqual(vfs.listdir('/links.tar/linktosub'),
+                         ['real2.txt', 'self', 'up.txt'])
+        assert not vfs.exists('/links.tar/loop')
+        assert not vfs.exists('/links.tar/dangling')
+
+    def gethandled(self, selector):
+        """Returns what is sent for selector over gopher."""
+        from io import BytesIO
+        from pygopherd import testutil
+        from pygopherd.protocols.rfc1436 import GopherProtocol
+        rfile = BytesIO(selector + b"\n")
+        wfile = BytesIO()
+        handler = testutil.gettestinghandler(rfile, wfile, self.tempconfig)
+        proto = GopherProtocol(selector.decode() + "\n", handler.server,
+                               handler, rfile, wfile, self.tempconfig)
+        proto.handle()
+        return wfile.getvalue()
+
+    def testhandler(self):
+        from pygopherd import testutil
+        from pygopherd.handlers import HandlerMultiplexer
+        testutil.getstringlogger()
+        self.maketar('sw.tar', 'w', [('pkg/README', b"Read me\n")],
+                     [('pkg/broken', 'missing')])
+        self.tempconfig.set("handlers.tar.TarHandler", "enabled", "true")
+        handlerlist = self.tempconfig.get("handlers.HandlerMultiplexer",
+                                          "handlers").strip()
+        handlerlist = handlerlist[0] + 'tar.TarHandler, ' + handlerlist[1:]
+        self.tempconfig.set("handlers.HandlerMultiplexer", "handlers",
+                            handlerlist)
+        HandlerMultiplexer.handlers = None
+        try:
+            menu = self.gethandled(b"/sw.tar/pkg")
+            self.assertEqual(self.gethandled(b"/sw.tar/pkg/README"),
+                             b"Read me\n")
+        finally:
+            HandlerMultiplexer.handlers = None
+        assert b"\t/sw.tar/pkg/README\t" in menu
+        assert not b"broken" in menu
+
+    def testpool(self):
+        vfs = getvfs(self.config, self.real, '/testarchive.tgz')
+        assert getvfs(self.config, self.real, '/testarchive.tgz') is vfs
+
+class TarHandler(ZIPHandler):
+    """Like ZIPHandler, but for tar archives."""
+
+    def isenabled(self):
+        return settings.get(self.config).tarenabled
+
+    def getpattern(self):
+        return settings.get(self.config).tarpattern
+
+    def isarchivefile(self, fspath):
+        try:
+            return tarfile.is_tarfile(fspath)
+        except (IOError, OSError, EOFError, zlib.error):
+            return 0
+
+    def getarchivevfs(self):
+        return getvfs(self.config, self.vfs, self.basename)
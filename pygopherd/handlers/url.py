@@ -19,7 +19,7 @@
 import socketserver
 import re
 import os, stat, os.path, mimetypes
-from pygopherd import protocols, gopherentry, handlers
+from pygopherd import protocols, gopherentry, handlers, settings
 from pygopherd.handlers.base import BaseHandler
 
 class HTMLURLHandler(BaseHandler):
@@ -39,6 +39,10 @@ class HTMLURLHandler(BaseHandler):
                self.selector.find('"') == -1 and \
                self.selector.find("\r") == -1
 
+    def iscandidate(cls, selector, statresult):
+        return selector.find("URL:") != -1
+    iscandidate = classmethod(iscandidate)
+
     def canhandlerequest(self):
         """We can handle the request if it's for something that starts
         with http or https."""
@@ -90,7 +94,7 @@ class URLTypeRewriter(BaseHandler):
                self.selector[2] == '/'
 
     def gethandler(self):
-        handlerlist = [x for x in handlers.HandlerMultiplexer.handlers if
+        handlerlist = [x for x in settings.get(self.config).handlers if
                        x != URLTypeRewriter]
         return handlers.HandlerMultiplexer.getHandler(self.selector[2:],
                                              self.searchrequest, self.protocol,
@@ -24,6 +24,7 @@ import socket, os, sys, socketserver, re, stat, os.path, tempfile
 import time, atexit, errno, struct
 
 from pygopherd import handlers, protocols, GopherExceptions, logger, sighandlers
+from pygopherd import servers, settings, output
 from pygopherd.protocols import *
 from pygopherd.protocols import ProtocolMultiplexer
 from pygopherd.handlers import *
@@ -60,10 +61,11 @@ def initmimetypes(config):
 
 
     configencoding = eval(config.get("pygopherd", "encoding"))
+    # init() starts over from the default encodings, so ours go in after.
+    mimetypes.init(mimetypesfiles)
     mimetypes.encodings_map.clear()
     for key, value in configencoding:
         mimetypes.encodings_map[key] = value
-    mimetypes.init(mimetypesfiles)
     logger.log("mimetypes initialized with files: " + str(mimetypesfiles))
 
     # Set up the inverse mapping file.
@@ -71,19 +73,77 @@ def initmimetypes(config):
     pygopherd.fileext.init()
 
 class GopherRequestHandler(socketserver.StreamRequestHandler):
+    # Whether handle() may serve more than one request per connection.
+    cankeepalive = 1
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        if isinstance(self.connection, socket.socket):
+            s = settings.get(self.server.config)
+            self.wfile = output.SocketWriter(self.connection,
+                                             s.outputbuffersize,
+                                             s.outputcork, s.outputnodelay)
+
+    def endresponse(self):
+        """Sends the client whatever of the response is still buffered."""
+        if isinstance(self.wfile, output.SocketWriter):
+            self.wfile.endresponse()
+        else:
+            self.wfile.flush()
+
     def handle(self):
+        self.requestcount = 1
         request = self.rfile.readline()
-
-        protohandler = \
-                     ProtocolMultiplexer.getProtocol(request, \
-                     self.server, self, self.rfile, self.wfile, self.server.config)
+        self.handleprotocol(self.getprotocol(request))
+        # A protocol that supports persistent connections sets
+        # keepalive if the client may send another request.
+        while self.keepalive:
+            request = self.readidle()
+            if not request:
+                break
+            self.requestcount += 1
+            self.handleprotocol(self.getprotocol(request))
+
+    def readidle(self):
+        """Reads the next request line on a persistent connection.
+        Returns an empty string if none comes within the keep-alive
+        timeout."""
+        if not isinstance(self.connection, socket.socket):
+            return self.rfile.readline()
+        oldtimeout = self.connection.gettimeout()
+        self.connection.settimeout(
+            settings.get(self.server.config).httpkeepalivetimeout)
+        try:
+            return self.rfile.readline()
+        except OSError:
+            return b''
+        finally:
+            self.connection.settimeout(oldtimeout)
+
+    def getprotocol(self, request):
+        """Finds the protocol object for the raw request line.  Server
+        types that read the request line themselves call this and
+        handleprotocol directly instead of handle."""
+        # Forget anything left over from an earlier request on this
+        # connection.
+        self.keepalive = 0
+        if hasattr(self, 'pygopherd_http_slurped'):
+            del self.pygopherd_http_slurped
+        return ProtocolMultiplexer.getProtocol(
+            request.decode(encoding = 'cp437'),
+            self.server, self, self.rfile, self.wfile, self.server.config)
+
+    def handleprotocol(self, protohandler):
         try:
             protohandler.handle()
+            self.endresponse()
         except socket.error as e:
-            if not (e[0] in [errno.ECONNRESET, errno.EPIPE]):
+            self.keepalive = 0
+            if not (e.errno in [errno.ECONNRESET, errno.EPIPE]):
                 traceback.print_exc()
             GopherExceptions.log(sys.exc_info()[1], protohandler, None)
         except:
+            self.keepalive = 0
             if GopherExceptions.tracebacks:
                 # Yes, this may be invalid.  Not much else we can do.
                 #traceback.print_exc(file = self.wfile)
@@ -91,9 +151,14 @@ class GopherRequestHandler(socketserver.StreamRequestHandler):
             GopherExceptions.log(sys.exc_info()[1], protohandler, None)
 
 def getserverobject(config):
-    # Pick up the server type from the config.
+    # Pick up the server type from the config.  Our own server types
+    # take precedence over the ones in socketserver.
 
-    servertype = eval("socketserver." + config.get("pygopherd", "servertype"))
+    servertypename = config.get("pygopherd", "servertype")
+    if hasattr(servers, servertypename):
+        servertype = getattr(servers, servertypename)
+    else:
+        servertype = eval("socketserver." + servertypename)
 
     class MyServer(servertype):
         allow_reuse_address = 1
@@ -128,6 +193,10 @@ def getserverobject(config):
         servername = config.get('pygopherd', 'interface')
         interface = config.get('pygopherd', 'interface')
 
+    # Server types that need the configuration while binding pick it up
+    # from here.
+    MyServer.config = config
+
     try:
         s = MyServer((interface, config.getint('pygopherd', 'port')),
                      GopherRequestHandler)
@@ -168,6 +237,11 @@ def initsecurity(config):
         os.setreuid(idsetuid, idsetuid)
         logger.log("Switched to uid %d" % idsetuid)
 
+def initsettings(config):
+    settings.reset(config)
+    settings.get(config)
+    logger.log("Settings compiled.")
+
 def initconditionaldetach(config):
     if config.getboolean("pygopherd", "detach"):
         pid = os.fork()
@@ -207,6 +281,7 @@ def initeverything(conffile):
     pgrp = initpgrp(config)
     initsighandlers(config, pgrp)
     initsecurity(config)
+    initsettings(config)
     os.chdir(config.get("pygopherd", "root"))
 
     logger.log("Running.  Root is '%s'" % config.get("pygopherd", "root"))
@@ -0,0 +1,138 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: buffered output to client sockets
+# Copyright (C) 2002-2019 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import socket, select, struct
+
+# Most buffers passed to a single sendmsg call.
+maxiov = 1024
+
+def waitwritable(sock):
+    """Waits for sock to accept more data.  Raises socket.timeout if it
+    does not within its send timeout."""
+    timeout = struct.unpack("ll", sock.getsockopt(socket.SOL_SOCKET,
+                                                  socket.SO_SNDTIMEO,
+                                                  struct.calcsize("ll")))
+    timeout = timeout[0] + timeout[1] / 1000000.0
+    if not select.select([], [sock], [], timeout or None)[1]:
+        raise socket.timeout("timed out sending to client")
+
+class SocketWriter:
+    """The wfile handed to protocols and handlers when the client is
+    on a real socket.
+
+    Writes are collected until buffersize bytes are waiting and then
+    sent with a single sendmsg call, without being joined first.
+    Writes larger than the buffer go out at once, together with
+    anything already waiting.  flush() sends everything waiting;
+    endresponse() also tells the kernel that the response is complete.
+
+    If cork is set and the platform has TCP_CORK, the socket is kept
+    corked so that the kernel only sends full segments, and uncorked
+    briefly at the end of each response.  If nodelay is set, Nagle's
+    algorithm is turned off, so that the last segment of a response
+    is not held back waiting for an acknowledgement."""
+
+    def __init__(self, sock, buffersize = 65536, cork = 1, nodelay = 1):
+        self.sock = sock
+        self.buffersize = buffersize
+        self.buffers = []
+        self.buffered = 0
+        self.closed = False
+        self.cork = cork and hasattr(socket, 'TCP_CORK')
+        self.bytessent = 0
+        self.sendcalls = 0
+        if nodelay:
+            self.setoption(socket.TCP_NODELAY, 1)
+        if self.cork:
+            self.setoption(socket.TCP_CORK, 1)
+
+    def setoption(self, option, value):
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, option, value)
+        except OSError:
+            # Not a TCP socket, most likely.
+            if option == getattr(socket, 'TCP_CORK', None):
+                self.cork = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        size = len(data)
+        if not size:
+            return 0
+        self.buffers.append(bytes(data))
+        self.buffered += size
+        if self.buffered >= self.buffersize:
+            self.flush()
+        return size
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Sends everything waiting in the buffer."""
+        buffers = self.buffers
+        self.buffers = []
+        self.buffered = 0
+        while buffers:
+            try:
+                sent = self.sock.sendmsg(buffers[:maxiov])
+            except BlockingIOError:
+                # The client is not reading.  Give up on it, and on what
+                # is left to send, after the send timeout.
+                waitwritable(self.sock)
+                continue
+            self.sendcalls += 1
+            self.bytessent += sent
+            while sent:
+                if sent >= len(buffers[0]):
+                    sent -= len(buffers[0])
+                    del buffers[0]
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+
+    def endresponse(self):
+        """Sends everything waiting and pushes out any partial segment
+        held back by the cork."""
+        self.flush()
+        if self.cork:
+            self.setoption(socket.TCP_CORK, 0)
+            self.setoption(socket.TCP_CORK, 1)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+
+    def getstats(self):
+        """Returns a dictionary with the bytes sent, the number of
+        send calls made and the bytes still waiting."""
+        return {'bytessent': self.bytessent,
+                'sendcalls': self.sendcalls,
+                'buffered': self.buffered}
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of buffered output
+# COPYRIGHT #
+# Copyright (C) 2002-2019 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, socket, struct, time
+from pygopherd import output, initialization, testutil
+
+class SocketWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.client = socket.create_connection(listener.getsockname())
+        self.server, address = listener.accept()
+        listener.close()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def read(self, size):
+        data = b''
+        while len(data) < size:
+            data += self.client.recv(size - len(data))
+        return data
+
+    def testbuffering(self):
+        wfile = output.SocketWriter(self.server, 1024)
+        for i in range(100):
+            wfile.write(b"line\r\n")
+        self.assertEqual(wfile.getstats(),
+                         {'bytessent': 0, 'sendcalls': 0, 'buffered': 600})
+        wfile.endresponse()
+        self.assertEqual(self.read(600), b"line\r\n" * 100)
+        self.assertEqual(wfile.getstats(),
+                         {'bytessent': 600, 'sendcalls': 1, 'buffered': 0})
+
+    def testlargewrite(self):
+        wfile = output.SocketWriter(self.server, 1024)
+        wfile.write(b"start")
+        wfile.write(b"x" * 2048)
+        stats = wfile.getstats()
+        self.assertEqual(stats['buffered'], 0)
+        self.assertEqual(stats['bytessent'], 2053)
+        self.assertEqual(self.read(2053), b"start" + b"x" * 2048)
+
+    def testoptions(self):
+        output.SocketWriter(self.server, nodelay = 1)
+        assert self.server.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        wfile = output.SocketWriter(self.server, cork = 0, nodelay = 0)
+        assert not wfile.cork
+        if hasattr(socket, 'TCP_CORK'):
+            wfile = output.SocketWriter(self.server, cork = 1)
+            assert self.server.getsockopt(socket.IPPROTO_TCP, socket.TCP_CORK)
+            wfile.write(b"corked")
+            wfile.endresponse()
+            self.assertEqual(self.read(6), b"corked")
+            assert self.server.getsockopt(socket.IPPROTO_TCP, socket.TCP_CORK)
+
+    def testnotcp(self):
+        one, two = socket.socketpair()
+        wfile = output.SocketWriter(one, cork = 1)
+        assert not wfile.cork
+        wfile.write(b"data")
+        wfile.close()
+        assert wfile.closed
+        self.assertRaises(ValueError, wfile.write, b"more")
+        self.assertEqual(two.recv(4), b"data")
+        one.close()
+        two.close()
+
+    def testsendtimeout(self):
+        # A client that stops reading is given up on after the send
+        # timeout, not waited for forever.
+        one, two = socket.socketpair()
+        one.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                       struct.pack("ll", 0, 200000))
+        wfile = output.SocketWriter(one, 65536)
+        start = time.time()
+        try:
+            self.assertRaises(socket.timeout, wfile.write, b"x" * 8388608)
+        finally:
+            one.close()
+            two.close()
+        assert time.time() - start < 5
+
+    def testrequesthandler(self):
+        config = testutil.getconfig()
+        testutil.getstringlogger()
+        server = testutil.gettestingserver(config)
+        self.client.sendall(b"/testfile.txt\r\n")
+        handler = initialization.GopherRequestHandler(self.server,
+                                                      ('127.0.0.1', 0), server)
+        assert isinstance(handler.wfile, output.SocketWriter)
+        assert handler.wfile.closed
+        self.server.close()
+        self.assertEqual(self.client.makefile('rb').read(), b"Test\n")
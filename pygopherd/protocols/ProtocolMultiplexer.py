@@ -16,15 +16,13 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from pygopherd import handlers, protocols
+from pygopherd import handlers, protocols, settings
 from pygopherd.protocols import *
 from pygopherd.GopherExceptions import FileNotFound
 import re
 
 def getProtocol(request, server, requesthandler, rfile, wfile, config):
-    p = eval(config.get("protocols.ProtocolMultiplexer", "protocols"))
-
-    for protocol in p:
+    for protocol in settings.get(config).protocols:
         ptry = protocol(request, server, requesthandler, rfile, wfile, config)
         if ptry.canhandlerequest():
             return ptry
@@ -20,8 +20,20 @@ import socketserver
 import re
 import os, stat, os.path, mimetypes
 from pygopherd import handlers, GopherExceptions, logger, gopherentry
+from pygopherd import settings, cache
 from pygopherd.handlers import HandlerMultiplexer
 
+# Rendered directory menus, shared by all requests.
+menucache = None
+
+def getmenucache(config):
+    global menucache
+    if menucache == None:
+        s = settings.get(config)
+        menucache = cache.LRUCache(None, maxbytes = s.menucachesize,
+                                   maxage = s.dircachetime)
+    return menucache
+
 class BaseGopherProtocol:
     """Skeleton protocol -- includes commonly-used routines."""
     def __init__(self, request, server, requesthandler, rfile, wfile, config):
@@ -105,38 +117,85 @@ class BaseGopherProtocol:
 
     def writedir(self, entry, dirlist):
         """Called to render a directory.  Generally called by self.handle()"""
-
+        self.wfile.write(self.getdirdata(entry, dirlist))
+
+    def getdirdata(self, entry, dirlist):
+        """Returns the rendered directory as bytes, from the menu cache
+        if it is there."""
+        key = self.getmenukey()
+        if key != None:
+            data = getmenucache(self.config).get(key)
+            if data != None:
+                return data
+
+        data = self.renderdir(entry, dirlist)
+        if key != None:
+            getmenucache(self.config).put(key, data, len(data))
+        return data
+
+    def renderdir(self, entry, dirlist):
+        """Renders a whole directory.  Returns bytes."""
+        retval = []
         startstr = self.renderdirstart(entry)
         if startstr != None:
-            self.wfile.write(startstr)
+            retval.append(startstr)
 
-        abstractopt = self.config.get("pygopherd", "abstract_entries")
+        abstractopt = settings.get(self.config).abstractentries
         doabstracts = abstractopt == 'always' or \
                       (abstractopt == 'unsupported' and
                        not self.groksabstract())
 
-        if self.config.getboolean("pygopherd", "abstract_headers"):
-            self.wfile.write(self.renderabstract(entry.getea('ABSTRACT', '')))
+        if settings.get(self.config).abstractheaders:
+            retval.append(self.renderabstract(entry.geteatext('ABSTRACT', '')))
 
         for direntry in dirlist:
-            self.wfile.write(self.renderobjinfo(direntry).encode(encoding='cp437'))
+            retval.append(self.renderobjinfo(direntry))
             if doabstracts:
-                abstract = self.renderabstract(direntry.getea('ABSTRACT'))
+                abstract = self.renderabstract(direntry.geteatext('ABSTRACT'))
                 if abstract:
-                    self.wfile.write(abstract)
+                    retval.append(abstract)
 
         endstr = self.renderdirend(entry)
         if endstr != None:
-            self.wfile.write(endstr)
+            retval.append(endstr)
+        return b''.join([x.encode(encoding='cp437') if isinstance(x, str) \
+                         else x for x in retval])
+
+    def getmenukey(self):
+        """Returns the key under which the rendered menu for this
+        request is cached, or None if it cannot be cached.  Only
+        directories whose listings are cached have their menus cached,
+        and for no longer."""
+        s = settings.get(self.config)
+        if not (s.dircachetime and s.menucachesize):
+            return None
+        getlistingkey = getattr(self.handler, 'getlistingkey', None)
+        if getlistingkey == None:
+            return None
+        listingkey = getlistingkey()
+        if listingkey == None:
+            return None
+        return (type(self), self.selector, self.searchrequest,
+                self.server.server_name, self.server.server_port,
+                listingkey, s.abstractentries, s.abstractheaders,
+                self.getmenuvariant())
+
+    def getmenuvariant(self):
+        """Returns anything else about the request that changes how
+        this protocol renders menus.  Subclasses whose menus depend on
+        more than the selector and server should override this."""
+        return None
 
     def renderabstract(self, abstractstring):
         if not abstractstring:
             return ''
-        retval = ''
+        # One entry does for every line.
+        absentry = gopherentry.getinfoentry('', self.config)
+        retval = []
         for line in abstractstring.splitlines():
-            absentry = gopherentry.getinfoentry(line, self.config)
-            retval += self.renderobjinfo(absentry)
-        return retval
+            absentry.name = line
+            retval.append(self.renderobjinfo(absentry))
+        return ''.join(retval)
 
     def renderdirstart(self, entry):
         """Renders the start of a directory.  Most protocols will not need
@@ -18,8 +18,8 @@
 
 import socketserver
 import re
-import os, stat, os.path, mimetypes, time
-from pygopherd import handlers, protocols, GopherExceptions
+import os, stat, os.path, mimetypes, time, copy
+from pygopherd import handlers, protocols, GopherExceptions, settings
 from pygopherd.protocols.rfc1436 import GopherProtocol
 
 class GopherPlusProtocol(GopherProtocol):
@@ -75,6 +75,9 @@ class GopherPlusProtocol(GopherProtocol):
             GopherExceptions.log(e, self, None)
             self.filenotfound(e[1])
 
+    def getmenuvariant(self):
+        return self.handlemethod
+
     def getsupportedblocknames(self, entry):
         # Return the always-supported values PLUS any extra ones for
         # this particular entry.
@@ -97,7 +100,7 @@ class GopherPlusProtocol(GopherProtocol):
             return "+" + blockname.upper() + ":\r\n" + \
                    ''.join(
                            [" " + x + "\r\n" for x in \
-                           entry.getea(blockname.upper()).splitlines()]
+                           entry.geteatext(blockname.upper()).splitlines()]
                    )
 
         # Not in there -- look up a custom function.
@@ -115,8 +118,7 @@ class GopherPlusProtocol(GopherProtocol):
     def getadminblock(self, entry):
         retstr = "+ADMIN:\r\n"
         retstr += " Admin: "
-        retstr += self.config.get("protocols.gopherp.GopherPlusProtocol",
-                                  "admin")
+        retstr += settings.get(self.config).gopherplusadmin
         retstr += "\r\n"
         if entry.getmtime():
             retstr += " Mod-Date: "
@@ -141,6 +143,9 @@ class GopherPlusProtocol(GopherProtocol):
     def renderobjinfo(self, entry):
         if entry.getmimetype('FAKE') == 'application/gopher-menu' and \
                entry.getgopherpsupport():
+            # Entries may be shared through the listing cache; change a
+            # copy rather than the original.
+            entry = copy.copy(entry)
             entry.mimetype = 'application/gopher+-menu'
         if self.handlemethod == 'documentonly':
             # It's a Gopher+ request for a gopher0 menu entry.
@@ -152,7 +157,7 @@ class GopherPlusProtocol(GopherProtocol):
     def filenotfound(self, msg):
         self.wfile.write("--2\r\n")
         self.wfile.write("1 ")
-        self.wfile.write(self.config.get("protocols.gopherp.GopherPlusProtocol", "admin"))
+        self.wfile.write(settings.get(self.config).gopherplusadmin)
         self.wfile.write("\r\n" + msg + "\r\n")
 
     def groksabstract(self):
@@ -18,12 +18,79 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import socketserver
-import re, binascii
+import re, binascii, html, hashlib, email.utils, uuid, gzip, zlib, io
 import os, stat, os.path, mimetypes, urllib.request, urllib.parse, urllib.error, time
-from pygopherd import handlers, protocols, GopherExceptions
+from pygopherd import handlers, protocols, GopherExceptions, settings, cache
 from pygopherd.protocols.base import BaseGopherProtocol
+from pygopherd.handlers.file import getstatetag
 import pygopherd.version
-import cgi
+
+try:
+    import zstandard
+    zstdavailable = 1
+except ImportError:
+    zstdavailable = 0
+
+# The content codings we can send, most preferred first.
+codings = ['gzip', 'deflate']
+if zstdavailable:
+    codings.insert(0, 'zstd')
+
+# Bodies smaller than this are not worth compressing.
+compressminsize = 256
+
+# Compressed bodies, by (ETag, coding).
+compressedcache = None
+
+def getcompressedcache(config):
+    global compressedcache
+    if compressedcache == None:
+        compressedcache = cache.LRUCache(None, maxbytes = \
+                              settings.get(config).httpcompresscachesize)
+    return compressedcache
+
+def compress(data, coding):
+    """Compresses data with the given HTTP content coding."""
+    if coding == 'gzip':
+        return gzip.compress(data, mtime = 0)
+    if coding == 'deflate':
+        # That is, the zlib format, not raw deflate.
+        return zlib.compress(data)
+    if coding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError("Unknown content coding %s" % coding)
+
+# The icons, decoded on first use, with their ETags.
+icondata = {}
+
+# When the icons last changed.
+iconmtime = 1008364787
+
+# Requests for more ranges than this get the whole file instead.
+maxranges = 64
+
+def escape(text):
+    return html.escape(text, False)
+
+class ChunkedWriter:
+    """Wraps wfile, sending what is written to it with the HTTP/1.1
+    chunked transfer coding.  close() sends the last chunk but does
+    not close wfile."""
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        if len(data):
+            self.wfile.write(b"%x\r\n" % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+        return len(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+    def close(self):
+        self.wfile.write(b"0\r\n\r\n")
 
 class HTTPProtocol(BaseGopherProtocol):
     def canhandlerequest(self):
@@ -43,20 +110,41 @@ class HTTPProtocol(BaseGopherProtocol):
             line = self.rfile.readline()
             if not len(line):
                 break
+            if isinstance(line, bytes):
+                line = line.decode(encoding = 'cp437')
             line = line.strip()
             if not len(line):
                 break
             splitline = line.split(':', 1)
             if len(splitline) == 2:
-                self.httpheaders[splitline[0].lower()] = splitline[1]
+                self.httpheaders[splitline[0].lower()] = splitline[1].strip()
         self.requesthandler.pygopherd_http_slurped = self.httpheaders
 
+    def setkeepalive(self):
+        """Decides whether the connection may stay open after this
+        request, and tells the request handler.  HTTP/1.1 clients get a
+        persistent connection unless they ask otherwise; HTTP/1.0
+        clients only if they ask for one."""
+        s = settings.get(self.config)
+        connection = self.httpheaders.get('connection', '').lower()
+        if self.requestparts[2] == 'HTTP/1.0':
+            self.keepalive = connection == 'keep-alive'
+        else:
+            self.keepalive = connection != 'close'
+        if getattr(self.requesthandler, 'requestcount', 1) >= \
+           s.httpkeepalivemax or \
+           not getattr(self.requesthandler, 'cankeepalive', 0):
+            self.keepalive = 0
+        self.requesthandler.keepalive = self.keepalive
+
     def handle(self):
         self.canhandlerequest()         # To get self.requestparts
-        self.iconmapping = eval(self.config.get("protocols.http.HTTPProtocol",
-                                                "iconmapping"))
+        self.iconmapping = settings.get(self.config).iconmapping
+        self.headerssent = 0
+        self.precompressed = None
 
         self.headerslurp()
+        self.setkeepalive()
         splitted = self.requestparts[1].split('?')
         self.selector = splitted[0]
         self.selector = urllib.parse.unquote(self.selector)
@@ -64,7 +152,7 @@ class HTTPProtocol(BaseGopherProtocol):
         self.selector = self.slashnormalize(self.selector)
         self.formvals = {}
         if len(splitted) >= 2:
-            self.formvals = cgi.parse_qs(splitted[1])
+            self.formvals = urllib.parse.parse_qs(splitted[1])
 
         if 'searchrequest' in self.formvals:
             self.searchrequest = self.formvals['searchrequest'][0]
@@ -73,12 +161,16 @@ class HTTPProtocol(BaseGopherProtocol):
         if icon:
             iconname = icon.group(1)
             if iconname in icons:
-                self.wfile.write("HTTP/1.0 200 OK\r\n")
-                self.wfile.write("Last-Modified: Fri, 14 Dec 2001 21:19:47 GMT\r\n")
-                self.wfile.write("Content-Type: image/gif\r\n\r\n")
-                if self.requestparts[0] == 'HEAD':
+                if not iconname in icondata:
+                    data = binascii.unhexlify(icons[iconname])
+                    icondata[iconname] = (data, self.getdataetag(data))
+                data, etag = icondata[iconname]
+                headers = self.getvalidators(etag, iconmtime)
+                if self.isnotmodified(etag, iconmtime):
+                    self.writeresponse("304 Not Modified", headers)
                     return
-                self.wfile.write(binascii.unhexlify(icons[iconname]))
+                headers.append(("Content-Type", "image/gif"))
+                self.writeresponse("200 OK", headers, data)
                 return
 
         try:
@@ -86,27 +178,326 @@ class HTTPProtocol(BaseGopherProtocol):
             self.log(handler)
             self.entry = handler.getentry()
             handler.prepare()
-            self.wfile.write("HTTP/1.0 200 OK\r\n")
-            if self.entry.getmtime() != None:
-                gmtime = time.gmtime(self.entry.getmtime())
-                mtime = time.strftime("%a, %d %b %Y %H:%M:%S GMT", gmtime)
-                self.wfile.write("Last-Modified: " + mtime + "\r\n")
             mimetype = self.entry.getmimetype()
             mimetype = self.adjustmimetype(mimetype)
-            self.wfile.write("Content-Type: " + mimetype + "\r\n\r\n")
-            if self.requestparts[0] == 'GET':
-                if handler.isdir():
-                    self.writedir(self.entry, handler.getdirlist())
-                else:
-                    self.handlerwrite(self.wfile)
+            data = None
+            if handler.isdir():
+                # Rendered even for HEAD, which needs the length too.
+                data = self.getdirdata(self.entry, handler.getdirlist())
+                etag = self.getdataetag(data)
+            else:
+                etag = handler.getetag()
+            coding, data, etag = self.encodebody(mimetype, data, etag)
+            mtime = self.entry.getmtime()
+            if etag == None:
+                # Without an ETag, the body may change whatever the
+                # file's mtime says.
+                mtime = None
+            headers = self.getvalidators(etag, mtime)
+            if coding:
+                headers.append(("Content-Encoding", coding))
+            if coding or (settings.get(self.config).httpcompress and \
+                          self.iscompressible(mimetype)):
+                headers.append(("Vary", "Accept-Encoding"))
+            if self.isnotmodified(etag, mtime):
+                self.writeresponse("304 Not Modified", headers)
+                return
+            headers.append(("Content-Type", mimetype))
+            if data == None and not coding and \
+               self.getcontentlength() != None:
+                headers.append(("Accept-Ranges", "bytes"))
+                ranges = self.getranges(etag, mtime)
+                if ranges == []:
+                    self.writeresponse("416 Range Not Satisfiable",
+                                       [("Content-Range", "bytes */%d" % \
+                                         self.getcontentlength())], b'')
+                    return
+                if ranges:
+                    self.writeranges(headers, ranges)
+                    return
+            self.writeresponse("200 OK", headers, data)
         except GopherExceptions.FileNotFound as e:
             self.filenotfound(str(e))
         except IOError as e:
             GopherExceptions.log(e, self, None)
-            self.filenotfound(e[1])
+            self.filenotfound(e.strerror or str(e))
+
+    def getacceptedcodings(self):
+        """Returns the content codings we can send that the client's
+        Accept-Encoding allows, the one to use first."""
+        if not settings.get(self.config).httpcompress:
+            return []
+        acceptencoding = self.httpheaders.get('accept-encoding')
+        if not acceptencoding:
+            return []
+        qvalues = {}
+        for item in acceptencoding.split(','):
+            params = item.split(';')
+            name = params[0].strip().lower()
+            if name == 'x-gzip':
+                name = 'gzip'
+            qvalue = 1.0
+            for param in params[1:]:
+                key, sep, value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        qvalue = float(value)
+                    except ValueError:
+                        qvalue = 0.0
+            qvalues[name] = qvalue
+        accepted = []
+        for coding in codings:
+            qvalue = qvalues.get(coding, qvalues.get('*', 0.0))
+            if qvalue > 0:
+                accepted.append((-qvalue, len(accepted), coding))
+        accepted.sort()
+        return [x[2] for x in accepted]
+
+    def iscompressible(self, mimetype):
+        return settings.get(self.config).httpcompresstypes.search(mimetype)
+
+    def encodebody(self, mimetype, data, etag):
+        """Chooses how to encode the body, which is data or, if that is
+        None, what the handler writes.  Returns the content coding (None
+        if the body is sent as it is), the body (None if the handler is
+        to write it) and the ETag that goes with it.
+
+        A copy that the handler has compressed ahead of time is used if
+        there is one; otherwise, the body may be compressed here, and
+        kept for next time."""
+        self.precompressed = None
+        accepted = self.getacceptedcodings()
+        if not accepted:
+            return (None, data, etag)
+        if data == None:
+            if 'range' in self.httpheaders:
+                # Ranges are of the body as it is.
+                return (None, data, etag)
+            for coding in accepted:
+                precompressed = self.handler.getprecompressed(coding)
+                if precompressed:
+                    self.precompressed = precompressed
+                    return (coding, None, self.getcodingetag(
+                        getstatetag(precompressed[1]), coding))
+            length = self.getcontentlength()
+            if etag == None or length == None or \
+               length > settings.get(self.config).httpcompressmaxsize:
+                return (None, data, etag)
+        else:
+            length = len(data)
+        if length < compressminsize or not self.iscompressible(mimetype):
+            return (None, data, etag)
+
+        coding = accepted[0]
+        key = (self.handler.vfs.getcachekey(), self.handler.getselector(),
+               etag, coding)
+        encoded = getcompressedcache(self.config).get(key)
+        if encoded == None:
+            if data == None:
+                buffer = io.BytesIO()
+                self.handlerwrite(buffer)
+                data = buffer.getvalue()
+            encoded = compress(data, coding)
+            getcompressedcache(self.config).put(key, encoded, len(encoded))
+        return (coding, encoded, self.getcodingetag(etag, coding))
+
+    def getcodingetag(self, etag, coding):
+        """Returns the ETag of a body encoded with coding, given the
+        ETag of the body as it is."""
+        return etag[:-1] + '-' + coding + '"'
+
+    def getdataetag(self, data):
+        """Returns a strong ETag for a body that is held in memory."""
+        return '"%s"' % hashlib.blake2b(data, digest_size = 12).hexdigest()
+
+    def getvalidators(self, etag, mtime):
+        """Returns the ETag, Last-Modified and Cache-Control headers
+        for this response, as a list of (name, value) pairs."""
+        headers = []
+        if etag != None:
+            headers.append(("ETag", etag))
+        if mtime != None:
+            headers.append(("Last-Modified",
+                            email.utils.formatdate(mtime, usegmt = True)))
+        for pattern, cachecontrol in settings.get(self.config).httpcachecontrol:
+            if pattern.search(self.selector):
+                if cachecontrol:
+                    headers.append(("Cache-Control", cachecontrol))
+                break
+        return headers
+
+    def isnotmodified(self, etag, mtime):
+        """Returns true if the client already has the current version,
+        going by If-None-Match or, if that is absent, If-Modified-Since.
+        Always false if there is no ETag."""
+        if etag == None:
+            return 0
+        ifnonematch = self.httpheaders.get('if-none-match')
+        if ifnonematch != None:
+            tags = [x.strip() for x in ifnonematch.split(',')]
+            # Weak comparison, as If-None-Match calls for.
+            return '*' in tags or etag in tags or ('W/' + etag) in tags
+        ifmodifiedsince = self.httpheaders.get('if-modified-since')
+        if ifmodifiedsince == None or mtime == None:
+            return 0
+        since = email.utils.parsedate_tz(ifmodifiedsince)
+        if since == None:
+            return 0
+        return int(mtime) <= email.utils.mktime_tz(since)
+
+    def getranges(self, etag, mtime):
+        """Returns the byte ranges the client asked for, merged and
+        sorted, as (offset, count) pairs.  Returns None if the whole
+        body should be sent instead, or an empty list if none of the
+        ranges can be satisfied."""
+        rangeheader = self.httpheaders.get('range')
+        if rangeheader == None or self.requestparts[0] != 'GET':
+            return None
+        ifrange = self.httpheaders.get('if-range')
+        if ifrange != None:
+            if ifrange.startswith('"') or ifrange.startswith('W/'):
+                # Strong comparison: a weak tag never matches.
+                if ifrange != etag:
+                    return None
+            else:
+                date = email.utils.parsedate_tz(ifrange)
+                if date == None or mtime == None or \
+                   email.utils.mktime_tz(date) != int(mtime):
+                    return None
+
+        match = re.match(r'bytes\s*=(.*)$', rangeheader.strip(), re.I)
+        if not match:
+            return None
+        specs = [x.strip() for x in match.group(1).split(',') if x.strip()]
+        if not specs or len(specs) > maxranges:
+            return None
+        length = self.getcontentlength()
+        ranges = []
+        for spec in specs:
+            match = re.match(r'(\d*)\s*-\s*(\d*)$', spec)
+            if not match or not (match.group(1) or match.group(2)):
+                return None
+            if match.group(1):
+                first = int(match.group(1))
+                last = length - 1
+                if match.group(2):
+                    last = int(match.group(2))
+                    if last < first:
+                        return None
+                if first >= length:
+                    continue
+                last = min(last, length - 1)
+            else:
+                suffix = int(match.group(2))
+                if not suffix:
+                    continue
+                first = max(0, length - suffix)
+                last = length - 1
+            ranges.append((first, last))
+
+        ranges.sort()
+        merged = []
+        for first, last in ranges:
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+            else:
+                merged.append((first, last))
+        return [(first, last - first + 1) for first, last in merged]
+
+    def writeranges(self, headers, ranges):
+        """Sends a 206 Partial Content response with the given ranges
+        of the body, as multipart/byteranges if there is more than one."""
+        length = self.getcontentlength()
+        if len(ranges) == 1:
+            offset, count = ranges[0]
+            headers.append(("Content-Range", "bytes %d-%d/%d" % \
+                            (offset, offset + count - 1, length)))
+            headers.append(("Content-Length", str(count)))
+            self.writehead("206 Partial Content", headers)
+            self.handler.writerange(self.wfile, offset, count)
+            return
+
+        boundary = uuid.uuid4().hex
+        contenttype = [x for x in headers if x[0] == 'Content-Type'][0][1]
+        headers = [x for x in headers if x[0] != 'Content-Type']
+        parts = []
+        total = 0
+        for offset, count in ranges:
+            part = "\r\n--%s\r\nContent-Type: %s\r\n" % (boundary, contenttype)
+            part += "Content-Range: bytes %d-%d/%d\r\n\r\n" % \
+                    (offset, offset + count - 1, length)
+            part = part.encode(encoding = 'cp437')
+            parts.append((part, offset, count))
+            total += len(part) + count
+        end = ("\r\n--%s--\r\n" % boundary).encode(encoding = 'cp437')
+        total += len(end)
+        headers.append(("Content-Type",
+                        "multipart/byteranges; boundary=%s" % boundary))
+        headers.append(("Content-Length", str(total)))
+        self.writehead("206 Partial Content", headers)
+        for part, offset, count in parts:
+            self.wfile.write(part)
+            self.handler.writerange(self.wfile, offset, count)
+        self.wfile.write(end)
+
+    def getcontentlength(self):
+        """Returns the length of what handlerwrite will write, or None
+        if it is not known in advance."""
+        if self.precompressed:
+            return self.precompressed[1][stat.ST_SIZE]
+        return self.handler.getcontentlength()
+
+    def writeresponse(self, status, headers, data = None):
+        """Sends a response with the given status and headers.  The
+        body is data or, if that is None, whatever handlerwrite writes.
+        Adds the headers that describe the length of the body and
+        whether the connection stays open."""
+        chunked = 0
+        if status.startswith("304"):
+            # Never has a body, nor says how long it would be.
+            data = b''
+        elif data != None:
+            headers.append(("Content-Length", str(len(data))))
+        elif self.getcontentlength() != None:
+            headers.append(("Content-Length", str(self.getcontentlength())))
+        elif self.keepalive and self.requestparts[2] != 'HTTP/1.0':
+            chunked = 1
+            headers.append(("Transfer-Encoding", "chunked"))
+        else:
+            # Only closing the connection can mark the end of the body.
+            self.keepalive = 0
+            self.requesthandler.keepalive = 0
+        if not self.writehead(status, headers):
+            return
+        if data != None:
+            self.wfile.write(data)
+        elif chunked:
+            wfile = ChunkedWriter(self.wfile)
+            self.handlerwrite(wfile)
+            wfile.close()
+        else:
+            self.handlerwrite(self.wfile)
+
+    def writehead(self, status, headers):
+        """Sends the status line and headers, adding the Connection
+        header.  Returns true if a body should follow."""
+        if self.keepalive:
+            if self.requestparts[2] == 'HTTP/1.0':
+                headers.append(("Connection", "keep-alive"))
+        else:
+            headers.append(("Connection", "close"))
+
+        head = "HTTP/1.1 %s\r\n" % status
+        head += "".join(["%s: %s\r\n" % x for x in headers])
+        self.wfile.write((head + "\r\n").encode(encoding = 'cp437'))
+        self.headerssent = 1
+        return self.requestparts[0] != 'HEAD'
 
     def handlerwrite(self, wfile):                                
-        self.handler.write(wfile)
+        if self.precompressed:
+            self.handler.writeprecompressed(wfile, self.precompressed[0])
+        else:
+            self.handler.write(wfile)
 
     def adjustmimetype(self, mimetype):
         if mimetype == None:
@@ -140,9 +531,9 @@ class HTTPProtocol(BaseGopherProtocol):
             retstr += '<A HREF="%s">' % url
         retstr += "<TT>"
         if entry.getname() != None:
-            retstr += cgi.escape(entry.getname())
+            retstr += escape(entry.getname())
         else:
-            retstr += cgi.escape(entry.getselector())
+            retstr += escape(entry.getselector())
         retstr += "</TT>"
         if entry.gettype() != 'i' and entry.gettype() != '7':
             retstr += '</A>'
@@ -155,7 +546,7 @@ class HTTPProtocol(BaseGopherProtocol):
         if entry.getmimetype():
             subtype = re.search('/.+$', entry.getmimetype())
             if subtype:
-                retstr += cgi.escape(subtype.group()[1:])
+                retstr += escape(subtype.group()[1:])
         retstr += '</FONT></TD></TR>\n'
         return retstr
     
@@ -163,17 +554,17 @@ class HTTPProtocol(BaseGopherProtocol):
         retstr ='<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0 Transitional//EN" "http://www.w3.org/TR/REC-html40/loose.dtd">'
         retstr += "\n<HTML><HEAD><TITLE>Gopher"
         if self.entry.getname():
-            retstr += ": " + cgi.escape(self.entry.getname())
+            retstr += ": " + escape(self.entry.getname())
         retstr += "</TITLE></HEAD><BODY>"
-        if self.config.has_option("protocols.http.HTTPProtocol", "pagetopper"):
+        pagetopper = settings.get(self.config).pagetopper
+        if pagetopper != None:
             retstr += re.sub('GOPHERURL',
                              self.entry.geturl(self.server.server_name,
                                                self.server.server_port),
-                             self.config.get("protocols.http.HTTPProtocol",
-                                             "pagetopper"))
+                             pagetopper)
         retstr += "<H1>Gopher"
         if self.entry.getname():
-            retstr += ": " + cgi.escape(self.entry.getname())
+            retstr += ": " + escape(self.entry.getname())
         retstr += '</H1><TABLE WIDTH="100%" CELLSPACING="1" CELLPADDING="0">'
         return retstr
 
@@ -187,14 +578,18 @@ class HTTPProtocol(BaseGopherProtocol):
         return retstr + "\n</BODY></HTML>\n"
 
     def filenotfound(self, msg):
-        self.wfile.write("HTTP/1.0 404 Not Found\r\n")
-        self.wfile.write("Content-Type: text/html\r\n\r\n")
-        self.wfile.write('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0 Transitional//EN" "http://www.w3.org/TR/REC-html40/loose.dtd">')
-        self.wfile.write("""\n<HTML><HEAD><TITLE>Selector Not Found</TITLE>
+        if self.headerssent:
+            # Too late to say so; the client will see the connection close.
+            self.requesthandler.keepalive = 0
+            return
+        body = '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0 Transitional//EN" "http://www.w3.org/TR/REC-html40/loose.dtd">'
+        body += """\n<HTML><HEAD><TITLE>Selector Not Found</TITLE>
         <H1>Selector Not Found</H1>
-        <TT>""")
-        self.wfile.write(cgi.escape(msg))
-        self.wfile.write("</TT><HR>Pygopherd</BODY></HTML>\n")
+        <TT>"""
+        body += escape(msg)
+        body += "</TT><HR>Pygopherd</BODY></HTML>\n"
+        self.writeresponse("404 Not Found", [("Content-Type", "text/html")],
+                           body.encode(encoding = 'cp437'))
 
     def getimgtag(self, entry):
         name = 'generic.gif'
@@ -0,0 +1,394 @@
+import unittest, socket, gzip, zlib
+from pygopherd.protocols import http
+from pygopherd.protocols.http import HTTPProtocol
+from pygopherd import testutil, initialization, settings
+from io import BytesIO
+
+class HTTPTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+        self.logfile = testutil.getstringlogger()
+
+    def request(self, request, headers = b"\r\n"):
+        self.rfile = BytesIO(headers)
+        self.wfile = BytesIO()
+        self.handler = testutil.gettestinghandler(self.rfile, self.wfile,
+                                                  self.config)
+        proto = HTTPProtocol(request, self.handler.server, self.handler,
+                             self.rfile, self.wfile, self.config)
+        assert proto.canhandlerequest()
+        return proto
+
+    def getresponse(self):
+        head, body = self.wfile.getvalue().split(b"\r\n\r\n", 1)
+        lines = head.decode('cp437').split("\r\n")
+        headers = dict([x.split(": ", 1) for x in lines[1:]])
+        return lines[0], headers, body
+
+    def testfile(self):
+        self.request("GET /testfile.txt HTTP/1.1\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertEqual(headers['Content-Type'], 'text/plain')
+        self.assertEqual(headers['Content-Length'], '5')
+        assert not 'Connection' in headers
+        self.assertEqual(body, b"Test\n")
+        assert self.handler.keepalive
+
+    def testhttp10(self):
+        self.request("GET /testfile.txt HTTP/1.0\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Connection'], 'close')
+        assert not self.handler.keepalive
+
+        self.request("GET /testfile.txt HTTP/1.0\r\n",
+                     b"Connection: Keep-Alive\r\n\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Connection'], 'keep-alive')
+        assert self.handler.keepalive
+
+    def testclose(self):
+        self.request("GET /testfile.txt HTTP/1.1\r\n",
+                     b"Connection: close\r\n\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Connection'], 'close')
+        assert not self.handler.keepalive
+
+    def testhead(self):
+        self.request("HEAD / HTTP/1.1\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Content-Type'], 'text/html')
+        assert int(headers['Content-Length']) > 0
+        self.assertEqual(body, b"")
+
+    def testdir(self):
+        self.request("GET / HTTP/1.1\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        assert body.endswith(b"</BODY></HTML>\n")
+
+    def testicon(self):
+        self.request("GET /PYGOPHERD-HTTPPROTO-ICONS/text.gif HTTP/1.1\r\n"
+                     ).handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Content-Type'], 'image/gif')
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        assert body.startswith(b"GIF89a")
+
+    def testchunked(self):
+        proto = self.request("GET /testfile.txt HTTP/1.1\r\n")
+        proto.getcontentlength = lambda: None
+        proto.handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(body, b"5\r\nTest\n\r\n0\r\n\r\n")
+
+        # HTTP/1.0 clients get the body up to the end of the connection.
+        proto = self.request("GET /testfile.txt HTTP/1.0\r\n",
+                             b"Connection: keep-alive\r\n\r\n")
+        proto.getcontentlength = lambda: None
+        proto.handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Connection'], 'close')
+        self.assertEqual(body, b"Test\n")
+        assert not self.handler.keepalive
+
+    def testnotfound(self):
+        self.request("GET /NONEXISTANT HTTP/1.1\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(status, "HTTP/1.1 404 Not Found")
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        assert self.handler.keepalive
+
+    def testpersistent(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        client = socket.create_connection(listener.getsockname())
+        server, address = listener.accept()
+        listener.close()
+        client.sendall(b"GET /testfile.txt HTTP/1.1\r\n\r\n" +
+                       b"GET /PYGOPHERD-HTTPPROTO-ICONS/text.gif HTTP/1.1\r\n\r\n" +
+                       b"GET /testfile.txt HTTP/1.1\r\nConnection: close\r\n\r\n")
+        handler = initialization.GopherRequestHandler(
+            server, ('127.0.0.1', 0), testutil.gettestingserver(self.config))
+        self.assertEqual(handler.requestcount, 3)
+        server.close()
+        data = client.makefile('rb').read()
+        client.close()
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK\r\n"), 3)
+        assert data.endswith(b"Connection: close\r\n\r\nTest\n")
+
+    def testidletimeout(self):
+        self.config.set("protocols.http.HTTPProtocol", "keepalivetimeout", "0")
+        one, two = socket.socketpair()
+        one.sendall(b"GET /testfile.txt HTTP/1.1\r\n\r\n")
+        handler = initialization.GopherRequestHandler(
+            two, ('127.0.0.1', 0), testutil.gettestingserver(self.config))
+        self.assertEqual(handler.requestcount, 1)
+        two.close()
+        assert one.makefile('rb').read().endswith(b"\r\n\r\nTest\n")
+        one.close()
+
+    def testmaxrequests(self):
+        self.config.set("protocols.http.HTTPProtocol", "keepalivemax", "2")
+        self.request("GET /testfile.txt HTTP/1.1\r\n")
+        self.handler.requestcount = 2
+        proto = HTTPProtocol("GET /testfile.txt HTTP/1.1\r\n",
+                             self.handler.server, self.handler,
+                             self.rfile, self.wfile, self.config)
+        proto.canhandlerequest()
+        proto.handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Connection'], 'close')
+
+    def testconditional(self):
+        self.request("GET /testfile.txt HTTP/1.1\r\n").handle()
+        status, headers, body = self.getresponse()
+        etag = headers['ETag']
+        assert etag.startswith('"')
+        self.assertEqual(headers['Cache-Control'], 'no-cache')
+        lastmodified = headers['Last-Modified']
+
+        self.request("GET /testfile.txt HTTP/1.1\r\n",
+                     b"If-None-Match: \"foo\", " + etag.encode() +
+                     b"\r\n\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(status, "HTTP/1.1 304 Not Modified")
+        self.assertEqual(headers['ETag'], etag)
+        assert not 'Content-Length' in headers
+        self.assertEqual(body, b"")
+        assert self.handler.keepalive
+
+        # If-None-Match wins over If-Modified-Since.
+        self.request("GET /testfile.txt HTTP/1.1\r\n",
+                     b"If-None-Match: \"foo\"\r\n" +
+                     b"If-Modified-Since: " + lastmodified.encode() +
+                     b"\r\n\r\n").handle()
+        self.assertEqual(self.getresponse()[2], b"Test\n")
+
+        self.request("GET /testfile.txt HTTP/1.1\r\n",
+                     b"If-Modified-Since: " + lastmodified.encode() +
+                     b"\r\n\r\n").handle()
+        self.assertEqual(self.getresponse()[0], "HTTP/1.1 304 Not Modified")
+        self.request("GET /testfile.txt HTTP/1.1\r\n",
+                     b"If-Modified-Since: Thu, 01 Jan 1970 00:00:00 GMT\r\n\r\n"
+                     ).handle()
+        self.assertEqual(self.getresponse()[2], b"Test\n")
+        self.request("GET /testfile.txt HTTP/1.1\r\n",
+                     b"If-Modified-Since: garbage\r\n\r\n").handle()
+        self.assertEqual(self.getresponse()[2], b"Test\n")
+
+        # Bodies without an ETag, such as templates', may change at any time.
+        proto = self.request("GET /testfile.txt HTTP/1.1\r\n",
+                             b"If-Modified-Since: " + lastmodified.encode() +
+                             b"\r\n\r\n")
+        assert not proto.isnotmodified(None, 0)
+
+    def testconditional_dir(self):
+        self.request("GET / HTTP/1.1\r\n").handle()
+        status, headers, body = self.getresponse()
+        etag = headers['ETag']
+        self.request("GET / HTTP/1.1\r\n",
+                     b"If-None-Match: " + etag.encode() + b"\r\n\r\n").handle()
+        self.assertEqual(self.getresponse()[0], "HTTP/1.1 304 Not Modified")
+        # The menu for another page differs.
+        self.request("GET /pygopherd HTTP/1.1\r\n",
+                     b"If-None-Match: " + etag.encode() + b"\r\n\r\n").handle()
+        self.assertEqual(self.getresponse()[0], "HTTP/1.1 200 OK")
+
+    def testconditional_icon(self):
+        self.request("GET /PYGOPHERD-HTTPPROTO-ICONS/text.gif HTTP/1.1\r\n"
+                     ).handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=604800')
+        self.assertEqual(headers['Last-Modified'],
+                         'Fri, 14 Dec 2001 21:19:47 GMT')
+        self.request("GET /PYGOPHERD-HTTPPROTO-ICONS/text.gif HTTP/1.1\r\n",
+                     b"If-None-Match: *\r\n\r\n").handle()
+        self.assertEqual(self.getresponse()[0], "HTTP/1.1 304 Not Modified")
+
+    def getrange(self, rangeheader, selector = "/testfile.txt", extra = b""):
+        self.request("GET %s HTTP/1.1\r\n" % selector,
+                     b"Range: " + rangeheader + b"\r\n" + extra + b"\r\n"
+                     ).handle()
+        return self.getresponse()
+
+    def testrange(self):
+        self.request("GET /testfile.txt HTTP/1.1\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        etag = headers['ETag']
+
+        for rangeheader, contentrange, expected in [
+                (b"bytes=1-2", "bytes 1-2/5", b"es"),
+                (b"bytes=3-", "bytes 3-4/5", b"t\n"),
+                (b"bytes=-2", "bytes 3-4/5", b"t\n"),
+                (b"bytes=-10", "bytes 0-4/5", b"Test\n"),
+                (b"bytes=2-100", "bytes 2-4/5", b"st\n"),
+                (b"bytes=0-1,1-2", "bytes 0-2/5", b"Tes")]:
+            status, headers, body = self.getrange(rangeheader)
+            self.assertEqual(status, "HTTP/1.1 206 Partial Content")
+            self.assertEqual(headers['Content-Range'], contentrange)
+            self.assertEqual(int(headers['Content-Length']), len(expected))
+            self.assertEqual(body, expected)
+
+        # Ranges that cannot be satisfied.
+        status, headers, body = self.getrange(b"bytes=5-")
+        self.assertEqual(status, "HTTP/1.1 416 Range Not Satisfiable")
+        self.assertEqual(headers['Content-Range'], 'bytes */5')
+
+        # Nonsense is ignored.
+        for rangeheader in [b"bytes=3-1", b"lines=1-2", b"bytes=a-b"]:
+            self.assertEqual(self.getrange(rangeheader)[2], b"Test\n")
+
+        # If-Range must match for the range to be sent.
+        status, headers, body = self.getrange(b"bytes=1-2", extra =
+                                              b"If-Range: " + etag.encode() +
+                                              b"\r\n")
+        self.assertEqual(body, b"es")
+        status, headers, body = self.getrange(b"bytes=1-2", extra =
+                                              b"If-Range: \"other\"\r\n")
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertEqual(body, b"Test\n")
+
+    def testmultirange(self):
+        status, headers, body = self.getrange(b"bytes=0-0, -1")
+        self.assertEqual(status, "HTTP/1.1 206 Partial Content")
+        contenttype, boundary = headers['Content-Type'].split("; boundary=")
+        self.assertEqual(contenttype, "multipart/byteranges")
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        boundary = boundary.encode()
+        self.assertEqual(body,
+            b"\r\n--" + boundary + b"\r\nContent-Type: text/plain\r\n" +
+            b"Content-Range: bytes 0-0/5\r\n\r\nT" +
+            b"\r\n--" + boundary + b"\r\nContent-Type: text/plain\r\n" +
+            b"Content-Range: bytes 4-4/5\r\n\r\n\n" +
+            b"\r\n--" + boundary + b"--\r\n")
+
+    def testrange_zip(self):
+        self.config.set("handlers.ZIP.ZIPHandler", "enabled", 'true')
+        handlerlist = self.config.get("handlers.HandlerMultiplexer",
+                                      "handlers").strip()
+        handlerlist = handlerlist[0] + 'ZIP.ZIPHandler, ' + handlerlist[1:]
+        self.config.set("handlers.HandlerMultiplexer", "handlers", handlerlist)
+        status, headers, body = self.getrange(b"bytes=3-",
+                                              "/testdata.zip/pygopherd/ziponly")
+        self.assertEqual(headers['Content-Range'], 'bytes 3-7/8')
+        self.assertEqual(body, b"only\n")
+
+    def testacceptedcodings(self):
+        for acceptencoding, expected in [
+                (b"gzip", ['gzip']),
+                (b"x-gzip, deflate", ['gzip', 'deflate']),
+                (b"gzip;q=0.5, deflate", ['deflate', 'gzip']),
+                (b"gzip;q=0, deflate;q=0.1", ['deflate']),
+                (b"identity", []),
+                (b"*", http.codings)]:
+            proto = self.request("GET / HTTP/1.1\r\n",
+                                 b"Accept-Encoding: " + acceptencoding +
+                                 b"\r\n\r\n")
+            proto.headerslurp()
+            self.assertEqual(proto.getacceptedcodings(), expected)
+
+        self.config.set("protocols.http.HTTPProtocol", "compress", "no")
+        settings.reset(self.config)
+        proto = self.request("GET / HTTP/1.1\r\n",
+                             b"Accept-Encoding: gzip\r\n\r\n")
+        proto.headerslurp()
+        self.assertEqual(proto.getacceptedcodings(), [])
+
+    def testcompress_dir(self):
+        self.request("GET / HTTP/1.1\r\n").handle()
+        status, headers, plain = self.getresponse()
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        assert not 'Content-Encoding' in headers
+        etag = headers['ETag']
+
+        for coding, decompress in [('gzip', gzip.decompress),
+                                   ('deflate', zlib.decompress)]:
+            self.request("GET / HTTP/1.1\r\n",
+                         b"Accept-Encoding: " + coding.encode() +
+                         b"\r\n\r\n").handle()
+            status, headers, body = self.getresponse()
+            self.assertEqual(headers['Content-Encoding'], coding)
+            self.assertEqual(headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(int(headers['Content-Length']), len(body))
+            assert headers['ETag'] != etag
+            self.assertEqual(decompress(body), plain)
+
+            self.request("GET / HTTP/1.1\r\n",
+                         b"Accept-Encoding: " + coding.encode() + b"\r\n" +
+                         b"If-None-Match: " + headers['ETag'].encode() +
+                         b"\r\n\r\n").handle()
+            self.assertEqual(self.getresponse()[0],
+                             "HTTP/1.1 304 Not Modified")
+
+    def testcompress_archive(self):
+        # Members alike in size and mtime must not share compressed bodies.
+        import tempfile, shutil, tarfile, os
+        from pygopherd.handlers import HandlerMultiplexer
+        root = tempfile.mkdtemp()
+        archive = tarfile.open(os.path.join(root, 'test.tar'), 'w')
+        members = [('a.txt', b"a" * 1000), ('b.txt', b"b" * 1000)]
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 1000000000
+            archive.addfile(info, BytesIO(data))
+        archive.close()
+        self.config.set("pygopherd", "root", root)
+        self.config.set("handlers.tar.TarHandler", "enabled", "true")
+        handlerlist = self.config.get("handlers.HandlerMultiplexer",
+                                      "handlers").strip()
+        handlerlist = handlerlist[0] + 'tar.TarHandler, ' + handlerlist[1:]
+        self.config.set("handlers.HandlerMultiplexer", "handlers", handlerlist)
+        settings.reset(self.config)
+        HandlerMultiplexer.handlers = None
+        etags = []
+        try:
+            for name, data in members:
+                self.request("GET /test.tar/%s HTTP/1.1\r\n" % name,
+                             b"Accept-Encoding: gzip\r\n\r\n").handle()
+                status, headers, body = self.getresponse()
+                self.assertEqual(headers['Content-Encoding'], 'gzip')
+                self.assertEqual(gzip.decompress(body), data)
+                etags.append(headers['ETag'])
+        finally:
+            HandlerMultiplexer.handlers = None
+            shutil.rmtree(root)
+        assert etags[0] != etags[1]
+
+    def testcompress_precompressed(self):
+        with open("testdata/testfile.txt.gz", "rb") as fd:
+            compressed = fd.read()
+        self.request("GET /testfile.txt HTTP/1.1\r\n",
+                     b"Accept-Encoding: gzip\r\n\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Content-Type'], 'text/plain')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(int(headers['Content-Length']), len(compressed))
+        assert not 'Accept-Ranges' in headers
+        self.assertEqual(body, compressed)
+
+        # Ranges are of the file as it is.
+        status, headers, body = self.getrange(b"bytes=1-2", extra =
+                                              b"Accept-Encoding: gzip\r\n")
+        assert not 'Content-Encoding' in headers
+        self.assertEqual(body, b"es")
+
+        # Files that Gopher clients get decompressed are sent as they are.
+        self.config.set("handlers.file.CompressedFileHandler",
+                        "decompressors", "{'gzip': 'zcat'}")
+        handlerlist = self.config.get("handlers.HandlerMultiplexer",
+                                      "handlers").strip()
+        handlerlist = handlerlist[0] + 'file.CompressedFileHandler, ' + \
+                      handlerlist[1:]
+        self.config.set("handlers.HandlerMultiplexer", "handlers", handlerlist)
+        settings.reset(self.config)
+        self.request("GET /testfile.txt.gz HTTP/1.1\r\n",
+                     b"Accept-Encoding: gzip\r\n\r\n").handle()
+        status, headers, body = self.getresponse()
+        self.assertEqual(headers['Content-Type'], 'text/plain')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(body, compressed)
@@ -1,6 +1,7 @@
 import unittest, re
 from pygopherd.protocols.rfc1436 import GopherProtocol
 from pygopherd import testutil
+from pygopherd.protocols import base
 from io import BytesIO
 
 class RFC1436TestCase(unittest.TestCase):
@@ -53,6 +54,22 @@ class RFC1436TestCase(unittest.TestCase):
         self.assertEqual(self.wfile.getvalue(), b"ZIPonly\n")
         self.config.set("handlers.ZIP.ZIPHandler", "enabled", "false")
 
+    def testhandle_file_tar(self):
+        self.config.set("handlers.tar.TarHandler", "enabled", 'true')
+        from pygopherd.handlers import HandlerMultiplexer
+        HandlerMultiplexer.handlers = None
+        handlerlist = self.config.get("handlers.HandlerMultiplexer", "handlers")
+        handlerlist = handlerlist.strip()
+        handlerlist = handlerlist[0] + 'tar.TarHandler, ' + handlerlist[1:]
+        self.config.set("handlers.HandlerMultiplexer", "handlers", handlerlist)
+        self.proto = GopherProtocol("/testarchive.tgz/testfile.txt\n",
+                                    self.server,
+                                    self.handler, self.rfile, self.wfile,
+                                    self.config)
+        self.proto.handle()
+        self.assertEqual(self.wfile.getvalue(), b"Test\n")
+        self.config.set("handlers.tar.TarHandler", "enabled", "false")
+
     def testhandle_dir_abstracts(self):
         proto = GopherProtocol("", self.server, self.handler, self.rfile,
                                self.wfile, self.config)
@@ -110,3 +127,31 @@ class RFC1436TestCase(unittest.TestCase):
         for i in range(len(actualarr)):
             self.assertEqual(actualarr[i], expectedarr[i])
 
+
+    def testhandle_dir_menucache(self):
+        base.menucache = None
+        proto = GopherProtocol("/pygopherd", self.server, self.handler,
+                               self.rfile, self.wfile, self.config)
+        proto.handle()
+        menu = self.wfile.getvalue()
+        assert menu.startswith(b"0pipetest")
+        stats = base.menucache.getstats()
+        self.assertEqual((stats['hits'], stats['entries']), (0, 1))
+        self.assertEqual(stats['bytes'], len(menu))
+
+        wfile = BytesIO()
+        proto = GopherProtocol("/pygopherd/", self.server, self.handler,
+                               self.rfile, wfile, self.config)
+        proto.handle()
+        self.assertEqual(wfile.getvalue(), menu)
+        self.assertEqual(base.menucache.getstats()['hits'], 1)
+
+        # Menus for other ports are rendered separately.
+        self.server.server_port += 1
+        wfile = BytesIO()
+        proto = GopherProtocol("/pygopherd", self.server, self.handler,
+                               self.rfile, wfile, self.config)
+        proto.handle()
+        self.server.server_port -= 1
+        assert wfile.getvalue() != menu
+        self.assertEqual(base.menucache.getstats()['entries'], 2)
@@ -17,9 +17,10 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from .http import HTTPProtocol
-from io import StringIO
-import cgi, re
+from .http import HTTPProtocol, escape
+from io import BytesIO
+import re
+from pygopherd import settings
 
 accesskeys = '1234567890#*'
 wmlheader = """<?xml version="1.0"?>
@@ -35,8 +36,7 @@ class WAPProtocol(HTTPProtocol):
         if not ishttp:
             return 0
 
-        waptop = self.config.get("protocols.wap.WAPProtocol",
-                                 "waptop")
+        waptop = settings.get(self.config).waptop
         self.waptop = waptop
         if self.requestparts[1].startswith(waptop):
             # If it starts with waptop, *guaranteed* to be wap.
@@ -85,9 +85,9 @@ class WAPProtocol(HTTPProtocol):
             else:
                 retstr += '<a href="%s">' % url
         if entry.getname() != None:
-            thisname = cgi.escape(entry.getname())
+            thisname = escape(entry.getname())
         else:
-            thisname = cgi.escape(entry.getselector())
+            thisname = escape(entry.getselector())
         retstr += thisname
         if not entry.gettype() in ['i', '7']:
             retstr += '</a>'
@@ -115,46 +115,59 @@ class WAPProtocol(HTTPProtocol):
         retval = wmlheader
         title = 'Gopher'
         if self.entry.getname():
-            title = cgi.escape(self.entry.getname())
+            title = escape(self.entry.getname())
         retval += '<card id="index" title="%s" newcontext="true">' % \
-                  cgi.escape(title)
+                  escape(title)
         
         retval += "\n<p>\n"
-        retval += "<b>%s</b><br/>\n" % cgi.escape(title)
+        retval += "<b>%s</b><br/>\n" % escape(title)
         return retval
 
     def renderdirend(self, entry):
         return "</p>\n</card>\n</wml>\n"
     
+    def getcontentlength(self):
+        if self.needsconversion:
+            return None
+        return HTTPProtocol.getcontentlength(self)
+
+    def encodebody(self, mimetype, data, etag):
+        if self.needsconversion:
+            # Copies compressed ahead of time are not of the WML.
+            self.precompressed = None
+            return (None, data, etag)
+        return HTTPProtocol.encodebody(self, mimetype, data, etag)
+
     def handlerwrite(self, wfile):
         global wmlheader
         if not self.needsconversion:
-            self.handler.write(wfile)
+            HTTPProtocol.handlerwrite(self, wfile)
             return
-        fakefile = StringIO()
+        fakefile = BytesIO()
         self.handler.write(fakefile)
         fakefile.seek(0)
-        wfile.write(wmlheader)
-        wfile.write('<card id="index" title="Text File" newcontext="true">\n')
-        wfile.write('<p>\n')
-        while 1:
-            line = fakefile.readline()
-            if not len(line):
-                break
-            line = line.rstrip()
+        out = [wmlheader,
+               '<card id="index" title="Text File" newcontext="true">\n',
+               '<p>\n']
+        for line in fakefile:
+            line = line.decode(encoding = 'cp437').rstrip()
             if len(line):
-                wfile.write(cgi.escape(line) + "\n")
+                out.append(escape(line) + "\n")
             else:
-                wfile.write("</p>\n<p>")
-        wfile.write('</p>\n</card>\n</wml>\n')
-        
+                out.append("</p>\n<p>")
+        out.append('</p>\n</card>\n</wml>\n')
+        wfile.write("".join(out).encode(encoding = 'cp437'))
+
     def filenotfound(self, msg):
-        wfile = self.wfile
-        wfile.write("HTTP/1.0 200 Not Found\r\n")
-        wfile.write("Content-Type: text/vnd.wap.wml\r\n\r\n")
-        wfile.write(wmlheader)
-        wfile.write('<card id="index" title="404 Error" newcontext="true">\n')
-        wfile.write('<p><b>Gopher Error</b></p><p>\n')
-        wfile.write(cgi.escape(msg)+ "\n")
-        wfile.write('</p>\n</card>\n</wml>\n')
-    
+        if self.headerssent:
+            self.requesthandler.keepalive = 0
+            return
+        body = wmlheader
+        body += '<card id="index" title="404 Error" newcontext="true">\n'
+        body += '<p><b>Gopher Error</b></p><p>\n'
+        body += escape(msg) + "\n"
+        body += '</p>\n</card>\n</wml>\n'
+        # WAP browsers show the page only with a 200.
+        self.writeresponse("200 Not Found",
+                           [("Content-Type", "text/vnd.wap.wml")],
+                           body.encode(encoding = 'cp437'))
@@ -0,0 +1,393 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: additional server types
+# Copyright (C) 2002-2019 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import socketserver, socket, os, errno, io, re, asyncio, threading, queue
+import concurrent.futures
+from pygopherd import logger
+
+# Matches the start of an HTTP request line.
+httprequestpatt = re.compile(rb'^[A-Z]+ [^ ]+ HTTP/')
+
+def getoption(config, section, option, default):
+    """Reads an optional setting for a server type.  config may be None
+    when a server is instantiated outside of getserverobject."""
+    if config is None or not config.has_option(section, option):
+        return default
+    return config.get(section, option)
+
+###########################################################################
+# Pre-forking server
+###########################################################################
+
+class PreforkServer(socketserver.TCPServer):
+    """Starts a fixed number of long-lived worker processes, each of
+    which accepts and handles connections itself.  Since a worker
+    lives for many requests, the per-process caches (directory listings,
+    handler lookups, MIME tables, and so on) stay warm between requests.
+
+    Where the OS supports SO_REUSEPORT, every worker gets a listening
+    socket of its own and the kernel spreads new connections across
+    them.  Otherwise, all workers accept from the one shared socket.
+
+    All listening sockets are created at bind time, before we drop
+    privileges, so that a recycled worker can reuse its slot's socket
+    even on a privileged port."""
+
+    # Set by initialization.getserverobject.
+    config = None
+
+    def getoption(self, option, default):
+        return getoption(self.config, "servers.PreforkServer", option, default)
+
+    def getworkercount(self):
+        workers = int(self.getoption("workers", 0))
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        return workers
+
+    def usereuseport(self):
+        return hasattr(socket, 'SO_REUSEPORT') and \
+               self.getoption("reuseport", "yes").lower() in \
+               ['1', 'yes', 'true', 'on']
+
+    def server_bind(self):
+        if self.usereuseport():
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        socketserver.TCPServer.server_bind(self)
+
+    def server_activate(self):
+        socketserver.TCPServer.server_activate(self)
+        self.listeners = [self.socket]
+        if not self.usereuseport():
+            return
+        address = self.socket.getsockname()
+        for i in range(1, self.getworkercount()):
+            sock = socket.socket(self.address_family, self.socket_type)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            # Carry over any timeouts set up on the original socket.
+            for option in [socket.SO_RCVTIMEO, socket.SO_SNDTIMEO]:
+                sock.setsockopt(socket.SOL_SOCKET, option,
+                                self.socket.getsockopt(socket.SOL_SOCKET,
+                                                       option, 16))
+            sock.bind(address)
+            sock.listen(self.request_queue_size)
+            self.listeners.append(sock)
+
+    def server_close(self):
+        for sock in getattr(self, 'listeners', [self.socket]):
+            sock.close()
+
+    def serve_forever(self, poll_interval = 0.5):
+        """Starts the workers, then sits in the master process replacing
+        any worker that exits."""
+        self.workerpids = {}
+        for slot in range(self.getworkercount()):
+            self.spawnworker(slot)
+
+        while 1:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                return
+            if pid in self.workerpids:
+                self.spawnworker(self.workerpids.pop(pid))
+
+    def spawnworker(self, slot):
+        pid = os.fork()
+        if pid:
+            self.workerpids[pid] = slot
+            return
+        try:
+            self.socket = self.listeners[slot % len(self.listeners)]
+            for sock in self.listeners:
+                if sock is not self.socket:
+                    sock.close()
+            self.listeners = [self.socket]
+            self.runworker()
+        finally:
+            os._exit(0)
+
+    def runworker(self):
+        """The body of a worker process.  Handles requests until
+        maxrequests have been served (if set), then returns so that the
+        master can start a fresh worker in its place."""
+        maxrequests = int(self.getoption("maxrequests", 0))
+        handled = 0
+        while maxrequests < 1 or handled < maxrequests:
+            try:
+                self.handle_request()
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            handled += 1
+        logger.log("Worker %d recycling after %d requests" % \
+                   (os.getpid(), handled))
+
+###########################################################################
+# Bounded thread pool server
+###########################################################################
+
+class ThreadPoolServer(socketserver.TCPServer):
+    """Handles connections with a fixed pool of threads fed from a
+    bounded queue of accepted connections.  When the queue is full, new
+    connections are turned away at once with a short "server busy"
+    error (a 503 for HTTP clients) rather than letting the backlog, and
+    the latency, grow without limit.
+
+    getstats returns the queue depth, rejection and utilisation
+    counters."""
+
+    # Set by initialization.getserverobject.
+    config = None
+
+    gopherbusy = b"3Server busy; please try again later\t\terror.host\t1\r\n"
+    httpbusy = b"HTTP/1.0 503 Service Unavailable\r\n" \
+               b"Retry-After: 5\r\n" \
+               b"Content-Type: text/plain\r\n\r\n" \
+               b"Server busy; please try again later\n"
+
+    def getoption(self, option, default):
+        return getoption(self.config, "servers.ThreadPoolServer", option,
+                         default)
+
+    def server_activate(self):
+        socketserver.TCPServer.server_activate(self)
+        self.threadcount = int(self.getoption("threads", 32))
+        self.queue = queue.Queue(int(self.getoption("queuesize", 64)))
+        self.workers = []
+        self.statslock = threading.Lock()
+        self.busy = 0
+        self.handled = 0
+        self.rejected = 0
+
+    def startworkers(self):
+        # Done on first use rather than at activation time, since
+        # threads do not survive the fork when the server detaches.
+        for i in range(self.threadcount):
+            worker = threading.Thread(target = self.workerloop, daemon = True)
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self, request, client_address):
+        if not self.workers:
+            self.startworkers()
+        try:
+            self.queue.put_nowait((request, client_address))
+        except queue.Full:
+            with self.statslock:
+                self.rejected += 1
+            self.reject(request, client_address)
+            self.shutdown_request(request)
+
+    def reject(self, request, client_address):
+        """Sends the busy message.  We only peek at what the client has
+        sent so far; we never wait for it."""
+        message = self.gopherbusy
+        try:
+            start = request.recv(64, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+            if httprequestpatt.match(start):
+                message = self.httpbusy
+        except OSError:
+            pass
+        logger.log("%s [%s/None] server busy; connection rejected" % \
+                   (client_address[0], type(self).__name__))
+        try:
+            request.sendall(message)
+        except OSError:
+            pass
+
+    def workerloop(self):
+        while 1:
+            request, client_address = self.queue.get()
+            if request is None:
+                return
+            with self.statslock:
+                self.busy += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.statslock:
+                    self.busy -= 1
+                    self.handled += 1
+
+    def getstats(self):
+        """Returns a dictionary of counters: connections waiting in the
+        queue and its capacity, threads busy and in total, their
+        utilisation as a fraction, and the totals handled and
+        rejected."""
+        with self.statslock:
+            return {'queued': self.queue.qsize(),
+                    'queuesize': self.queue.maxsize,
+                    'busy': self.busy,
+                    'threads': self.threadcount,
+                    'utilisation': float(self.busy) / self.threadcount,
+                    'handled': self.handled,
+                    'rejected': self.rejected}
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        for worker in self.workers:
+            self.queue.put((None, None))
+        self.workers = []
+
+###########################################################################
+# asyncio event-loop server
+###########################################################################
+
+class PrefixedSocketReader(io.RawIOBase):
+    """Raw reader that first hands back the data the event loop already
+    read from the socket, then reads from the socket itself."""
+    def __init__(self, prefix, sock):
+        self.prefix = prefix
+        self.sock = sock
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        if self.prefix:
+            count = min(len(buf), len(self.prefix))
+            buf[:count] = self.prefix[:count]
+            self.prefix = self.prefix[count:]
+            return count
+        try:
+            return self.sock.recv_into(buf)
+        except BlockingIOError:
+            return None
+
+class AsyncioServer(socketserver.TCPServer):
+    """Accepts connections and reads requests on an asyncio event loop,
+    so that there is no thread or process per client.  Once a complete
+    request has arrived (the request line, plus the headers for HTTP),
+    the protocol is picked on the loop and its handle method -- where
+    the blocking handler work happens -- is run in a bounded thread pool.
+    Idle or slow clients therefore cost only a socket apiece."""
+
+    # Set by initialization.getserverobject.
+    config = None
+
+    def getoption(self, option, default):
+        return getoption(self.config, "servers.AsyncioServer", option, default)
+
+    def getrequesttimeout(self):
+        if self.config is not None and \
+           self.config.has_option('pygopherd', 'timeout'):
+            return self.config.getint('pygopherd', 'timeout')
+        return None
+
+    def serve_forever(self, poll_interval = 0.5):
+        asyncio.run(self.serveloop())
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def serveloop(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.connections = set()
+        self.maxrequestsize = int(self.getoption("maxrequestsize", 16384))
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            int(self.getoption("threads", 32)))
+        self.socket.setblocking(False)
+        accepter = self.loop.create_task(self.acceptloop())
+        try:
+            await self.stopping.wait()
+        finally:
+            accepter.cancel()
+            self.executor.shutdown(wait = False)
+
+    async def acceptloop(self):
+        while 1:
+            try:
+                sock, address = await self.loop.sock_accept(self.socket)
+            except OSError as e:
+                # Probably out of file descriptors; back off for a moment.
+                logger.log("AsyncioServer: accept failed: %s" % str(e))
+                await asyncio.sleep(0.1)
+                continue
+            task = self.loop.create_task(self.handleconnection(sock, address))
+            self.connections.add(task)
+            task.add_done_callback(self.connections.discard)
+
+    async def readrequest(self, sock):
+        """Reads until we have a full request line -- and for HTTP, the
+        blank line ending the headers -- or the peer closes, or we hit
+        maxrequestsize."""
+        data = b''
+        while len(data) < self.maxrequestsize:
+            chunk = await self.loop.sock_recv(sock, 4096)
+            if not chunk:
+                break
+            data += chunk
+            eol = data.find(b'\n')
+            if eol == -1:
+                continue
+            if not httprequestpatt.match(data[:eol]):
+                break
+            if data.find(b'\n\r\n', eol) != -1 or \
+               data.find(b'\n\n', eol) != -1:
+                break
+        return data
+
+    async def handleconnection(self, sock, address):
+        try:
+            sock.setblocking(False)
+            try:
+                data = await asyncio.wait_for(self.readrequest(sock),
+                                              self.getrequesttimeout())
+            except asyncio.TimeoutError:
+                return
+            if not data:
+                return
+            eol = data.find(b'\n') + 1 or len(data)
+            handler = self.makehandler(sock, address, data[eol:])
+            protohandler = handler.getprotocol(data[:eol])
+            await self.loop.run_in_executor(self.executor, self.runhandler,
+                                            handler, protohandler)
+        except Exception:
+            self.handle_error(sock, address)
+        finally:
+            self.shutdown_request(sock)
+
+    def makehandler(self, sock, address, rest):
+        """Builds a request handler around a connection whose request
+        line we have already read, without running it."""
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = sock
+        handler.client_address = address
+        handler.server = self
+        # Only one request is read per connection here.
+        handler.cankeepalive = 0
+        handler.setup()
+        handler.rfile.close()
+        handler.rfile = io.BufferedReader(PrefixedSocketReader(rest, sock))
+        return handler
+
+    def runhandler(self, handler, protohandler):
+        """Runs in the thread pool."""
+        # Back to blocking mode, so that the socket timeouts apply again.
+        handler.connection.setblocking(True)
+        try:
+            handler.handleprotocol(protohandler)
+        finally:
+            handler.finish()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of additional server types
+# COPYRIGHT #
+# Copyright (C) 2002-2019 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, socketserver, socket, threading, time
+from pygopherd import servers, initialization, testutil
+
+class EchoHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(self.rfile.readline())
+
+def talk(address, data):
+    sock = socket.create_connection(address)
+    sock.sendall(data)
+    result = sock.makefile('rb').read()
+    sock.close()
+    return result
+
+class PreforkServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+        self.logfile = testutil.getstringlogger()
+        self.config.set("servers.PreforkServer", "workers", "3")
+
+    def getserver(self):
+        servers.PreforkServer.config = self.config
+        try:
+            return servers.PreforkServer(('127.0.0.1', 0), EchoHandler)
+        finally:
+            servers.PreforkServer.config = None
+
+    def testgetserverobject(self):
+        self.config.set("pygopherd", "servertype", "PreforkServer")
+        self.config.set("pygopherd", "port", "22271")
+        s = initialization.getserverobject(self.config)
+        assert isinstance(s, servers.PreforkServer)
+        s.server_close()
+
+    def testlisteners(self):
+        s = self.getserver()
+        self.assertEqual(len(s.listeners), 3)
+        address = s.socket.getsockname()
+        for sock in s.listeners:
+            self.assertEqual(sock.getsockname(), address)
+            assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT)
+        s.server_close()
+
+    def testnoreuseport(self):
+        self.config.set("servers.PreforkServer", "reuseport", "no")
+        s = self.getserver()
+        self.assertEqual(s.listeners, [s.socket])
+        s.server_close()
+
+    def testrunworker_recycle(self):
+        self.config.set("servers.PreforkServer", "reuseport", "no")
+        self.config.set("servers.PreforkServer", "maxrequests", "2")
+        s = self.getserver()
+        s.config = self.config
+        worker = threading.Thread(target = s.runworker)
+        worker.start()
+        address = s.socket.getsockname()
+        self.assertEqual(talk(address, b"one\n"), b"one\n")
+        self.assertEqual(talk(address, b"two\n"), b"two\n")
+        worker.join(5)
+        assert not worker.is_alive()
+        assert self.logfile.getvalue().endswith("after 2 requests\n")
+        s.server_close()
+
+class AsyncioServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+        self.logfile = testutil.getstringlogger()
+        self.config.set("pygopherd", "servertype", "AsyncioServer")
+        self.config.set("pygopherd", "port", "0")
+        self.config.set("servers.AsyncioServer", "threads", "2")
+        self.server = initialization.getserverobject(self.config)
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.start()
+        while not hasattr(self.server, 'connections'):
+            time.sleep(0.01)
+        self.address = self.server.socket.getsockname()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join(5)
+        self.server.server_close()
+
+    def testgopher(self):
+        self.assertEqual(talk(self.address, b"/testfile.txt\r\n"), b"Test\n")
+
+    def testslowclient(self):
+        sock = socket.create_connection(self.address)
+        sock.sendall(b"/testfile")
+        # An idle client must not hold up the others.
+        self.assertEqual(talk(self.address, b"/testfile.txt\r\n"), b"Test\n")
+        sock.sendall(b".txt\r\n")
+        self.assertEqual(sock.makefile('rb').read(), b"Test\n")
+        sock.close()
+
+    def testnotfound(self):
+        result = talk(self.address, b"/NONEXISTANT\r\n")
+        assert result.startswith(b"3'/NONEXISTANT' does not exist")
+
+class BlockingHandler(socketserver.StreamRequestHandler):
+    release = threading.Event()
+    def handle(self):
+        self.release.wait(5)
+        self.wfile.write(b"done\n")
+
+class ThreadPoolServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+        self.logfile = testutil.getstringlogger()
+        self.config.set("servers.ThreadPoolServer", "threads", "1")
+        self.config.set("servers.ThreadPoolServer", "queuesize", "1")
+        servers.ThreadPoolServer.config = self.config
+        try:
+            self.server = servers.ThreadPoolServer(('127.0.0.1', 0),
+                                                   BlockingHandler)
+        finally:
+            servers.ThreadPoolServer.config = None
+        self.address = self.server.socket.getsockname()
+        BlockingHandler.release.clear()
+
+    def tearDown(self):
+        BlockingHandler.release.set()
+        self.server.server_close()
+
+    def connect(self, data = b""):
+        sock = socket.create_connection(self.address)
+        if data:
+            sock.sendall(data)
+        self.server.handle_request()
+        return sock
+
+    def testloadshedding(self):
+        first = self.connect(b"/\r\n")
+        while self.server.getstats()['busy'] != 1:
+            time.sleep(0.01)
+        second = self.connect(b"/\r\n")
+        self.assertEqual(self.server.getstats()['queued'], 1)
+
+        # Pool and queue are both full; these are turned away at once.
+        sock = self.connect(b"GET / HTTP/1.0\r\n\r\n")
+        result = sock.makefile('rb').read()
+        assert result.startswith(b"HTTP/1.0 503 Service Unavailable\r\n")
+        sock.close()
+        sock = self.connect()
+        result = sock.makefile('rb').read()
+        assert result.startswith(b"3Server busy")
+        sock.close()
+
+        BlockingHandler.release.set()
+        for sock in [first, second]:
+            self.assertEqual(sock.makefile('rb').read(), b"done\n")
+            sock.close()
+        stats = self.server.getstats()
+        self.assertEqual(stats['rejected'], 2)
+        self.assertEqual(stats['threads'], 1)
+        self.assertEqual(stats['queuesize'], 1)
+        assert "connection rejected" in self.logfile.getvalue()
@@ -0,0 +1,234 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: precompiled settings
+# Copyright (C) 2002-2019 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+import re, types
+
+class Settings:
+    """A read-only copy of the configuration with everything that the
+    protocols and handlers need per request already evaluated: class
+    lists resolved, regular expressions compiled and mappings built.
+
+    Attributes cannot be changed once the object is built.  Use get()
+    rather than creating these directly."""
+
+    def __init__(self, config):
+        # Imported here since both multiplexers import us.
+        from pygopherd.protocols import ProtocolMultiplexer
+        from pygopherd.handlers import HandlerMultiplexer
+
+        self.root = config.get("pygopherd", "root")
+        self.abstractentries = config.get("pygopherd", "abstract_entries")
+        self.abstractheaders = config.getboolean("pygopherd",
+                                                 "abstract_headers")
+
+        # The class lists are evaluated in the namespace of their
+        # multiplexers, as they always have been.
+        self.protocols = tuple(eval(config.get("protocols.ProtocolMultiplexer",
+                                               "protocols"),
+                                    vars(ProtocolMultiplexer)))
+        self.handlers = tuple(eval(config.get("handlers.HandlerMultiplexer",
+                                              "handlers"),
+                                   vars(HandlerMultiplexer)))
+
+        self.handlercachesize = 4096
+        if config.has_option("handlers.HandlerMultiplexer", "cachesize"):
+            self.handlercachesize = config.getint("handlers.HandlerMultiplexer",
+                                                  "cachesize")
+        self.negativecachesize = 4096
+        if config.has_option("handlers.HandlerMultiplexer", "negativecachesize"):
+            self.negativecachesize = \
+                config.getint("handlers.HandlerMultiplexer", "negativecachesize")
+        self.negativecachetime = 60
+        if config.has_option("handlers.HandlerMultiplexer", "negativecachetime"):
+            self.negativecachetime = \
+                config.getint("handlers.HandlerMultiplexer", "negativecachetime")
+
+        self.vfscachesize = 10000
+        if config.has_option("handlers.base.VFS_Cached", "cachesize"):
+            self.vfscachesize = config.getint("handlers.base.VFS_Cached",
+                                              "cachesize")
+        self.vfscachetime = 0
+        if config.has_option("handlers.base.VFS_Cached", "cachetime"):
+            self.vfscachetime = config.getint("handlers.base.VFS_Cached",
+                                              "cachetime")
+
+        self.outputbuffersize = 65536
+        if config.has_option("output.SocketWriter", "buffersize"):
+            self.outputbuffersize = config.getint("output.SocketWriter",
+                                                  "buffersize")
+        self.outputcork = 1
+        if config.has_option("output.SocketWriter", "cork"):
+            self.outputcork = config.getboolean("output.SocketWriter", "cork")
+        self.outputnodelay = 1
+        if config.has_option("output.SocketWriter", "nodelay"):
+            self.outputnodelay = config.getboolean("output.SocketWriter",
+                                                   "nodelay")
+
+        self.defaultmimetype = config.get("GopherEntry", "defaultmimetype")
+        self.mapping = tuple([(re.compile(mimepatt), gophertype) for \
+                              mimepatt, gophertype in \
+                              eval(config.get("GopherEntry", "mapping"))])
+        self.eaexts = tuple(eval(config.get("GopherEntry", "eaexts")).items())
+
+        self.decompressors = types.MappingProxyType(
+            eval(config.get("handlers.file.CompressedFileHandler",
+                            "decompressors")))
+        self.decompresspatt = re.compile(
+            config.get("handlers.file.CompressedFileHandler", "decompresspatt"))
+        self.decompresscachesize = 4194304
+        if config.has_option("handlers.file.CompressedFileHandler",
+                             "cachesize"):
+            self.decompresscachesize = \
+                config.getint("handlers.file.CompressedFileHandler",
+                              "cachesize")
+        self.decompresscachefilesize = 262144
+        if config.has_option("handlers.file.CompressedFileHandler",
+                             "cachefilesize"):
+            self.decompresscachefilesize = \
+                config.getint("handlers.file.CompressedFileHandler",
+                              "cachefilesize")
+
+        self.ignorepatt = re.compile(config.get("handlers.dir.DirHandler",
+                                                "ignorepatt"))
+        self.dircachetime = config.getint("handlers.dir.DirHandler",
+                                          "cachetime")
+        self.dircachesize = 16777216
+        if config.has_option("handlers.dir.DirHandler", "cachesize"):
+            self.dircachesize = config.getint("handlers.dir.DirHandler",
+                                              "cachesize")
+        self.dircachedir = None
+        if config.has_option("handlers.dir.DirHandler", "cachedir"):
+            self.dircachedir = config.get("handlers.dir.DirHandler",
+                                          "cachedir")
+
+        self.extstrip = config.get("handlers.UMN.UMNDirHandler", "extstrip")
+
+        self.zipenabled = config.getboolean("handlers.ZIP.ZIPHandler",
+                                            "enabled")
+        self.zippattern = re.compile(config.get("handlers.ZIP.ZIPHandler",
+                                                "pattern"))
+        self.zipcachedir = None
+        if config.has_option("handlers.ZIP.ZIPHandler", "cachedir"):
+            self.zipcachedir = config.get("handlers.ZIP.ZIPHandler",
+                                          "cachedir")
+        self.zippoolsize = 32
+        if config.has_option("handlers.ZIP.ZIPHandler", "poolsize"):
+            self.zippoolsize = config.getint("handlers.ZIP.ZIPHandler",
+                                             "poolsize")
+
+        self.tarenabled = 0
+        if config.has_option("handlers.tar.TarHandler", "enabled"):
+            self.tarenabled = config.getboolean("handlers.tar.TarHandler",
+                                                "enabled")
+        tarpattern = r'\.(tar|tar\.gz|tgz)$'
+        if config.has_option("handlers.tar.TarHandler", "pattern"):
+            tarpattern = config.get("handlers.tar.TarHandler", "pattern")
+        self.tarpattern = re.compile(tarpattern)
+        self.tarpoolsize = 32
+        if config.has_option("handlers.tar.TarHandler", "poolsize"):
+            self.tarpoolsize = config.getint("handlers.tar.TarHandler",
+                                             "poolsize")
+
+        self.allowpythonpath = 1
+        if config.has_option("handlers.tal.TALFileHandler", "allowpythonpath"):
+            self.allowpythonpath = \
+                config.getboolean("handlers.tal.TALFileHandler",
+                                  "allowpythonpath")
+
+        self.menucachesize = 8388608
+        if config.has_option("protocols.base.BaseGopherProtocol",
+                             "menucachesize"):
+            self.menucachesize = \
+                config.getint("protocols.base.BaseGopherProtocol",
+                              "menucachesize")
+
+        self.gopherplusadmin = config.get("protocols.gopherp.GopherPlusProtocol",
+                                          "admin")
+
+        self.iconmapping = types.MappingProxyType(
+            eval(config.get("protocols.http.HTTPProtocol", "iconmapping")))
+        self.pagetopper = None
+        if config.has_option("protocols.http.HTTPProtocol", "pagetopper"):
+            self.pagetopper = config.get("protocols.http.HTTPProtocol",
+                                         "pagetopper")
+
+        self.httpcachecontrol = ()
+        if config.has_option("protocols.http.HTTPProtocol", "cachecontrol"):
+            self.httpcachecontrol = tuple(
+                [(re.compile(pattern), value) for pattern, value in \
+                 eval(config.get("protocols.http.HTTPProtocol",
+                                 "cachecontrol"))])
+
+        self.httpkeepalivetimeout = 15
+        if config.has_option("protocols.http.HTTPProtocol", "keepalivetimeout"):
+            self.httpkeepalivetimeout = \
+                config.getint("protocols.http.HTTPProtocol", "keepalivetimeout")
+        self.httpkeepalivemax = 100
+        if config.has_option("protocols.http.HTTPProtocol", "keepalivemax"):
+            self.httpkeepalivemax = \
+                config.getint("protocols.http.HTTPProtocol", "keepalivemax")
+
+        self.httpcompress = 1
+        if config.has_option("protocols.http.HTTPProtocol", "compress"):
+            self.httpcompress = \
+                config.getboolean("protocols.http.HTTPProtocol", "compress")
+        self.httpcompresstypes = re.compile(
+            r'^text/|^application/(json|javascript|xml)|\+xml$')
+        if config.has_option("protocols.http.HTTPProtocol", "compresstypes"):
+            self.httpcompresstypes = re.compile(
+                config.get("protocols.http.HTTPProtocol", "compresstypes"))
+        self.httpcompressmaxsize = 1048576
+        if config.has_option("protocols.http.HTTPProtocol", "compressmaxsize"):
+            self.httpcompressmaxsize = \
+                config.getint("protocols.http.HTTPProtocol", "compressmaxsize")
+        self.httpcompresscachesize = 8388608
+        if config.has_option("protocols.http.HTTPProtocol",
+                             "compresscachesize"):
+            self.httpcompresscachesize = \
+                config.getint("protocols.http.HTTPProtocol",
+                              "compresscachesize")
+
+        self.waptop = config.get("protocols.wap.WAPProtocol", "waptop")
+
+        self.frozen = 1
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', 0):
+            raise AttributeError("Settings are read-only")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("Settings are read-only")
+
+def get(config):
+    """Returns the Settings for config, compiling them on first use.
+    The result is kept on the config object itself, so changes made to
+    config after that point are not seen; call reset() if you must."""
+    try:
+        return config.pygopherd_settings
+    except AttributeError:
+        config.pygopherd_settings = Settings(config)
+        return config.pygopherd_settings
+
+def reset(config):
+    """Discards any Settings compiled for config."""
+    try:
+        del config.pygopherd_settings
+    except AttributeError:
+        pass
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of precompiled settings
+# COPYRIGHT #
+# Copyright (C) 2002-2019 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+
+import unittest
+from pygopherd import settings, testutil
+from pygopherd.handlers import file, UMN
+from pygopherd.protocols import rfc1436
+
+class SettingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+
+    def testcompiled(self):
+        s = settings.get(self.config)
+        assert file.FileHandler in s.handlers
+        assert UMN.UMNDirHandler in s.handlers
+        self.assertEqual(s.protocols[-1], rfc1436.GopherProtocol)
+        assert s.ignorepatt.search('/foo/gophermap')
+        assert not s.ignorepatt.search('/foo/bar.txt')
+        self.assertEqual(s.iconmapping['1'], 'folder.gif')
+        self.assertEqual(s.eaexts[0], ('.abstract', 'ABSTRACT'))
+
+    def testreadonly(self):
+        s = settings.get(self.config)
+        self.assertRaises(AttributeError, setattr, s, 'waptop', '/foo')
+        def setmapping():
+            s.iconmapping['0'] = 'x'
+        self.assertRaises(TypeError, setmapping)
+        self.assertEqual(s.waptop, '/wap')
+
+    def testget(self):
+        s = settings.get(self.config)
+        self.config.set("protocols.wap.WAPProtocol", "waptop", "/mobile")
+        assert settings.get(self.config) is s
+        settings.reset(self.config)
+        self.assertEqual(settings.get(self.config).waptop, "/mobile")
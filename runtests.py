@@ -27,20 +27,36 @@ import pygopherd.protocols
 import pygopherd.protocols.ProtocolMultiplexerTest
 import pygopherd.protocols.baseTest
 import pygopherd.protocols.rfc1436Test
+import pygopherd.protocols.httpTest
 import pygopherd.protocols
+import pygopherd.handlers.HandlerMultiplexerTest
+import pygopherd.handlers.baseTest
+import pygopherd.handlers.dirTest
+import pygopherd.handlers.fileTest
 import pygopherd.handlers.ZIP
+import pygopherd.handlers.tar
 
 def suite():
     tests = [initializationTest,
+             cacheTest,
              GopherExceptionsTest,
              fileextTest,
              gopherentryTest,
              loggerTest,
+             outputTest,
              pipeTest,
+             serversTest,
+             settingsTest,
              pygopherd.protocols.ProtocolMultiplexerTest,
              pygopherd.protocols.baseTest,
              pygopherd.protocols.rfc1436Test,
-	     pygopherd.handlers.ZIP
+             pygopherd.protocols.httpTest,
+             pygopherd.handlers.HandlerMultiplexerTest,
+             pygopherd.handlers.baseTest,
+             pygopherd.handlers.dirTest,
+             pygopherd.handlers.fileTest,
+	     pygopherd.handlers.ZIP,
+	     pygopherd.handlers.tar
         ]
     suite = unittest.TestSuite()
     for module in tests: